@@ -0,0 +1,203 @@
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import metrics
+import reports
+
+# ==================== Materialized views ====================
+
+class MaterializedView:
+    """Derived state kept in step with collection changes.
+
+    The view registers as a listener on its source collections. It is built
+    from scratch on first use (and again after a collection is reloaded from
+    disk), and from then on every change is folded in incrementally by
+    `apply`. A build that races with a change is retried, so the installed
+    state always matches the collections.
+
+    Subclasses implement `build()` (returns a fresh state from the store) and
+    `apply(state, collection, old, new)`.
+    """
+
+    SOURCES: Tuple[str, ...] = ()
+
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.state = None
+        self._generation = 0
+        for name in self.SOURCES:
+            store[name].listeners.append(self)
+
+    # ---- listener protocol ----
+
+    def changed(self, collection: str, old: Optional[dict], new: Optional[dict]):
+        with self.lock:
+            self._generation += 1
+            if self.state is not None:
+                self.apply(self.state, collection, old, new)
+
+    def reset(self, collection: str):
+        with self.lock:
+            self._generation += 1
+            self.state = None
+
+    # ---- building ----
+
+    def build(self):
+        raise NotImplementedError
+
+    def apply(self, state, collection: str, old: Optional[dict], new: Optional[dict]):
+        raise NotImplementedError
+
+    def _consistent_build(self):
+        """(state, generation) such that no change happened while the state was built"""
+        while True:
+            with self.lock:
+                generation = self._generation
+            # Collections are read without holding the view lock; their listeners need it
+            with metrics.section(type(self).__name__, "build"):
+                state = self.build()
+            with self.lock:
+                if self._generation == generation:
+                    return state, generation
+
+    def read(self, fn):
+        """Call fn(state) on a current state, building it first if needed"""
+        # Picks up edits made outside the process; a reload resets the view
+        for name in self.SOURCES:
+            self.store[name].refresh()
+        while True:
+            with self.lock:
+                if self.state is not None:
+                    return fn(self.state)
+            state, generation = self._consistent_build()
+            with self.lock:
+                if self._generation == generation:
+                    self.state = state
+
+# ==================== Student balances ====================
+
+def student_totals(store, student_ids: Iterable[str]) -> Dict[str, Tuple[float, float]]:
+    """(hours attended, total paid) of the given students, from their own records"""
+    student_ids = set(student_ids)
+    attendance = store["attendance"].find_in("studentId", student_ids, reports.ATTENDANCE_FIELDS)
+    sessions = store["sessions"].get_many(reports.attended_session_ids(attendance), reports.SESSION_FIELDS)
+    payments = store["payments"].find_in("studentId", student_ids)
+    totals = reports.balance_totals(sessions, attendance, payments)
+    return {student_id: totals.get(student_id, (0, 0)) for student_id in student_ids}
+
+def all_totals(store) -> Dict[str, Tuple[float, float]]:
+    """(hours attended, total paid) of every student with records, in one pass over the collections"""
+    return reports.balance_totals(store["sessions"].project(reports.SESSION_FIELDS),
+                                  store["attendance"].project(reports.ATTENDANCE_FIELDS),
+                                  store["payments"].all())
+
+class BalanceState:
+    def __init__(self):
+        # (studentId, sessionId) -> number of counted attendance records
+        self.pair_counts: Dict[Tuple[str, str], int] = {}
+        self.session_students: Dict[str, Set[str]] = {}
+        # studentId -> (hours attended, total paid), for the students nothing has changed for since
+        self.totals: Dict[str, Tuple[float, float]] = {}
+
+class StudentBalances(MaterializedView):
+    """Per-student hours attended and total paid, kept between requests.
+
+    Totals are added up by reports.balance_totals, as the single-student
+    balance is, so the two agree to the last digit. A change drops the totals
+    of the students it affects (those of a session are found through the
+    attendance counted per session), and only those are added up again on
+    the next read. Amounts due are derived from the student's current
+    hourlyRate when read, so rate changes need no update.
+    """
+
+    SOURCES = ("sessions", "attendance", "payments")
+
+    def build(self) -> BalanceState:
+        state = BalanceState()
+        for a in self.store["attendance"].project(reports.ATTENDANCE_FIELDS):
+            self.apply(state, "attendance", None, a)
+        return state
+
+    def apply(self, state: BalanceState, collection: str, old: Optional[dict], new: Optional[dict]):
+        if collection == "attendance":
+            if old is not None and old["status"] in reports.COUNTED_STATUSES:
+                self._uncount(state, old["studentId"], old["sessionId"])
+            if new is not None and new["status"] in reports.COUNTED_STATUSES:
+                self._count(state, new["studentId"], new["sessionId"])
+            changed = {r["studentId"] for r in (old, new) if r is not None}
+        elif collection == "sessions":
+            changed = state.session_students.get((old or new)["id"], ())
+        elif collection == "payments":
+            changed = {r["studentId"] for r in (old, new) if r is not None}
+        else:
+            return
+        for student_id in changed:
+            state.totals.pop(student_id, None)
+
+    def _count(self, state: BalanceState, student_id: str, session_id: str):
+        key = (student_id, session_id)
+        state.pair_counts[key] = state.pair_counts.get(key, 0) + 1
+        if state.pair_counts[key] == 1:
+            state.session_students.setdefault(session_id, set()).add(student_id)
+
+    def _uncount(self, state: BalanceState, student_id: str, session_id: str):
+        key = (student_id, session_id)
+        state.pair_counts[key] -= 1
+        if state.pair_counts[key] == 0:
+            del state.pair_counts[key]
+            students = state.session_students[session_id]
+            students.discard(student_id)
+            if not students:
+                del state.session_students[session_id]
+
+    # ---- queries ----
+
+    def all_balances(self) -> List[dict]:
+        """Balance of every student, in collection order"""
+        students = self.store["students"].all()
+        totals, generation = self.read(lambda state: (dict(state.totals), self._generation))
+        # Added up without the view lock, which writers need to report their changes
+        missing = [s["id"] for s in students if s["id"] not in totals]
+        if len(missing) * 8 > len(students):
+            # Cheaper as one pass than student by student; both add up the same floats
+            every = all_totals(self.store)
+            missing = {student_id: every.get(student_id, (0, 0)) for student_id in missing}
+        else:
+            missing = student_totals(self.store, missing)
+        with self.lock:
+            # Kept only if nothing changed meanwhile; otherwise they are added up again next time
+            if self.state is not None and self._generation == generation:
+                self.state.totals.update(missing)
+        totals.update(missing)
+        return [reports.balance_summary(s, *totals[s["id"]]) for s in students]
+
+    def check(self) -> dict:
+        """Add every student's totals up from scratch, diff them against the kept ones and adopt them"""
+        self.read(lambda state: None)
+        while True:
+            with self.lock:
+                generation = self._generation
+            with metrics.section(type(self).__name__, "build"):
+                rebuilt = self.build()
+                every = all_totals(self.store)
+                for student in self.store["students"].all():
+                    rebuilt.totals[student["id"]] = every.get(student["id"], (0, 0))
+            with self.lock:
+                if self._generation != generation:
+                    continue
+                kept = self.state.totals if self.state is not None else {}
+                mismatches = []
+                for student_id in sorted(kept.keys() & rebuilt.totals.keys()):
+                    for field, materialized, fresh in zip(("totalHours", "totalPaid"), kept[student_id],
+                                                          rebuilt.totals[student_id]):
+                        if materialized != fresh:
+                            mismatches.append({
+                                "studentId": student_id,
+                                "field": field,
+                                "materialized": materialized,
+                                "rebuilt": fresh,
+                            })
+                self.state = rebuilt
+                return {"consistent": not mismatches, "mismatches": mismatches}
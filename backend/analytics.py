@@ -0,0 +1,333 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import metrics
+import reports
+
+# Period lengths the analytics reports can bucket by
+BUCKETS = ("day", "week", "month")
+
+# Attendance statuses reported separately by the analytics reports
+STATUSES = ("present", "late", "absent")
+
+# ==================== Columns ====================
+
+class Codes:
+    """Stable small integers for string ids, so columns can refer to records by number"""
+
+    def __init__(self):
+        self.lookup: Dict[str, int] = {}
+        self.ids: List[str] = []
+
+    def code(self, value: str) -> int:
+        code = self.lookup.get(value)
+        if code is None:
+            code = self.lookup[value] = len(self.ids)
+            self.ids.append(value)
+        return code
+
+    def encode(self, values: List[str]) -> np.ndarray:
+        return np.fromiter((self.code(v) for v in values), dtype=np.int64, count=len(values))
+
+def parse_dates(values: List[Optional[str]]) -> np.ndarray:
+    """YYYY-MM-DD strings as datetime64[D]; missing or invalid dates become NaT"""
+    try:
+        return np.array(values, dtype="datetime64[D]")
+    except (ValueError, TypeError):
+        dates = np.empty(len(values), dtype="datetime64[D]")
+        for i, value in enumerate(values):
+            try:
+                dates[i] = np.datetime64(value, "D")
+            except (ValueError, TypeError):
+                dates[i] = np.datetime64("NaT")
+        return dates
+
+def period_starts(dates: np.ndarray, bucket: str) -> np.ndarray:
+    """First day (day, week starting Monday) or month of the period each date falls in"""
+    if bucket == "month":
+        return dates.astype("datetime64[M]")
+    if bucket == "week":
+        # Day 0 (1970-01-01) was a Thursday
+        return dates - (dates.astype(np.int64) + 3) % 7
+    return dates
+
+def date_bounds(dates: np.ndarray, start: Optional[str], end: Optional[str]) -> np.ndarray:
+    """Mask of the dates within [start, end]; either bound may be None. NaT is never inside."""
+    mask = ~np.isnat(dates)
+    if start is not None:
+        mask &= dates >= np.datetime64(start, "D")
+    if end is not None:
+        mask &= dates <= np.datetime64(end, "D")
+    return mask
+
+def group(keys: List[np.ndarray]) -> Tuple[List[np.ndarray], np.ndarray]:
+    """Distinct key combinations (one array per key, sorted) and each row's group number"""
+    if not len(keys[0]):
+        return [k[:0] for k in keys], np.zeros(0, dtype=np.int64)
+    combined = np.zeros(len(keys[0]), dtype=np.int64)
+    for key in keys:
+        low = key.min()
+        combined = combined * (int(key.max()) - int(low) + 1) + (key - low)
+    _, first, inverse = np.unique(combined, return_index=True, return_inverse=True)
+    return [key[first] for key in keys], inverse.reshape(-1)
+
+def _extend(previous: Optional[Dict[str, np.ndarray]], columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """`columns` appended to `previous` (new arrays: readers may still hold the old ones)"""
+    if previous is None:
+        return columns
+    return {key: np.concatenate([previous[key], values]) for key, values in columns.items()}
+
+# ==================== Analytics ====================
+
+class Analytics:
+    """Attendance and revenue reports computed with NumPy over column snapshots.
+
+    Sessions, attendance and payments are held as arrays (ids replaced by
+    integer codes, dates as datetime64). A collection's arrays are built
+    from the store the first time a report needs them. After that, records
+    inserted through the store are appended from the listener events;
+    anything else (an update, a delete, a reload, or a change made by
+    another process, seen as a version the inserts do not account for)
+    makes the next report rebuild that collection's arrays. The code maps
+    start afresh at a rebuild once most of their ids are gone. The reports
+    themselves are vectorized group-bys with no per-record Python. Works
+    with any store offering `project`, `versions` and listeners (Store and
+    SQLiteStore).
+    """
+
+    FIELDS = {
+        "sessions": ("id", "classId", "date"),
+        "attendance": reports.ATTENDANCE_FIELDS,
+        "payments": ("studentId", "date", "amount"),
+    }
+
+    # Inserts held for appending before a rebuild is cheaper
+    MAX_HEARD = 100000
+
+    def __init__(self, store):
+        self.store = store
+        # Held by each report from updating the arrays to mapping codes back to ids,
+        # so no other report renumbers the codes in between
+        self.building = threading.RLock()
+        # Guards what the listener hooks record; never held while calling the store
+        self.lock = threading.Lock()
+        self._new_codes()
+        self._columns: Dict[str, Dict[str, np.ndarray]] = {}
+        # Per collection: the version the arrays reflect, and the records inserted
+        # since (None when the arrays must be rebuilt)
+        self._versions: Dict[str, int] = {}
+        self._heard: Dict[str, Optional[List[dict]]] = {name: None for name in self.FIELDS}
+        # Number of changes heard, so a reader can tell one raced it
+        self._changes = 0
+        for name in self.FIELDS:
+            store[name].listeners.append(self)
+
+    def _new_codes(self):
+        self.sessions = Codes()
+        self.students = Codes()
+        self.classes = Codes()
+        self.statuses = Codes()
+
+    # ---- listener protocol ----
+
+    def changed(self, collection: str, old: Optional[dict], new: Optional[dict]):
+        with self.lock:
+            self._changes += 1
+            heard = self._heard[collection]
+            if heard is None:
+                return
+            if old is None and len(heard) < self.MAX_HEARD:
+                heard.append(new)
+            else:
+                self._heard[collection] = None
+
+    def reset(self, collection: str):
+        with self.lock:
+            self._changes += 1
+            self._heard[collection] = None
+
+    # ---- columns ----
+
+    def columns(self, names: Tuple[str, ...]) -> Dict[str, Dict[str, np.ndarray]]:
+        """Current arrays of the named collections, appending inserts and rebuilding any that changed otherwise"""
+        with self.building:
+            while True:
+                with self.lock:
+                    changes = self._changes
+                versions = self.store.versions(names)
+                with self.lock:
+                    if self._changes != changes:
+                        # A change arrived while the versions were read: they may not match what was heard
+                        continue
+                    stale = []
+                    appends = {}
+                    for name, version in zip(names, versions):
+                        heard = self._heard[name]
+                        if heard is not None and self._versions[name] + len(heard) == version:
+                            if heard:
+                                appends[name] = heard
+                                self._heard[name] = []
+                                self._versions[name] = version
+                        else:
+                            stale.append(name)
+                            # Inserts from here on are heard again, to be appended after the build
+                            self._heard[name] = []
+                            self._versions[name] = version
+                if stale and self._codes_worn():
+                    # Most ids were deleted: start the maps afresh, which invalidates every array
+                    self._new_codes()
+                    self._columns.clear()
+                    with self.lock:
+                        for name in self.FIELDS:
+                            self._heard[name] = None
+                    continue
+                for name, records in appends.items():
+                    with metrics.section("analytics", f"append_{name}"):
+                        self._columns[name] = getattr(self, f"_build_{name}")(records, self._columns[name])
+                if not stale:
+                    return {name: self._columns[name] for name in names}
+                for name in stale:
+                    with metrics.section("analytics", f"build_{name}"):
+                        self._columns[name] = getattr(self, f"_build_{name}")(self.store[name].project(self.FIELDS[name]))
+                with self.lock:
+                    for name in stale:
+                        if self._heard[name]:
+                            # Inserted during the build, which may or may not have read them
+                            self._heard[name] = None
+                return {name: self._columns[name] for name in names}
+
+    def _codes_worn(self) -> bool:
+        """Whether a code map holds more than twice as many ids as there are records left"""
+        owners = ((self.sessions, "sessions"), (self.students, "students"), (self.classes, "classes"))
+        return any(len(codes.ids) > 2 * len(self.store[name]) + 1000 for codes, name in owners)
+
+    def _build_sessions(self, records: List[dict], previous: Optional[Dict[str, np.ndarray]] = None) -> Dict[str, np.ndarray]:
+        codes = self.sessions.encode([r["id"] for r in records])
+        classes = self.classes.encode([r.get("classId") or "" for r in records])
+        dates = parse_dates([r.get("date") for r in records])
+        # Indexed by session code; codes of sessions that no longer exist keep -1 / NaT
+        by_code_class = np.full(len(self.sessions.ids), -1, dtype=np.int64)
+        by_code_date = np.full(len(self.sessions.ids), np.datetime64("NaT"), dtype="datetime64[D]")
+        if previous is not None:
+            by_code_class[:len(previous["class"])] = previous["class"]
+            by_code_date[:len(previous["date"])] = previous["date"]
+        by_code_class[codes] = classes
+        by_code_date[codes] = dates
+        return {"class": by_code_class, "date": by_code_date}
+
+    def _build_attendance(self, records: List[dict], previous: Optional[Dict[str, np.ndarray]] = None) -> Dict[str, np.ndarray]:
+        return _extend(previous, {
+            "session": self.sessions.encode([r["sessionId"] for r in records]),
+            "student": self.students.encode([r["studentId"] for r in records]),
+            "status": self.statuses.encode([r["status"] for r in records]),
+        })
+
+    def _build_payments(self, records: List[dict], previous: Optional[Dict[str, np.ndarray]] = None) -> Dict[str, np.ndarray]:
+        return _extend(previous, {
+            "student": self.students.encode([r["studentId"] for r in records]),
+            "date": parse_dates([r.get("date") for r in records]),
+            "amount": np.array([r["amount"] for r in records], dtype=np.float64),
+        })
+
+    def _attendance_by_session(self, start: Optional[str], end: Optional[str]) -> Dict[str, np.ndarray]:
+        """Attendance rows of sessions dated within [start, end], with the session's class and date"""
+        columns = self.columns(("sessions", "attendance"))
+        sessions, attendance = columns["sessions"], columns["attendance"]
+        session = attendance["session"]
+        # Attendance may name sessions first seen after the session arrays were built
+        known = session < len(sessions["date"])
+        dates = np.full(len(session), np.datetime64("NaT"), dtype="datetime64[D]")
+        classes = np.full(len(session), -1, dtype=np.int64)
+        dates[known] = sessions["date"][session[known]]
+        classes[known] = sessions["class"][session[known]]
+        mask = date_bounds(dates, start, end)
+        return {
+            "date": dates[mask],
+            "class": classes[mask],
+            "student": attendance["student"][mask],
+            "status": attendance["status"][mask],
+        }
+
+    def _status_counts(self, statuses: np.ndarray, groups: np.ndarray, size: int) -> Dict[str, List[int]]:
+        counts = {}
+        for status in STATUSES:
+            code = self.statuses.lookup.get(status, -1)
+            counts[status] = np.bincount(groups[statuses == code], minlength=size).tolist()
+        counts["total"] = np.bincount(groups, minlength=size).tolist()
+        return counts
+
+    # ---- reports ----
+
+    def attendance_rates(self, start: Optional[str], end: Optional[str], bucket: str) -> List[dict]:
+        """Per class and period: attendance counts by status and the share counted as attending"""
+        with self.building:
+            rows = self._attendance_by_session(start, end)
+            rows = {key: values[rows["class"] >= 0] for key, values in rows.items()}
+            periods = period_starts(rows["date"], bucket)
+            (classes, starts), groups = group([rows["class"], periods.astype(np.int64)])
+            counts = self._status_counts(rows["status"], groups, len(classes))
+            names = {c["id"]: c["name"] for c in self.store["classes"].all()}
+            labels = np.datetime_as_string(starts.astype(periods.dtype)).tolist()
+            result = []
+            for i, (code, period) in enumerate(zip(classes.tolist(), labels)):
+                class_id = self.classes.ids[code]
+                attended = sum(counts[s][i] for s in reports.COUNTED_STATUSES)
+                result.append({
+                    "classId": class_id,
+                    "className": names.get(class_id, "Unknown"),
+                    "period": period,
+                    **{key: counts[key][i] for key in counts},
+                    "attendanceRate": attended / counts["total"][i],
+                })
+            result.sort(key=lambda r: (r["className"], r["classId"], r["period"]))
+            return result
+
+    def attendance_trends(self, start: Optional[str], end: Optional[str], bucket: str,
+                          class_id: Optional[str] = None, student_id: Optional[str] = None) -> List[dict]:
+        """Per period: attendance counts by status and the late and absent shares"""
+        with self.building:
+            rows = self._attendance_by_session(start, end)
+            mask = np.ones(len(rows["date"]), dtype=bool)
+            if class_id is not None:
+                mask &= rows["class"] == self.classes.lookup.get(class_id, -1)
+            if student_id is not None:
+                mask &= rows["student"] == self.students.lookup.get(student_id, -1)
+            periods = period_starts(rows["date"][mask], bucket)
+            (starts,), groups = group([periods.astype(np.int64)])
+            counts = self._status_counts(rows["status"][mask], groups, len(starts))
+            labels = np.datetime_as_string(starts.astype(periods.dtype)).tolist()
+            return [
+                {
+                    "period": period,
+                    **{key: counts[key][i] for key in counts},
+                    "lateRate": counts["late"][i] / counts["total"][i],
+                    "absentRate": counts["absent"][i] / counts["total"][i],
+                }
+                for i, period in enumerate(labels)
+            ]
+
+    def revenue(self, start: Optional[str], end: Optional[str], bucket: str) -> List[dict]:
+        """Per student and period: payments received and their total amount"""
+        with self.building:
+            payments = self.columns(("payments",))["payments"]
+            mask = date_bounds(payments["date"], start, end)
+            periods = period_starts(payments["date"][mask], bucket)
+            (students, starts), groups = group([payments["student"][mask], periods.astype(np.int64)])
+            amounts = np.bincount(groups, weights=payments["amount"][mask], minlength=len(students)).tolist()
+            counts = np.bincount(groups, minlength=len(students)).tolist()
+            names = {s["id"]: s["name"] for s in self.store["students"].all()}
+            labels = np.datetime_as_string(starts.astype(periods.dtype)).tolist()
+            result = [
+                {
+                    "studentId": self.students.ids[code],
+                    "studentName": names.get(self.students.ids[code], "Unknown"),
+                    "period": period,
+                    "payments": counts[i],
+                    "amount": amounts[i],
+                }
+                for i, (code, period) in enumerate(zip(students.tolist(), labels))
+            ]
+            result.sort(key=lambda r: (r["studentName"], r["studentId"], r["period"]))
+            return result
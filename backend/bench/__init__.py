@@ -0,0 +1,10 @@
+"""Benchmarks for the API.
+
+- `python -m bench.generate --out /tmp/bench-data` writes a seeded synthetic
+  dataset in the same JSON layout as backend/data.
+- `python -m bench.run --data-dir /tmp/bench-data --out results.json` drives
+  every route of main.py in-process and records latency percentiles and
+  memory; `--compare` checks a run against an earlier results file.
+
+Run both from the backend directory.
+"""
@@ -0,0 +1,194 @@
+"""Seeded synthetic datasets in the backend/data JSON layout.
+
+The same seed and sizes always produce byte-identical files, so benchmark
+runs on different commits can use exactly the same data. Records look like
+what the API creates: students enrolled in weekly classes, one session per
+class per week, attendance for the class's students and payments spread
+over the same period. Attendance is streamed to disk, so a million records
+do not need to fit in memory as dicts.
+"""
+
+import argparse
+import os
+import random
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List
+
+from schedule import WEEKDAYS
+from storage import dump_collection_tmp, replace_file
+
+FIRST_NAMES = ["Aarav", "Maya", "Liam", "Priya", "Noah", "Zara", "Ethan", "Anika", "Lucas", "Isla",
+               "Rohan", "Chloe", "Arjun", "Ava", "Kai", "Meera", "Leo", "Sofia", "Dev", "Emma"]
+LAST_NAMES = ["Sharma", "Smith", "Patel", "Nguyen", "Brown", "Kumar", "Wilson", "Chen", "Taylor", "Iyer"]
+SUBJECTS = ["Algebra", "Geometry", "Calculus", "Statistics", "Arithmetic", "Trigonometry"]
+STATUSES = ["present"] * 16 + ["late"] * 2 + ["absent"] * 2
+START_TIMES = ["09:00", "10:30", "13:00", "15:30", "16:00", "17:30"]
+
+DEFAULT_SIZES = {"students": 1000, "classes": 200, "sessions": 50000, "attendance": 1000000, "payments": 100000}
+
+class Generator:
+    """One dataset's worth of records, all drawn from a single seeded RNG"""
+
+    def __init__(self, seed: int, start: date):
+        self.rng = random.Random(seed)
+        self.start = start
+        self.ids = set()
+
+    def new_id(self) -> str:
+        """8 hex digits like main.generate_id, unique within the dataset"""
+        while True:
+            value = "%08x" % self.rng.getrandbits(32)
+            if value not in self.ids:
+                self.ids.add(value)
+                return value
+
+    def timestamp(self, day: date, hour: int = 9) -> str:
+        moment = datetime(day.year, day.month, day.day, hour) + timedelta(
+            seconds=self.rng.randrange(3600), microseconds=self.rng.randrange(1000000))
+        return moment.isoformat()
+
+    def students(self, count: int) -> List[dict]:
+        rng = self.rng
+        joined = self.start - timedelta(days=30)
+        return [{
+            "id": self.new_id(),
+            "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "phone": f"555-{rng.randrange(10000):04d}",
+            "email": f"student{i}@example.com",
+            "hourlyRate": rng.choice([15.0, 17.5, 20.0, 22.5, 25.0, 30.0, 35.0, 40.0]),
+            "active": rng.random() < 0.9,
+            "enrolledClasses": [],
+            "createdAt": self.timestamp(joined),
+        } for i in range(count)]
+
+    def classes(self, count: int, students: List[dict], roster: int) -> List[dict]:
+        rng = self.rng
+        created = []
+        for i in range(count):
+            start_time = rng.choice(START_TIMES)
+            hour, minute = map(int, start_time.split(":"))
+            end_minutes = hour * 60 + minute + rng.choice([60, 90, 120])
+            members = rng.sample(students, min(roster + rng.randrange(4), len(students)))
+            cls = {
+                "id": self.new_id(),
+                "name": f"{rng.choice(SUBJECTS)} {i + 1}",
+                "dayOfWeek": WEEKDAYS[i % 7],
+                "startTime": start_time,
+                "endTime": f"{end_minutes // 60:02d}:{end_minutes % 60:02d}",
+                "studentIds": [s["id"] for s in members],
+                "createdAt": self.timestamp(self.start - timedelta(days=7)),
+            }
+            for student in members:
+                student["enrolledClasses"].append(cls["id"])
+            created.append(cls)
+        return created
+
+    def sessions(self, count: int, classes: List[dict]) -> List[dict]:
+        """Weekly sessions of every class from `start`, earliest first"""
+        rng = self.rng
+        first_day = {c["id"]: self.start + timedelta(days=(WEEKDAYS.index(c["dayOfWeek"]) - self.start.weekday()) % 7)
+                     for c in classes}
+        created = []
+        week = 0
+        while len(created) < count:
+            for cls in sorted(classes, key=lambda c: WEEKDAYS.index(c["dayOfWeek"])):
+                if len(created) == count:
+                    break
+                day = first_day[cls["id"]] + timedelta(weeks=week)
+                end_time = cls["endTime"]
+                if rng.random() < 0.05:
+                    # Sessions occasionally run over
+                    hour, minute = map(int, end_time.split(":"))
+                    end_time = f"{hour:02d}:{minute + 15:02d}" if minute < 45 else f"{hour + 1:02d}:{minute - 45:02d}"
+                start_h, start_m = map(int, cls["startTime"].split(":"))
+                end_h, end_m = map(int, end_time.split(":"))
+                created.append({
+                    "id": self.new_id(),
+                    "classId": cls["id"],
+                    "date": day.isoformat(),
+                    "startTime": cls["startTime"],
+                    "endTime": end_time,
+                    "hoursWorked": round(((end_h * 60 + end_m) - (start_h * 60 + start_m)) / 60, 2),
+                    "createdAt": self.timestamp(day, 20),
+                })
+            week += 1
+        return created
+
+    def attendance(self, count: int, sessions: List[dict], classes: List[dict]) -> Iterator[dict]:
+        """About `count` records spread evenly over sessions (at most one per student per session)"""
+        rng = self.rng
+        rosters = {c["id"]: c["studentIds"] for c in classes}
+        base, extra = divmod(count, len(sessions)) if sessions else (0, 0)
+        bigger = set(rng.sample(range(len(sessions)), extra))
+        for i, session in enumerate(sessions):
+            roster = rosters[session["classId"]]
+            wanted = min(base + (i in bigger), len(roster))
+            day = date.fromisoformat(session["date"])
+            for student_id in rng.sample(roster, wanted):
+                yield {
+                    "id": self.new_id(),
+                    "sessionId": session["id"],
+                    "studentId": student_id,
+                    "status": rng.choice(STATUSES),
+                    "createdAt": self.timestamp(day, 21),
+                }
+
+    def payments(self, count: int, students: List[dict], days: int) -> List[dict]:
+        rng = self.rng
+        dates = sorted(self.start + timedelta(days=rng.randrange(max(days, 1))) for _ in range(count))
+        created = []
+        for day in dates:
+            student = rng.choice(students)
+            created.append({
+                "id": self.new_id(),
+                "studentId": student["id"],
+                "amount": round(student["hourlyRate"] * rng.choice([1, 1.5, 2, 4, 8]), 2),
+                "date": day.isoformat(),
+                "notes": rng.choice(["", "", "", "Cash", "Bank transfer"]),
+                "createdAt": self.timestamp(day, 18),
+            })
+        return created
+
+def write_collection(data_dir: str, name: str, records) -> int:
+    counted = [0]
+
+    def counting():
+        for record in records:
+            counted[0] += 1
+            yield record
+
+    filepath = os.path.join(data_dir, f"{name}.json")
+    replace_file(dump_collection_tmp(filepath, name, counting()), filepath)
+    return counted[0]
+
+def generate(data_dir: str, sizes: Dict[str, int], seed: int = 1, start: date = date(2021, 1, 4)) -> Dict[str, int]:
+    """Write a dataset of (about) `sizes` records per collection into `data_dir`"""
+    os.makedirs(data_dir, exist_ok=True)
+    gen = Generator(seed, start)
+    students = gen.students(sizes["students"])
+    sessions_per_class = sizes["sessions"] / max(sizes["classes"], 1)
+    roster = max(1, -(-sizes["attendance"] // max(sizes["sessions"], 1)))
+    classes = gen.classes(sizes["classes"], students, roster) if students else []
+    sessions = gen.sessions(sizes["sessions"], classes) if classes else []
+    counts = {
+        "students": write_collection(data_dir, "students", students),
+        "classes": write_collection(data_dir, "classes", classes),
+        "sessions": write_collection(data_dir, "sessions", sessions),
+        "attendance": write_collection(data_dir, "attendance", gen.attendance(sizes["attendance"], sessions, classes)),
+        "payments": write_collection(data_dir, "payments",
+                                     gen.payments(sizes["payments"], students, int(sessions_per_class * 7))),
+    }
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a seeded synthetic dataset in the backend/data layout")
+    parser.add_argument("--out", required=True, help="directory to write the JSON files to")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--start", default="2021-01-04", help="date of the first week of sessions")
+    for name, size in DEFAULT_SIZES.items():
+        parser.add_argument(f"--{name}", type=int, default=size)
+    args = parser.parse_args()
+
+    sizes = {name: getattr(args, name) for name in DEFAULT_SIZES}
+    for name, count in generate(args.out, sizes, args.seed, date.fromisoformat(args.start)).items():
+        print(f"{name}: {count}")
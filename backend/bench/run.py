@@ -0,0 +1,452 @@
+"""Benchmark every API route in-process and write the results as JSON.
+
+The app is called directly through ASGI (no sockets, no HTTP client), so
+the numbers are the server's own cost: routing, validation, storage,
+serialization. Each scenario is one request shape; most routes have one,
+list routes have a few. Reads run first, then writes, which create the
+records that later updates and deletes act on (so `--only` should include
+the matching create scenarios when selecting updates or deletes). The data
+directory is copied to a temporary one first, so the dataset is never
+modified.
+
+Every route registered in main.app must have a scenario; routes without one
+are listed under "uncovered" in the results so they are not silently
+skipped when endpoints are added.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import snapshot
+
+# ==================== In-process client ====================
+
+class ASGIClient:
+    """Sends one request at a time straight into an ASGI app"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str, params: Optional[dict] = None, body=None,
+                      headers: Optional[Dict[str, str]] = None) -> Tuple[int, bytes]:
+        payload = json.dumps(body).encode() if body is not None else b""
+        raw_headers = [(b"host", b"bench"), (b"content-length", str(len(payload)).encode())]
+        if body is not None:
+            raw_headers.append((b"content-type", b"application/json"))
+        raw_headers.extend((k.lower().encode(), v.encode()) for k, v in (headers or {}).items())
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": method, "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+            "query_string": urlencode(params or {}).encode(), "headers": raw_headers,
+            "client": ("127.0.0.1", 0), "server": ("bench", 80),
+        }
+        delivered = False
+
+        async def receive():
+            nonlocal delivered
+            if not delivered:
+                delivered = True
+                return {"type": "http.request", "body": payload, "more_body": False}
+            # The client never disconnects; streaming responses stop waiting once they finish
+            await asyncio.Event().wait()
+
+        status, chunks = [0], []
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return status[0], b"".join(chunks)
+
+# ==================== Scenarios ====================
+
+class Context:
+    """Ids sampled from the loaded dataset, plus records created by earlier write scenarios"""
+
+    def __init__(self, store, rng: random.Random):
+        self.rng = rng
+        self.students = [s["id"] for s in store["students"].all()]
+        self.classes = [c["id"] for c in store["classes"].all()]
+        sessions = store["sessions"].project(("id", "date"))
+        self.sessions = [s["id"] for s in rng.sample(sessions, min(1000, len(sessions)))]
+        dates = sorted(s["date"] for s in sessions) or [date.today().isoformat()]
+        self.first_date, self.last_date = dates[0], dates[-1]
+        attendance = store["attendance"].project(("id",))
+        self.attendance = [a["id"] for a in rng.sample(attendance, min(1000, len(attendance)))]
+        self.payments = [p["id"] for p in store["payments"].all()[:1000]]
+        self.created: Dict[str, List[str]] = {name: [] for name in ("students", "classes", "sessions", "attendance", "payments")}
+        # Body of the batch sent again and again with one Idempotency-Key
+        self.replayed_batch: Optional[dict] = None
+
+    def pick(self, ids: List[str]) -> str:
+        return self.rng.choice(ids)
+
+    def window(self, days: int) -> Tuple[str, str]:
+        """A random range of `days` days within the dataset's session dates"""
+        first = date.fromisoformat(self.first_date)
+        span = max((date.fromisoformat(self.last_date) - first).days - days, 0)
+        start = first + timedelta(days=self.rng.randrange(span + 1))
+        return start.isoformat(), (start + timedelta(days=days)).isoformat()
+
+    def future_week(self, i: int) -> Tuple[str, str]:
+        """Week `i` after the last session, so generated sessions never collide"""
+        start = date.fromisoformat(self.last_date) + timedelta(weeks=i + 1)
+        return start.isoformat(), (start + timedelta(days=6)).isoformat()
+
+    def take(self, name: str) -> str:
+        """A record created earlier by this run, removed from the pool"""
+        return self.created[name].pop()
+
+class Scenario:
+    """One request shape for a route: `make(ctx, i)` returns (path, params, body)"""
+
+    def __init__(self, name: str, method: str, route: str, make: Callable, heavy: bool = False,
+                 collect: Optional[Callable] = None, headers: Optional[Dict[str, str]] = None, expect: int = 200):
+        self.name = name
+        self.method = method
+        self.route = route
+        self.make = make
+        self.heavy = heavy
+        self.collect = collect
+        self.headers = headers
+        self.expect = expect
+
+def created(name: str, key: Optional[str] = None):
+    """Collector remembering the id(s) a write returned under ctx.created[name]"""
+    def collect(ctx: Context, payload):
+        rows = payload[key] if key else payload
+        for row in rows if isinstance(rows, list) else [rows]:
+            ctx.created[name].append(row["id"])
+    return collect
+
+def _session_body(ctx: Context, i: int) -> dict:
+    start, _ = ctx.future_week(i)
+    return {"classId": ctx.pick(ctx.classes), "date": start, "startTime": "10:00", "endTime": "11:30"}
+
+def _payment_body(ctx: Context, i: int) -> dict:
+    return {"studentId": ctx.pick(ctx.students), "amount": 40.0, "date": ctx.window(0)[0], "notes": "bench"}
+
+def _batch_body(ctx: Context, i: int) -> dict:
+    """Ten operations over three collections, as a client saving a session's changes would send"""
+    return {"operations": [
+        {"method": "PUT", "path": f"/api/sessions/{ctx.created['sessions'][i]}", "body": {"endTime": "12:30"}},
+        {"method": "PUT", "path": f"/api/attendance/{ctx.created['attendance'][i]}", "body": {"status": "late"}},
+        *({"method": "POST", "path": "/api/payments", "body": _payment_body(ctx, i)} for _ in range(8)),
+    ]}
+
+def _replayed_batch(ctx: Context, i: int) -> dict:
+    if ctx.replayed_batch is None:
+        ctx.replayed_batch = _batch_body(ctx, i)
+    return ctx.replayed_batch
+
+SCENARIOS = [
+    # ---- reads ----
+    Scenario("students.list", "GET", "/api/students", lambda c, i: ("/api/students", {}, None)),
+    Scenario("students.page", "GET", "/api/students", lambda c, i: ("/api/students", {"limit": 50, "sort": "name"}, None)),
+    Scenario("students.get", "GET", "/api/students/{student_id}",
+             lambda c, i: (f"/api/students/{c.pick(c.students)}", {}, None)),
+    Scenario("classes.list", "GET", "/api/classes", lambda c, i: ("/api/classes", {}, None)),
+    Scenario("classes.get", "GET", "/api/classes/{class_id}", lambda c, i: (f"/api/classes/{c.pick(c.classes)}", {}, None)),
+    Scenario("sessions.by_class", "GET", "/api/sessions",
+             lambda c, i: ("/api/sessions", {"class_id": c.pick(c.classes)}, None)),
+    Scenario("sessions.month", "GET", "/api/sessions",
+             lambda c, i: ("/api/sessions", dict(zip(("from", "to"), c.window(30))), None)),
+    Scenario("sessions.page", "GET", "/api/sessions",
+             lambda c, i: ("/api/sessions", {"limit": 100, "sort": "-date"}, None)),
+    Scenario("sessions.list", "GET", "/api/sessions", lambda c, i: ("/api/sessions", {}, None), heavy=True),
+    Scenario("sessions.get", "GET", "/api/sessions/{session_id}",
+             lambda c, i: (f"/api/sessions/{c.pick(c.sessions)}", {}, None)),
+    Scenario("attendance.by_session", "GET", "/api/attendance",
+             lambda c, i: ("/api/attendance", {"session_id": c.pick(c.sessions)}, None)),
+    Scenario("attendance.by_student", "GET", "/api/attendance",
+             lambda c, i: ("/api/attendance", {"student_id": c.pick(c.students), "limit": 200}, None)),
+    Scenario("attendance.list", "GET", "/api/attendance", lambda c, i: ("/api/attendance", {}, None), heavy=True),
+    Scenario("payments.by_student", "GET", "/api/payments",
+             lambda c, i: ("/api/payments", {"student_id": c.pick(c.students)}, None)),
+    Scenario("payments.month", "GET", "/api/payments",
+             lambda c, i: ("/api/payments", dict(zip(("from", "to"), c.window(30))), None)),
+    Scenario("payments.get", "GET", "/api/payments/{payment_id}",
+             lambda c, i: (f"/api/payments/{c.pick(c.payments)}", {}, None)),
+    Scenario("reports.payroll.month", "GET", "/api/reports/payroll",
+             lambda c, i: ("/api/reports/payroll", dict(zip(("start_date", "end_date"), c.window(30))), None)),
+    Scenario("reports.payroll.year", "GET", "/api/reports/payroll",
+             lambda c, i: ("/api/reports/payroll", dict(zip(("start_date", "end_date"), c.window(365))), None)),
+    Scenario("reports.student_balance", "GET", "/api/reports/student-balance/{student_id}",
+             lambda c, i: (f"/api/reports/student-balance/{c.pick(c.students)}", {}, None)),
+    Scenario("reports.balances", "GET", "/api/reports/balances", lambda c, i: ("/api/reports/balances", {}, None)),
+    Scenario("reports.attendance_rates", "GET", "/api/reports/attendance-rates",
+             lambda c, i: ("/api/reports/attendance-rates", {**dict(zip(("from", "to"), c.window(90))), "bucket": "week"}, None)),
+    Scenario("reports.attendance_trends", "GET", "/api/reports/attendance-trends",
+             lambda c, i: ("/api/reports/attendance-trends", {"studentId": c.pick(c.students)}, None)),
+    Scenario("reports.revenue", "GET", "/api/reports/revenue",
+             lambda c, i: ("/api/reports/revenue", dict(zip(("from", "to"), c.window(365))), None)),
+    Scenario("dashboard", "GET", "/api/dashboard", lambda c, i: ("/api/dashboard", {}, None)),
+    Scenario("metrics", "GET", "/api/metrics", lambda c, i: ("/api/metrics", {}, None)),
+    Scenario("export.payroll", "GET", "/api/export/payroll",
+             lambda c, i: ("/api/export/payroll", dict(zip(("from", "to"), c.window(365))), None)),
+    Scenario("export.sessions", "GET", "/api/export/{collection}",
+             lambda c, i: ("/api/export/sessions", {}, None), heavy=True),
+    Scenario("export.attendance.gzip", "GET", "/api/export/{collection}",
+             lambda c, i: ("/api/export/attendance", {"format": "csv"}, None), heavy=True,
+             headers={"Accept-Encoding": "gzip"}),
+    Scenario("reports.balances.check", "POST", "/api/reports/balances/check",
+             lambda c, i: ("/api/reports/balances/check", {}, None), heavy=True),
+    # ---- writes ----
+    Scenario("students.create", "POST", "/api/students",
+             lambda c, i: ("/api/students", {}, {"name": f"Bench {i}", "email": f"bench{i}@example.com", "hourlyRate": 25}),
+             collect=created("students")),
+    Scenario("students.bulk", "POST", "/api/students/bulk",
+             lambda c, i: ("/api/students/bulk", {}, [{"name": f"Bulk {i}-{j}", "phone": str(j)} for j in range(100)]),
+             collect=created("students", "created")),
+    Scenario("students.update", "PUT", "/api/students/{student_id}",
+             lambda c, i: (f"/api/students/{c.created['students'][i]}", {}, {"hourlyRate": 30})),
+    Scenario("classes.create", "POST", "/api/classes",
+             lambda c, i: ("/api/classes", {}, {"name": f"Bench {i}", "dayOfWeek": "Monday", "startTime": "10:00",
+                                                "endTime": "11:00", "studentIds": c.rng.sample(c.students, min(10, len(c.students)))}),
+             collect=created("classes")),
+    Scenario("classes.update", "PUT", "/api/classes/{class_id}",
+             lambda c, i: (f"/api/classes/{c.created['classes'][i]}", {}, {"endTime": "11:30"})),
+    Scenario("sessions.create", "POST", "/api/sessions", lambda c, i: ("/api/sessions", {}, _session_body(c, i)),
+             collect=created("sessions")),
+    Scenario("sessions.bulk", "POST", "/api/sessions/bulk",
+             lambda c, i: ("/api/sessions/bulk", {}, [{**_session_body(c, 1000 + i), "startTime": f"{8 + j % 12:02d}:{j // 12:02d}",
+                                                      "endTime": "21:00"} for j in range(50)]),
+             collect=created("sessions", "created")),
+    Scenario("sessions.generate", "POST", "/api/sessions/generate",
+             lambda c, i: ("/api/sessions/generate", {}, dict(zip(("startDate", "endDate"), c.future_week(2000 + i)))),
+             collect=created("sessions", "created")),
+    Scenario("sessions.update", "PUT", "/api/sessions/{session_id}",
+             lambda c, i: (f"/api/sessions/{c.created['sessions'][i]}", {}, {"endTime": "12:00"})),
+    Scenario("attendance.create", "POST", "/api/attendance",
+             lambda c, i: ("/api/attendance", {}, {"sessionId": c.created["sessions"][-1 - i], "studentId": c.pick(c.students),
+                                                   "status": "present"}),
+             collect=created("attendance")),
+    Scenario("attendance.bulk", "POST", "/api/attendance/bulk",
+             lambda c, i: ("/api/attendance/bulk", {}, [{"sessionId": c.created["sessions"][i], "studentId": s, "status": "late"}
+                                                        for s in c.students[:20]])),
+    Scenario("attendance.update", "PUT", "/api/attendance/{attendance_id}",
+             lambda c, i: (f"/api/attendance/{c.created['attendance'][i]}", {}, {"status": "absent"})),
+    Scenario("payments.create", "POST", "/api/payments", lambda c, i: ("/api/payments", {}, _payment_body(c, i)),
+             collect=created("payments")),
+    Scenario("payments.bulk", "POST", "/api/payments/bulk",
+             lambda c, i: ("/api/payments/bulk", {}, [{**_payment_body(c, i), "notes": f"bulk {i}-{j}"} for j in range(100)]),
+             collect=created("payments", "created")),
+    Scenario("payments.update", "PUT", "/api/payments/{payment_id}",
+             lambda c, i: (f"/api/payments/{c.created['payments'][i]}", {}, {"amount": 45.0})),
+    Scenario("batch", "POST", "/api/batch", lambda c, i: ("/api/batch", {}, _batch_body(c, i))),
+    # The same key and operations every time: all but the first are answered from the batch log
+    Scenario("batch.replayed", "POST", "/api/batch", lambda c, i: ("/api/batch", {}, _replayed_batch(c, i)),
+             headers={"Idempotency-Key": "bench-batch"}),
+    Scenario("payments.delete", "DELETE", "/api/payments/{payment_id}",
+             lambda c, i: (f"/api/payments/{c.take('payments')}", {}, None)),
+    Scenario("sessions.delete", "DELETE", "/api/sessions/{session_id}",
+             lambda c, i: (f"/api/sessions/{c.take('sessions')}", {}, None)),
+    Scenario("classes.delete", "DELETE", "/api/classes/{class_id}",
+             lambda c, i: (f"/api/classes/{c.take('classes')}", {}, None)),
+    Scenario("students.delete", "DELETE", "/api/students/{student_id}",
+             lambda c, i: (f"/api/students/{c.take('students')}", {}, None)),
+    # After the writes, so there are changes to return
+    Scenario("changes", "GET", "/api/changes", lambda c, i: ("/api/changes", {"since": 0, "limit": 100}, None)),
+]
+
+def uncovered_routes(app, scenarios: List[Scenario]) -> List[str]:
+    """"METHOD /path" of every API route no scenario exercises"""
+    covered = {(s.method, s.route) for s in scenarios}
+    missing = []
+    for route in app.routes:
+        for method in sorted(getattr(route, "methods", None) or ()):
+            if method != "HEAD" and route.path.startswith("/api/") and (method, route.path) not in covered:
+                missing.append(f"{method} {route.path}")
+    return missing
+
+# ==================== Measuring ====================
+
+def percentile(ordered: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+async def measure(client: ASGIClient, ctx: Context, scenario: Scenario, iterations: int, clear_cache, trace: bool) -> dict:
+    """Time `iterations` requests of one scenario (after one untimed warm-up)"""
+    async def call(i: int) -> Tuple[int, float]:
+        path, params, body = scenario.make(ctx, i)
+        clear_cache()
+        started = time.perf_counter()
+        status, payload = await client.request(scenario.method, path, params, body, scenario.headers)
+        elapsed = time.perf_counter() - started
+        if scenario.collect is not None and status == 200:
+            scenario.collect(ctx, json.loads(payload))
+        return status, elapsed
+
+    statuses = {}
+    status, first = await call(0)
+    statuses[status] = 1
+    timings = []
+    for i in range(1, iterations + 1):
+        status, elapsed = await call(i)
+        statuses[status] = statuses.get(status, 0) + 1
+        timings.append(elapsed * 1000)
+
+    result = {"route": f"{scenario.method} {scenario.route}", "iterations": iterations, "first_ms": round(first * 1000, 3)}
+    if timings:
+        ordered = sorted(timings)
+        result.update({
+            "mean_ms": round(sum(ordered) / len(ordered), 3),
+            "p50_ms": round(percentile(ordered, 0.50), 3),
+            "p90_ms": round(percentile(ordered, 0.90), 3),
+            "p99_ms": round(percentile(ordered, 0.99), 3),
+            "max_ms": round(ordered[-1], 3),
+        })
+    if trace:
+        # One more request with allocation tracing on (it slows the request, so it is not timed)
+        tracemalloc.start()
+        await call(iterations + 1)
+        result["peak_alloc_kb"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        tracemalloc.stop()
+    result["statuses"] = {str(code): count for code, count in sorted(statuses.items())}
+    result["errors"] = sum(count for code, count in statuses.items() if code != scenario.expect)
+    return result
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(data_dir: str, storage: str = "json", iterations: int = 20, heavy_iterations: int = 3, seed: int = 1,
+        cached: bool = False, trace: bool = True, only: Optional[List[str]] = None, file_format: str = "json") -> dict:
+    """Benchmark every scenario against a copy of `data_dir` and return the results document"""
+    work = tempfile.mkdtemp(prefix="tuition-bench-")
+    try:
+        shutil.copytree(data_dir, work, dirs_exist_ok=True)
+        os.environ["TUITION_DATA_DIR"] = work
+        os.environ["TUITION_STORAGE"] = storage
+        os.environ["TUITION_FORMAT"] = file_format
+        if storage != "sqlite" and snapshot.detect_format(work) != file_format:
+            # Convert up front so the load time measures the format itself
+            snapshot.convert(work, file_format)
+        if storage == "sqlite":
+            import sqlite_store
+            db = os.path.join(work, "tuition.db")
+            if not os.path.exists(db):
+                sqlite_store.import_json(work, db)
+            os.environ["TUITION_DB"] = db
+        import main
+
+        started = time.perf_counter()
+        main.store.versions(main.store.COLLECTIONS)
+        load_seconds = time.perf_counter() - started
+        records = {name: len(main.store[name]) for name in main.store.COLLECTIONS}
+
+        rng = random.Random(seed)
+        ctx = Context(main.store, rng)
+        client = ASGIClient(main.app)
+        clear_cache = (lambda: None) if cached else main.response_cache.clear
+        scenarios = [s for s in SCENARIOS if not only or any(s.name.startswith(prefix) for prefix in only)]
+
+        async def run_all():
+            results = {}
+            for scenario in scenarios:
+                count = heavy_iterations if scenario.heavy else iterations
+                results[scenario.name] = await measure(client, ctx, scenario, count, clear_cache, trace)
+                print(f"{scenario.name:32} p50 {results[scenario.name].get('p50_ms', 0):10.2f} ms"
+                      f"  p99 {results[scenario.name].get('p99_ms', 0):10.2f} ms", file=sys.stderr)
+            return results
+
+        endpoints = asyncio.run(run_all())
+        return {
+            "meta": {
+                "commit": git_commit(),
+                "startedAt": datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "storage": storage,
+                "format": file_format,
+                "records": records,
+                "iterations": iterations,
+                "heavyIterations": heavy_iterations,
+                "seed": seed,
+                "responseCache": cached,
+                "loadSeconds": round(load_seconds, 3),
+                "peakRssMb": peak_rss_mb(),
+            },
+            "endpoints": endpoints,
+            "uncovered": uncovered_routes(main.app, SCENARIOS),
+        }
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+# ==================== Comparing ====================
+
+def compare(baseline: dict, current: dict, threshold: float = 1.25) -> List[str]:
+    """Print p50/p99 of both runs side by side; return the scenarios whose p50 grew by more than `threshold`"""
+    regressions = []
+    print(f"{'scenario':32} {'p50 before':>11} {'p50 after':>11} {'ratio':>7} {'p99 before':>11} {'p99 after':>11}")
+    for name, after in current["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if before is None or "p50_ms" not in before or "p50_ms" not in after:
+            continue
+        ratio = after["p50_ms"] / before["p50_ms"] if before["p50_ms"] else float("inf")
+        flag = "  <-- slower" if ratio > threshold else ""
+        print(f"{name:32} {before['p50_ms']:11.2f} {after['p50_ms']:11.2f} {ratio:7.2f} "
+              f"{before['p99_ms']:11.2f} {after['p99_ms']:11.2f}{flag}")
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every API route in-process")
+    parser.add_argument("--data-dir", required=True, help="dataset to run against (e.g. from bench.generate); it is copied, not modified")
+    parser.add_argument("--out", help="write the results JSON here (default: stdout)")
+    parser.add_argument("--storage", choices=["json", "journal", "sqlite"], default="json")
+    parser.add_argument("--format", choices=snapshot.FORMATS, default="json",
+                        help="data file format to run with (the copy is converted first if needed)")
+    parser.add_argument("--iterations", type=int, default=20, help="timed requests per scenario")
+    parser.add_argument("--heavy-iterations", type=int, default=3,
+                        help="timed requests for scenarios that read whole collections")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--cached", action="store_true", help="keep the response cache between requests")
+    parser.add_argument("--no-trace", action="store_true", help="skip the traced request that measures allocations")
+    parser.add_argument("--only", action="append", help="run only scenarios whose name starts with this (repeatable)")
+    parser.add_argument("--compare", help="earlier results JSON to compare against; exits 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=1.25, help="p50 ratio counted as a regression")
+    args = parser.parse_args()
+
+    results = run(args.data_dir, args.storage, args.iterations, args.heavy_iterations, args.seed,
+                  args.cached, not args.no_trace, args.only, args.format)
+    document = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(document + "\n")
+    else:
+        print(document)
+    for route in results["uncovered"]:
+        print(f"warning: no benchmark scenario for {route}", file=sys.stderr)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} scenario(s) slower than {args.threshold}x: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
@@ -0,0 +1,95 @@
+from typing import Callable, Dict, List, Optional, Tuple
+
+# ==================== Bulk inserts ====================
+
+def bulk_insert(store, name: str, rows: List, build: Callable[[object], dict], key_fields: Tuple[str, ...],
+                generate_id: Callable[[], str], references: Optional[Dict[str, str]] = None):
+    """Validate a batch of rows and insert the valid ones with a single write.
+
+    `build` turns a raw row into a record (raising ValueError, which includes
+    pydantic's ValidationError, for invalid rows). `references` maps a record
+    field to the collection its value must exist in. Rows whose `key_fields`
+    match an existing record or an earlier row of the batch are rejected;
+    keys are compared through a hash set (or a hash index), so the cost is
+    O(batch) rather than O(batch x collection).
+
+    Returns (created records, errors), errors being {"row": index, "detail": message}.
+    """
+    errors = []
+    candidates = []
+    for index, row in enumerate(rows):
+        try:
+            candidates.append((index, build(row)))
+        except ValueError as exc:
+            errors.append({"row": index, "detail": describe_error(exc)})
+
+    collection = store[name]
+    # The referenced records are looked up under the same locks as the insert, so none
+    # can be deleted in between
+    with store.batch():
+        for field, target in (references or {}).items():
+            found = {r["id"] for r in store[target].get_many({record[field] for _, record in candidates})}
+            kept = []
+            for index, record in candidates:
+                if record[field] in found:
+                    kept.append((index, record))
+                else:
+                    errors.append({"row": index, "detail": f"Unknown {field}: {record[field]}"})
+            candidates = kept
+
+        created, duplicates = dedupe(collection, candidates, key_fields)
+        errors.extend(
+            {"row": index, "detail": "Already exists" if first is None else f"Duplicate of row {first}"}
+            for index, first in duplicates
+        )
+        created = assign_unique_ids(collection, created, generate_id)
+        collection.insert_many(created)
+
+    errors.sort(key=lambda error: error["row"])
+    return created, errors
+
+def dedupe(collection, candidates: List[Tuple[int, dict]], key_fields: Tuple[str, ...]):
+    """Split (index, record) pairs into records to insert and (index, first index or None) duplicates.
+
+    None marks a row that duplicates a record already stored.
+    """
+    keys = [tuple(record.get(f) for f in key_fields) for _, record in candidates]
+    existing = collection.existing_keys(key_fields, set(keys))
+    first_rows = {}
+    kept, duplicates = [], []
+    for (index, record), key in zip(candidates, keys):
+        if key in existing:
+            duplicates.append((index, None))
+        elif key in first_rows:
+            duplicates.append((index, first_rows[key]))
+        else:
+            first_rows[key] = index
+            kept.append(record)
+    return kept, duplicates
+
+def assign_unique_ids(collection, records: List[dict], generate_id: Callable[[], str]) -> List[dict]:
+    """Records with any id already taken (in the collection or earlier in the batch) replaced.
+
+    Short random ids collide easily at batch sizes in the tens of thousands.
+    """
+    taken = {r["id"] for r in collection.get_many([r["id"] for r in records])}
+    unique = []
+    for record in records:
+        if record["id"] in taken:
+            new_id = generate_id()
+            while new_id in taken or collection.get(new_id) is not None:
+                new_id = generate_id()
+            record = {**record, "id": new_id}
+        taken.add(record["id"])
+        unique.append(record)
+    return unique
+
+def describe_error(exc: ValueError) -> str:
+    errors = getattr(exc, "errors", None)
+    if callable(errors):
+        # pydantic ValidationError: one "field: message" per problem
+        return "; ".join(
+            ".".join(str(part) for part in error["loc"]) + ": " + error["msg"] if error["loc"] else error["msg"]
+            for error in errors()
+        )
+    return str(exc)
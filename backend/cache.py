@@ -0,0 +1,72 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+# ==================== Response cache ====================
+
+class ResponseCache:
+    """Bounded LRU of serialized responses.
+
+    Entries are keyed by (endpoint, params) and remember the collection
+    versions they were computed from; a lookup only hits when the versions
+    still match. A mutation therefore invalidates exactly the entries that
+    depend on the collection it changed, and the next computation for the
+    same key replaces the stale entry in place.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[tuple, Tuple[tuple, bytes]]" = OrderedDict()
+
+    def get(self, key: tuple, versions: tuple) -> Optional[bytes]:
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != versions:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: tuple, versions: tuple, body: bytes):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self._entries[key] = (versions, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+# ==================== ETags ====================
+
+def make_etag(epoch: str, key: tuple, versions: tuple) -> str:
+    """Strong ETag for a response computed from `versions` of its collections.
+
+    `epoch` identifies the store instance, so versions that restart from zero
+    after a restart never reproduce an old tag.
+    """
+    digest = hashlib.sha1(repr((key, versions)).encode()).hexdigest()[:20]
+    return f'"{epoch}-{digest}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches `etag` (weak comparison, as RFC 9110 requires)"""
+    if not if_none_match:
+        return False
+    for candidate in _split_tags(if_none_match):
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+def _split_tags(header: str) -> Iterable[str]:
+    return (tag.strip() for tag in header.split(",") if tag.strip())
@@ -0,0 +1,154 @@
+"""Change feed: every change to the store as a numbered event, so clients can sync deltas"""
+
+import asyncio
+import os
+import threading
+import uuid
+from collections import deque
+from itertools import islice
+from typing import Deque, List, Optional, Tuple
+
+import orjson
+
+from storage import read_journal, replace_file
+
+class ChangeFeed:
+    """The last `capacity` changes to every collection, as events {"seq", "collection", "op", "id", "record"}.
+
+    Listens to the collections like a MaterializedView. A collection replaced
+    wholesale gives one "reset" event with no id. With `log_path`, events are
+    also appended to a JSON-lines file and read back on start.
+    """
+
+    def __init__(self, store, capacity: int = 10000, log_path: Optional[str] = None):
+        self.capacity = capacity
+        self.events: Deque[dict] = deque(maxlen=capacity)
+        self.seq = 0
+        self.epoch = uuid.uuid4().hex[:8]
+        self.lock = threading.Lock()
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        # In-memory collections report their initial load as a reset, which is not a change
+        self._loaded = set() if store.IN_MEMORY else set(store.COLLECTIONS)
+        self.log_path = log_path
+        self._log = None
+        self._logged = 0
+        if log_path:
+            self._open_log()
+        for name in store.COLLECTIONS:
+            store[name].listeners.append(self)
+
+    # ---- listener protocol ----
+
+    def changed(self, collection: str, old: Optional[dict], new: Optional[dict]):
+        if new is None:
+            self._append(collection, "delete", old["id"], None)
+        else:
+            self._append(collection, "insert" if old is None else "update", new["id"], new)
+
+    def reset(self, collection: str):
+        if collection not in self._loaded:
+            self._loaded.add(collection)
+            return
+        self._append(collection, "reset", None, None)
+
+    # ---- events ----
+
+    def _append(self, collection: str, op: str, record_id: Optional[str], record: Optional[dict]):
+        with self.lock:
+            self.seq += 1
+            event = {"seq": self.seq, "collection": collection, "op": op, "id": record_id, "record": record}
+            self.events.append(event)
+            if self._log is not None:
+                self._write_log(event)
+            waiters, self._waiters = self._waiters, []
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:
+                # The waiter's event loop has been closed
+                pass
+
+    def read(self, since: int, limit: int = 1000, collections: Optional[set] = None) -> Optional[dict]:
+        """Events after `since` (at most `limit`, only of `collections` if given), or None if
+        the client must resync because events after `since` are no longer retained.
+
+        Returns {"epoch", "events", "next"}: pass `next` as `since` to continue.
+        """
+        with self.lock:
+            latest = self.seq
+            oldest = self.events[0]["seq"] if self.events else latest + 1
+            if since > latest or since < oldest - 1:
+                return None
+            events = []
+            position = since
+            for event in islice(self.events, since + 1 - oldest, None):
+                if len(events) == limit:
+                    break
+                position = event["seq"]
+                if collections is None or event["collection"] in collections:
+                    events.append(event)
+        return {"epoch": self.epoch, "events": events, "next": position}
+
+    async def wait(self, since: int, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for an event after `since`; False if none came"""
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        with self.lock:
+            if self.seq > since:
+                return True
+            self._waiters.append((loop, waiter))
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self.lock:
+                if (loop, waiter) in self._waiters:
+                    self._waiters.remove((loop, waiter))
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    # ---- log ----
+
+    def _open_log(self):
+        entries = read_journal(self.log_path)
+        if entries and "epoch" in entries[0]:
+            self.epoch = entries[0]["epoch"]
+            self.events.extend(entries[1:])
+            if self.events:
+                self.seq = self.events[-1]["seq"]
+        self._rewrite_log()
+
+    def _write_log(self, event: dict):
+        self._log.write(orjson.dumps(event) + b"\n")
+        self._log.flush()
+        self._logged += 1
+        if self._logged >= 2 * self.capacity:
+            self._rewrite_log()
+
+    def _rewrite_log(self):
+        """Replace the log with a header and the retained events"""
+        if self._log is not None:
+            self._log.close()
+        tmp_path = f"{self.log_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps({"epoch": self.epoch}) + b"\n")
+            for event in self.events:
+                f.write(orjson.dumps(event) + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        replace_file(tmp_path, self.log_path)
+        self._log = open(self.log_path, "ab")
+        self._logged = len(self.events)
+
+def _wake(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+def sse(name: str, payload: dict, event_id: Optional[int] = None) -> bytes:
+    """One Server-Sent Events message"""
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {name}\ndata: ".encode() + orjson.dumps(payload) + b"\n\n"
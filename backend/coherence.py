@@ -0,0 +1,125 @@
+"""Locks and version counters shared by the server processes of one data directory (TUITION_WORKERS > 1)"""
+
+import mmap
+import os
+import struct
+import uuid
+from contextlib import contextmanager
+from typing import Iterable, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FILENAME = "versions.shm"
+MAGIC = b"tuition1"
+
+# Magic and epoch, then per collection: counter, snapshot mtime and size, journal mtime and size
+HEADER = struct.Struct("<8s8s")
+SLOT = struct.Struct("<5q")
+
+Signature = Tuple[Optional[Tuple[int, int]], Optional[Tuple[int, int]]]
+
+class ProcessLock:
+    """Exclusive or shared flock on a lock file, for one process at a time.
+
+    flock does not exclude threads of the same process from each other, so
+    callers hold a thread lock around it (storage.CommitLock does).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def acquire(self, exclusive: bool = True):
+        fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+    def release(self):
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        os.close(self._fd)
+
+    @contextmanager
+    def holding(self, exclusive: bool = True):
+        self.acquire(exclusive)
+        try:
+            yield
+        finally:
+            self.release()
+
+class SharedVersions:
+    """The counters, signatures and epoch in `versions.shm`, plus each collection's ProcessLock.
+
+    A writer bumps a collection's counter once its change is on disk, along
+    with the signature (mtime and size) of the files it left; a process is
+    current while the counter equals the one it last caught up to. Counters
+    and signatures are only changed by `publish`, whose caller holds the
+    collection's lock exclusively. The epoch is renewed by a process that
+    opens the file while no other has it open.
+    """
+
+    def __init__(self, data_dir: str, names: Iterable[str]):
+        if fcntl is None:
+            raise RuntimeError("several worker processes need fcntl file locks, which this platform lacks")
+        self.names = list(names)
+        self._offsets = {name: HEADER.size + i * SLOT.size for i, name in enumerate(self.names)}
+        self.locks = {name: ProcessLock(os.path.join(data_dir, f"{name}.lock")) for name in self.names}
+        size = HEADER.size + SLOT.size * len(self.names)
+        self.path = os.path.join(data_dir, FILENAME)
+        # Held shared for as long as this process runs, so the next one to start can tell it is not alone
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            alone = False
+        else:
+            alone = True
+        if alone and not self._valid(size):
+            # New file, or laid out for other collections: start every counter afresh
+            os.ftruncate(self._fd, 0)
+            os.ftruncate(self._fd, size)
+        elif not self._valid(size):
+            raise RuntimeError(f"{self.path} was written for other collections by a process still running")
+        self._map = mmap.mmap(self._fd, size)
+        if alone:
+            HEADER.pack_into(self._map, 0, MAGIC, uuid.uuid4().bytes[:8])
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+
+    def _valid(self, size: int) -> bool:
+        if os.fstat(self._fd).st_size != size:
+            return False
+        return os.pread(self._fd, len(MAGIC), 0) == MAGIC
+
+    @property
+    def epoch(self) -> str:
+        return HEADER.unpack_from(self._map, 0)[1].hex()
+
+    def counter(self, name: str) -> int:
+        return struct.unpack_from("<q", self._map, self._offsets[name])[0]
+
+    def signature(self, name: str) -> Signature:
+        _, *values = SLOT.unpack_from(self._map, self._offsets[name])
+        return _unflatten(values[:2]), _unflatten(values[2:])
+
+    def close(self):
+        """Release the locks and the mapping (the shared lock on the file goes with its descriptor)"""
+        self._map.close()
+        os.close(self._fd)
+        for lock in self.locks.values():
+            lock.close()
+
+    def publish(self, name: str, signature: Signature) -> int:
+        """Record a change to `name` that left its files with `signature`; returns the new counter"""
+        counter = self.counter(name) + 1
+        snapshot_sig, journal_sig = signature
+        SLOT.pack_into(self._map, self._offsets[name], counter, *_flatten(snapshot_sig), *_flatten(journal_sig))
+        return counter
+
+def _flatten(signature: Optional[Tuple[int, int]]) -> Tuple[int, int]:
+    return signature if signature is not None else (-1, -1)
+
+def _unflatten(values) -> Optional[Tuple[int, int]]:
+    return None if values[1] < 0 else tuple(values)
@@ -0,0 +1,25 @@
+"""JSON encoding with orjson, for API responses, cached payloads and exports"""
+
+from typing import Any
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+# Types orjson does not know itself (pydantic models, sets, Decimals) go through FastAPI's encoder
+def _default(value):
+    encoded = jsonable_encoder(value)
+    if encoded is value:
+        raise TypeError(f"{type(value).__name__} is not JSON serializable")
+    return encoded
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=OPTIONS)
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson (the app's default response class)"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,99 @@
+import csv
+import io
+import zlib
+from typing import Iterable, Iterator, List, Optional
+
+from encoding import dumps
+
+# Content types of the supported export formats
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# CSV columns per export, in the order the API returns fields
+COLUMNS = {
+    "students": ["id", "name", "phone", "email", "hourlyRate", "active", "enrolledClasses", "createdAt"],
+    "classes": ["id", "name", "dayOfWeek", "startTime", "endTime", "studentIds", "createdAt"],
+    "sessions": ["id", "classId", "date", "startTime", "endTime", "hoursWorked", "createdAt"],
+    "attendance": ["id", "sessionId", "studentId", "status", "createdAt"],
+    "payments": ["id", "studentId", "amount", "date", "notes", "createdAt"],
+    "payroll": ["studentId", "studentName", "hours", "hourlyRate", "earnings"],
+}
+
+# Encoded output is handed on in chunks of about this size
+CHUNK_BYTES = 64 * 1024
+
+# ==================== Encoding ====================
+
+def encode_rows(batches: Iterable[List[dict]], fmt: str, columns: List[str]) -> Iterator[bytes]:
+    """Encode batches of rows as NDJSON or CSV, yielding chunks of about CHUNK_BYTES.
+
+    Only one chunk is held at a time, so memory does not grow with the
+    number of rows.
+    """
+    if fmt != "csv":
+        yield from _ndjson_chunks(batches)
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    for batch in batches:
+        for row in batch:
+            writer.writerow([_csv_value(row.get(column)) for column in columns])
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+def _ndjson_chunks(batches: Iterable[List[dict]]) -> Iterator[bytes]:
+    chunk = bytearray()
+    for batch in batches:
+        for row in batch:
+            chunk += dumps(row)
+            chunk += b"\n"
+        if len(chunk) >= CHUNK_BYTES:
+            yield bytes(chunk)
+            chunk.clear()
+    if chunk:
+        yield bytes(chunk)
+
+def _csv_value(value):
+    if isinstance(value, list):
+        return ";".join(str(v) for v in value)
+    return value
+
+def gzip_stream(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Compress a byte stream into one gzip member, chunk by chunk"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+# ==================== Filters ====================
+
+def only_sessions(batches: Iterable[List[dict]], session_ids: set) -> Iterator[List[dict]]:
+    """Attendance batches reduced to records of the given sessions"""
+    for batch in batches:
+        kept = [a for a in batch if a["sessionId"] in session_ids]
+        if kept:
+            yield kept
+
+def attendance_between(store, between: tuple) -> Iterator[List[dict]]:
+    """Attendance batches of sessions dated within `between`.
+
+    The session ids are gathered when iteration starts, so a streamed export
+    does that work on the streaming thread rather than in the request handler.
+    """
+    session_ids = {s["id"] for batch in store["sessions"].scan(between=between) for s in batch}
+    yield from only_sessions(store["attendance"].scan(), session_ids)
+
+def content_disposition(name: str, fmt: str) -> str:
+    return f'attachment; filename="{name}.{fmt}"'
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    return "gzip" in (accept_encoding or "").lower()
@@ -0,0 +1,267 @@
+"""Offline check and repair of the references between the collections of a data directory"""
+
+import argparse
+import json
+import os
+import re
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import orjson
+
+import metrics
+import snapshot
+from storage import Store, dump_collection_tmp, fsync_dir, replace_file
+
+# ==================== Streaming reads ====================
+
+_WHITESPACE = re.compile(r"\s*")
+_DECODER = json.JSONDecoder()
+
+class _JSONStream:
+    """Values of a JSON file parsed one at a time from a sliding buffer"""
+
+    CHUNK = 1 << 20
+
+    def __init__(self, f):
+        self.f = f
+        self.buffer = ""
+        self.pos = 0
+
+    def _fill(self) -> bool:
+        chunk = self.f.read(self.CHUNK)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """The next character that is not whitespace"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError(f"{self.f.name}: unexpected end of file")
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"{self.f.name}: expected {char!r}, found {self.buffer[self.pos]!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number at the end of the buffer may go on in the next chunk
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+def json_records(filepath: str, name: str) -> Iterator[dict]:
+    """The records of a {name: [records]} JSON file one at a time"""
+    started = time.perf_counter()
+    with open(filepath, encoding="utf-8") as f:
+        stream = _JSONStream(f)
+        stream.expect("{")
+        if stream.peek() != "}":
+            while True:
+                key = stream.value()
+                stream.expect(":")
+                if key == name and stream.peek() == "[":
+                    stream.pos += 1
+                    if stream.peek() != "]":
+                        while True:
+                            yield stream.value()
+                            if stream.peek() == "]":
+                                break
+                            stream.expect(",")
+                    stream.pos += 1
+                else:
+                    stream.value()
+                if stream.peek() == "}":
+                    break
+                stream.expect(",")
+        metrics.record_io("read", filepath, f.tell(), time.perf_counter() - started)
+
+def _journal(filepath: str) -> List[dict]:
+    """Entries of a journal file, stopping at a torn final line (like storage.read_journal, without cutting it off)"""
+    entries = []
+    try:
+        f = open(filepath, "rb")
+    except FileNotFoundError:
+        return entries
+    with f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                entries.append(orjson.loads(line))
+            except ValueError:
+                break
+    return entries
+
+class _Source:
+    """One collection's files, read as Collection._load would see them"""
+
+    def __init__(self, data_dir: str, name: str, file_format: str):
+        self.name = name
+        extension = snapshot.EXTENSION if file_format == "msgpack" else ".json"
+        self.path = os.path.join(data_dir, f"{name}{extension}")
+        other = os.path.join(data_dir, f"{name}{'.json' if file_format == 'msgpack' else snapshot.EXTENSION}")
+        self.source = self.path if os.path.exists(self.path) or not os.path.exists(other) else other
+        self.journal_path = os.path.join(data_dir, f"{name}.journal")
+        self.has_journal = os.path.exists(self.journal_path)
+
+    def _snapshot(self) -> Iterable[dict]:
+        if not os.path.exists(self.source):
+            return ()
+        if self.source.endswith(snapshot.EXTENSION):
+            return snapshot.iter_records(self.source, self.name)
+        return json_records(self.source, self.name)
+
+    def records(self) -> Iterator[dict]:
+        """The snapshot's records with the journal applied: updates in place, deletes
+        skipped, records (re)inserted by the journal at the end, in journal order"""
+        # id -> [record, whether it stays at its snapshot position]; deleted ids are dropped
+        final: Dict[str, list] = {}
+        touched = set()
+        for entry in _journal(self.journal_path):
+            if entry["op"] == "delete":
+                final.pop(entry["id"], None)
+                touched.add(entry["id"])
+                continue
+            record = entry["record"]
+            if record["id"] in final:
+                final[record["id"]][0] = record
+            else:
+                final[record["id"]] = [record, record["id"] not in touched]
+                touched.add(record["id"])
+        emitted = set()
+        for record in self._snapshot():
+            record_id = record["id"]
+            if record_id not in touched:
+                yield record
+            elif record_id not in emitted:
+                emitted.add(record_id)
+                change = final.get(record_id)
+                if change is not None and change[1]:
+                    yield change[0]
+        for record_id, (record, in_place) in final.items():
+            if not (in_place and record_id in emitted):
+                yield record
+
+    def dump_tmp(self, records: Iterable[dict]) -> str:
+        """Write `records` durably, in the chosen format, to a temp file and return its path"""
+        if self.path.endswith(snapshot.EXTENSION):
+            return snapshot.dump_records_tmp(self.path, self.name, records)
+        return dump_collection_tmp(self.path, self.name, records)
+
+    def install(self, tmp_path: str):
+        """Make a file written by dump_tmp the collection's snapshot, dropping its journal"""
+        replace_file(tmp_path, self.path)
+        if self.source != self.path:
+            os.replace(self.source, f"{self.source}.bak")
+        if self.has_journal:
+            os.remove(self.journal_path)
+            fsync_dir(os.path.dirname(self.journal_path))
+
+# ==================== Scan ====================
+
+def _relink(records: List[dict], field: str, valid: set, linked: Dict[str, list]) -> int:
+    """Give each record's list `field` only ids in `valid`, plus the ids in `linked[record id]`
+    it misses; returns how many records changed"""
+    fixed = 0
+    for i, record in enumerate(records):
+        listed = record.get(field) or []
+        kept = list(dict.fromkeys(x for x in listed if x in valid))
+        kept += [x for x in linked.get(record["id"], []) if x not in kept]
+        if kept != listed:
+            records[i] = {**record, field: kept}
+            fixed += 1
+    return fixed
+
+def scan(data_dir: str, repair: bool = False, file_format: Optional[str] = None) -> Dict[str, dict]:
+    """Find (and with `repair`, fix) broken references in `data_dir`.
+
+    Returns {collection: {"records", "orphans", "fixed"}}: records read,
+    records whose parent is missing (removed when repairing, with whatever
+    depends on them), and records whose enrolment list was wrong. Students
+    and classes are held in memory; the other collections are streamed, and
+    written back the same way when repairing.
+    """
+    file_format = file_format or snapshot.detect_format(data_dir)
+    sources = {name: _Source(data_dir, name, file_format) for name in Store.COLLECTIONS}
+    summary = {name: {"records": 0, "orphans": 0, "fixed": 0} for name in Store.COLLECTIONS}
+
+    students = list(sources["students"].records())
+    classes = list(sources["classes"].records())
+    student_ids = {s["id"] for s in students}
+    class_ids = {c["id"] for c in classes}
+    # Enrolments named on either side, between records that exist
+    enrolled: Dict[str, list] = {}
+    members: Dict[str, list] = {}
+    for cls in classes:
+        for student_id in cls.get("studentIds") or []:
+            if student_id in student_ids:
+                enrolled.setdefault(student_id, []).append(cls["id"])
+    for student in students:
+        for class_id in student.get("enrolledClasses") or []:
+            if class_id in class_ids:
+                members.setdefault(class_id, []).append(student["id"])
+    summary["students"].update(records=len(students), fixed=_relink(students, "enrolledClasses", class_ids, enrolled))
+    summary["classes"].update(records=len(classes), fixed=_relink(classes, "studentIds", student_ids, members))
+    for name, records in (("students", students), ("classes", classes)):
+        if repair and (summary[name]["fixed"] or sources[name].has_journal):
+            sources[name].install(sources[name].dump_tmp(records))
+
+    # Children, each checked against the parents kept so far (Store.CASCADES)
+    parents = {"students": student_ids, "classes": class_ids}
+    session_ids = set()
+    parents["sessions"] = session_ids
+    references = {child: [] for child in ("sessions", "attendance", "payments")}
+    for parent, children in Store.CASCADES.items():
+        for child, field in children:
+            references[child].append((field, parents[parent]))
+
+    for name in ("sessions", "attendance", "payments"):
+        counts = summary[name]
+        checks = references[name]
+
+        def kept(source=sources[name], counts=counts, checks=checks, name=name):
+            for record in source.records():
+                counts["records"] += 1
+                if any(record.get(field) is not None and record[field] not in ids for field, ids in checks):
+                    counts["orphans"] += 1
+                    continue
+                if name == "sessions":
+                    session_ids.add(record["id"])
+                yield record
+
+        if repair:
+            # Written to a temp file as it is read; only kept if something changed
+            tmp_path = sources[name].dump_tmp(kept())
+            if counts["orphans"] or sources[name].has_journal:
+                sources[name].install(tmp_path)
+            else:
+                os.remove(tmp_path)
+        else:
+            for _ in kept():
+                pass
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find, and optionally remove, orphaned records in a data directory")
+    parser.add_argument("--data-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+    parser.add_argument("--repair", action="store_true", help="rewrite the files without the problems found")
+    args = parser.parse_args()
+
+    for name, counts in scan(args.data_dir, repair=args.repair).items():
+        print(f"{name}: {counts['records']} records, {counts['orphans']} orphaned, {counts['fixed']} enrolment lists fixed")
@@ -1,13 +1,35 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Body, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List
+from fastapi.responses import Response, StreamingResponse
+from starlette.middleware import Middleware
+from pydantic import BaseModel, ValidationError
+from starlette.concurrency import run_in_threadpool
+from typing import Any, Optional, List
 from datetime import datetime, date
-import json
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import hashlib
 import os
+import re
 import uuid
+from urllib.parse import unquote
 
-app = FastAPI(title="Tuition Tracker API")
+import analytics
+import bulk
+import changes
+import encoding
+import export
+import metrics
+import paging
+import schedule
+import tenants
+from cache import ResponseCache, etag_matches, make_etag
+from storage import ConstraintError, Store, WouldBlock, deferred_commits, nonblocking
+from sqlite_store import SQLiteStore
+
+# Responses are encoded with orjson (see encoding.py)
+app = FastAPI(title="Tuition Tracker API", default_response_class=encoding.ORJSONResponse)
 
 # CORS middleware for React frontend
 # Update GITHUB_PAGES_URL with your actual GitHub Pages URL after deployment
@@ -27,42 +49,231 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Data directory path - works both locally and on PythonAnywhere
-DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
-
-# Ensure data directory exists
-os.makedirs(DATA_DIR, exist_ok=True)
+# Data directory path - works both locally and on PythonAnywhere; TUITION_DATA_DIR points elsewhere
+DATA_DIR = os.environ.get("TUITION_DATA_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
 
 # ==================== Utility Functions ====================
 
-# Default empty data structures
-DEFAULT_DATA = {
-    "students.json": {"students": []},
-    "classes.json": {"classes": []},
-    "sessions.json": {"sessions": []},
-    "attendance.json": {"attendance": []},
-    "payments.json": {"payments": []},
-}
-
-def read_json(filename: str) -> dict:
-    filepath = os.path.join(DATA_DIR, filename)
-    # Create file with default data if it doesn't exist
-    if not os.path.exists(filepath):
-        default = DEFAULT_DATA.get(filename, {})
-        with open(filepath, "w") as f:
-            json.dump(default, f, indent=2)
-        return default
-    with open(filepath, "r") as f:
-        return json.load(f)
-
-def write_json(filename: str, data: dict):
-    filepath = os.path.join(DATA_DIR, filename)
-    with open(filepath, "w") as f:
-        json.dump(data, f, indent=2, default=str)
+# Storage mode: "json" rewrites a collection file on every change, "journal"
+# appends each change to a per-collection log that is compacted periodically,
+# "sqlite" keeps everything in a local SQLite database (see sqlite_store.py)
+STORAGE_MODE = os.environ.get("TUITION_STORAGE", "json")
+SQLITE_PATH = os.environ.get("TUITION_DB", os.path.join(DATA_DIR, "tuition.db"))
+# How long the per-collection writer waits to gather concurrent changes into one disk write
+COMMIT_WINDOW = float(os.environ.get("TUITION_COMMIT_WINDOW_MS", "2")) / 1000
+# Keep attendance and sessions in typed columns instead of dicts (see tables.py); set to 0 to disable
+COMPACT_RECORDS = os.environ.get("TUITION_COMPACT", "1") != "0"
+# Data file format: "json" or "msgpack" binary snapshots (see snapshot.py), converted on first start
+FILE_FORMAT = os.environ.get("TUITION_FORMAT", "json")
+# Requests sending this token in an X-Profile header are run under cProfile; unset disables profiling
+PROFILE_TOKEN = os.environ.get("TUITION_PROFILE_TOKEN", "")
+PROFILE_DIR = os.environ.get("TUITION_PROFILE_DIR", os.path.join(DATA_DIR, "profiles"))
+# Change events kept for /api/changes, and an optional file they are also logged to (kept across restarts)
+CHANGES_RETAINED = int(os.environ.get("TUITION_CHANGES_RETAINED", "10000"))
+CHANGES_LOG = os.environ.get("TUITION_CHANGES_LOG", "")
+# Number of server processes sharing the data directory. Above 1, collections are locked across
+# processes and kept coherent through a shared counter file (see coherence.py); set it to the
+# worker count whenever the app runs under several workers, however they are started
+WORKERS = int(os.environ.get("TUITION_WORKERS", "1"))
+# Serve many tutors from one process: requests pick a tenant by X-Tenant header or /tenants/<id>
+# path prefix, each tenant having its own directory under TUITION_TENANTS_DIR (see tenants.py)
+TENANTS = os.environ.get("TUITION_TENANTS", "0") != "0"
+TENANTS_DIR = os.environ.get("TUITION_TENANTS_DIR", os.path.join(DATA_DIR, "tenants"))
+# Tenant stores kept open at most, and the memory their loaded collections may take together
+TENANTS_OPEN = int(os.environ.get("TUITION_TENANTS_OPEN", "100"))
+TENANTS_MEMORY_MB = float(os.environ.get("TUITION_TENANTS_MEMORY_MB", "1024"))
+
+# Per-route request counts and latencies for /api/metrics
+app.add_middleware(metrics.MetricsMiddleware,
+                   profiler=metrics.RequestProfiler(PROFILE_TOKEN, PROFILE_DIR) if PROFILE_TOKEN else None)
+
+def open_store(data_dir: str, db_path: str):
+    if STORAGE_MODE == "sqlite":
+        return SQLiteStore(db_path)
+    # Collections are loaded once and served from memory; see storage.py
+    return Store(data_dir, journal=STORAGE_MODE == "journal", commit_window=COMMIT_WINDOW,
+                 compact=COMPACT_RECORDS, file_format=FILE_FORMAT, shared=WORKERS > 1)
+
+def open_change_feed(store, log_path: str):
+    """Every change to the store, numbered, for clients syncing deltas (see changes.py).
+    None with several workers: each would number only the changes it made itself."""
+    if WORKERS > 1:
+        return None
+    return changes.ChangeFeed(store, CHANGES_RETAINED, log_path or None)
+
+store = open_store(DATA_DIR, SQLITE_PATH)
+change_feed = open_change_feed(store, CHANGES_LOG)
+
+if TENANTS:
+    def open_tenant(path: str) -> tenants.Tenant:
+        tenant_store = open_store(path, os.path.join(path, "tuition.db"))
+        log_path = os.path.join(path, os.path.basename(CHANGES_LOG)) if CHANGES_LOG else ""
+        return tenants.Tenant(tenant_store, open_change_feed(tenant_store, log_path))
+
+    tenant_stores = tenants.TenantStores(TENANTS_DIR, open_tenant, TENANTS_OPEN, int(TENANTS_MEMORY_MB * 1024 * 1024))
+    # Innermost, so CORS headers and request metrics also cover requests it rejects
+    app.user_middleware.append(Middleware(tenants.TenantMiddleware, tenants=tenant_stores))
+    # The routes below use `store` and `change_feed`, which now resolve to the request's tenant
+    store = tenants.TenantLocal("store", store)
+    change_feed = tenants.TenantLocal("change_feed", change_feed)
+    metrics.REGISTRY.gauge("tuition_tenants_open", "Tenant stores currently open", (),
+                           lambda: {(): len(tenant_stores)})
+    metrics.REGISTRY.gauge("tuition_tenant_memory_bytes", "Estimated memory held by each open tenant's collections",
+                           ("tenant",), lambda: {(tenant_id,): size for tenant_id, size in tenant_stores.sizes().items()})
+
+@app.exception_handler(ConstraintError)
+def constraint_error_handler(request: Request, exc: ConstraintError):
+    return encoding.ORJSONResponse(status_code=400, content={"detail": str(exc)})
 
 def generate_id() -> str:
     return str(uuid.uuid4())[:8]
 
+def bulk_response(created: List[dict], errors: List[dict]) -> Response:
+    """Response of the bulk endpoints: the records created and the rows rejected, with reasons"""
+    return encoding.ORJSONResponse({"created": created, "errors": errors})
+
+async def bulk_create(*args, **kwargs) -> Response:
+    """bulk.bulk_insert on the thread pool, rendering its response there too: encoding
+    tens of thousands of records on the event loop would hold up every other request"""
+    return await run_blocking(lambda: bulk_response(*bulk.bulk_insert(store, *args, **kwargs)))
+
+# ==================== Async Execution ====================
+
+# Reports run on their own small pool, so a burst of slow reports queues up
+# there instead of occupying the threads and event loop that serve everything else
+REPORT_WORKERS = int(os.environ.get("TUITION_REPORT_WORKERS", "4"))
+report_executor = ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix="report")
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run blocking work on the server's thread pool (inline while the request is being profiled)"""
+    if metrics.profiling():
+        return fn(*args, **kwargs)
+    return await run_in_threadpool(fn, *args, **kwargs)
+
+# Reads and writes only run on the event loop when they cannot wait on another process's lock
+INLINE = store.IN_MEMORY and WORKERS == 1
+
+async def run_read(fn, *args):
+    """Run a quick read: inline when the store is in memory, on the thread pool for SQLite,
+    when other workers share the data, or when it would have to wait (for a collection
+    held by a long write such as a bulk import, or one not loaded yet)"""
+    if INLINE:
+        try:
+            with nonblocking():
+                return fn(*args)
+        except WouldBlock:
+            pass
+    return await run_blocking(fn, *args)
+
+async def run_write(fn, *args):
+    """Run a change without blocking the event loop.
+
+    With the in-memory store the change is applied inline and its disk flush
+    awaited. It goes to the thread pool instead with SQLite or several workers,
+    or when it would have to wait for a collection's lock or first load.
+    """
+    if INLINE:
+        tickets = []
+        try:
+            with nonblocking(), deferred_commits(tickets):
+                return fn(*args)
+        except WouldBlock:
+            pass
+        finally:
+            # Also on errors: whatever was changed before the error is on disk before we answer
+            for ticket in tickets:
+                await asyncio.wrap_future(ticket)
+    return await run_blocking(fn, *args)
+
+async def run_report(fn, *args):
+    """Run a slow computation on the bounded report pool"""
+    if metrics.profiling():
+        return fn(*args)
+    # In the request's context, which names its tenant
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(report_executor, context.run, fn, *args)
+
+# ==================== Response Caching ====================
+
+# Serialized list/report payloads kept in memory, least recently used evicted first
+CACHE_ENTRIES = int(os.environ.get("TUITION_CACHE_ENTRIES", "256"))
+response_cache = ResponseCache(CACHE_ENTRIES)
+
+async def cached_response(request: Request, endpoint: str, collections: List[str], params: tuple, compute,
+                          run=run_report) -> Response:
+    """Serve a GET whose payload depends only on `collections` and `params`.
+
+    The ETag is derived from the collections' versions, so a matching
+    If-None-Match is answered with 304 before anything is read. Otherwise the
+    serialized payload comes from the response cache, or from `compute()`,
+    which is called (and its result serialized) through `run`.
+    """
+    key = (store.epoch, endpoint, params)
+    versions = await run_read(store.versions, collections)
+    etag = make_etag(store.epoch, key, versions)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    body = response_cache.get(key, versions)
+    if body is None:
+        body = await run(lambda: serialized(endpoint, compute))
+        response_cache.put(key, versions, body)
+    return Response(body, media_type="application/json", headers=headers)
+
+def serialized(endpoint: str, compute) -> bytes:
+    """JSON body of compute(), with both steps timed as report sections of `endpoint`"""
+    with metrics.section(endpoint, "compute"):
+        payload = compute()
+    with metrics.section(endpoint, "serialize"):
+        return encoding.dumps(payload)
+
+metrics.REGISTRY.gauge("tuition_response_cache_entries", "Payloads held in the response cache", (),
+                       lambda: {(): len(response_cache)})
+metrics.REGISTRY.gauge("tuition_response_cache_hits_total", "Response cache lookups answered from the cache", (),
+                       lambda: {(): response_cache.hits}, kind="counter")
+metrics.REGISTRY.gauge("tuition_response_cache_misses_total", "Response cache lookups that had to compute", (),
+                       lambda: {(): response_cache.misses}, kind="counter")
+
+# ==================== Listing ====================
+
+MAX_PAGE_SIZE = 1000
+
+async def list_response(request: Request, collection: str, criteria: dict, sort: Optional[str] = None,
+                        limit: Optional[int] = None, cursor: Optional[str] = None, fields: Optional[str] = None,
+                        between: Optional[tuple] = None) -> Response:
+    """Serve a list GET with optional sorting, field projection, range filter and pagination.
+
+    Without `limit` or `cursor` the response is the plain array these
+    endpoints have always returned; with either it is
+    {"items": [...], "nextCursor": ...}, where nextCursor is null on the
+    last page.
+    """
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    field_list = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    
+    def compute():
+        try:
+            after = paging.decode_cursor(cursor, sort) if cursor else None
+            records, position = store[collection].query(criteria, sort, between, after, limit)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        items = paging.project(records, field_list)
+        if limit is None and cursor is None:
+            return items
+        next_cursor = paging.encode_cursor(sort, position) if position is not None else None
+        return {"items": items, "nextCursor": next_cursor}
+    
+    params = (tuple(sorted(criteria.items())), sort, limit, cursor, fields, between)
+    # A page is small enough to build inline; a whole collection may not be
+    run = run_read if limit is not None else run_blocking
+    return await cached_response(request, collection, [collection], params, compute, run)
+
+def date_range(date_from: Optional[str], date_to: Optional[str]) -> Optional[tuple]:
+    if date_from is None and date_to is None:
+        return None
+    return ("date", date_from, date_to)
+
 # ==================== Pydantic Models ====================
 
 class StudentCreate(BaseModel):
@@ -99,6 +310,12 @@ class SessionCreate(BaseModel):
     startTime: str
     endTime: str
 
+class SessionGenerate(BaseModel):
+    startDate: str
+    endDate: str
+    classIds: Optional[List[str]] = None  # default: every class
+    excludeDates: Optional[List[str]] = []  # holidays
+
 class SessionUpdate(BaseModel):
     startTime: Optional[str] = None
     endTime: Optional[str] = None
@@ -123,25 +340,30 @@ class PaymentUpdate(BaseModel):
     date: Optional[str] = None
     notes: Optional[str] = None
 
+class BatchOperation(BaseModel):
+    method: str
+    path: str  # e.g. /api/sessions/<id>
+    body: Optional[Any] = None
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation]
+
 # ==================== Student Routes ====================
 
 @app.get("/api/students")
-def get_students():
-    data = read_json("students.json")
-    return data["students"]
+async def get_students(request: Request, sort: Optional[str] = None, limit: Optional[int] = None,
+                       cursor: Optional[str] = None, fields: Optional[str] = None):
+    return await list_response(request, "students", {}, sort, limit, cursor, fields)
 
 @app.get("/api/students/{student_id}")
-def get_student(student_id: str):
-    data = read_json("students.json")
-    for student in data["students"]:
-        if student["id"] == student_id:
-            return student
-    raise HTTPException(status_code=404, detail="Student not found")
+async def get_student(student_id: str):
+    student = await run_read(store["students"].get, student_id)
+    if student is None:
+        raise HTTPException(status_code=404, detail="Student not found")
+    return student
 
-@app.post("/api/students")
-def create_student(student: StudentCreate):
-    data = read_json("students.json")
-    new_student = {
+def new_student(student: StudentCreate) -> dict:
+    return {
         "id": generate_id(),
         "name": student.name,
         "phone": student.phone,
@@ -151,49 +373,59 @@ def create_student(student: StudentCreate):
         "enrolledClasses": [],
         "createdAt": datetime.now().isoformat()
     }
-    data["students"].append(new_student)
-    write_json("students.json", data)
-    return new_student
+
+def apply_create_student(student: StudentCreate) -> dict:
+    return store["students"].insert(new_student(student))
+
+@app.post("/api/students")
+async def create_student(student: StudentCreate):
+    return await run_write(apply_create_student, student)
+
+@app.post("/api/students/bulk")
+async def bulk_create_students(rows: List[Any] = Body(...)):
+    """Create many students with one write; rows matching an existing name, email and phone are rejected"""
+    return await bulk_create(
+        "students", rows, lambda row: new_student(StudentCreate.model_validate(row)),
+        ("name", "email", "phone"), generate_id,
+    )
+
+def apply_update_student(student_id: str, student: StudentUpdate) -> dict:
+    update_data = student.model_dump(exclude_unset=True)
+    updated = store.update("students", student_id, update_data)
+    if updated is None:
+        raise HTTPException(status_code=404, detail="Student not found")
+    return updated
 
 @app.put("/api/students/{student_id}")
-def update_student(student_id: str, student: StudentUpdate):
-    data = read_json("students.json")
-    for i, s in enumerate(data["students"]):
-        if s["id"] == student_id:
-            update_data = student.model_dump(exclude_unset=True)
-            data["students"][i].update(update_data)
-            write_json("students.json", data)
-            return data["students"][i]
-    raise HTTPException(status_code=404, detail="Student not found")
+async def update_student(student_id: str, student: StudentUpdate):
+    return await run_write(apply_update_student, student_id, student)
+
+def apply_delete_student(student_id: str) -> dict:
+    # Also deletes the student's attendance and payments, and takes them off class lists
+    deleted = store.delete("students", student_id)
+    if deleted is None:
+        raise HTTPException(status_code=404, detail="Student not found")
+    return {"message": "Student deleted", "student": deleted}
 
 @app.delete("/api/students/{student_id}")
-def delete_student(student_id: str):
-    data = read_json("students.json")
-    for i, s in enumerate(data["students"]):
-        if s["id"] == student_id:
-            deleted = data["students"].pop(i)
-            write_json("students.json", data)
-            return {"message": "Student deleted", "student": deleted}
-    raise HTTPException(status_code=404, detail="Student not found")
+async def delete_student(student_id: str):
+    return await run_write(apply_delete_student, student_id)
 
 # ==================== Class Routes ====================
 
 @app.get("/api/classes")
-def get_classes():
-    data = read_json("classes.json")
-    return data["classes"]
+async def get_classes(request: Request, sort: Optional[str] = None, limit: Optional[int] = None,
+                      cursor: Optional[str] = None, fields: Optional[str] = None):
+    return await list_response(request, "classes", {}, sort, limit, cursor, fields)
 
 @app.get("/api/classes/{class_id}")
-def get_class(class_id: str):
-    data = read_json("classes.json")
-    for cls in data["classes"]:
-        if cls["id"] == class_id:
-            return cls
-    raise HTTPException(status_code=404, detail="Class not found")
+async def get_class(class_id: str):
+    cls = await run_read(store["classes"].get, class_id)
+    if cls is None:
+        raise HTTPException(status_code=404, detail="Class not found")
+    return cls
 
-@app.post("/api/classes")
-def create_class(cls: ClassCreate):
-    data = read_json("classes.json")
+def apply_create_class(cls: ClassCreate) -> dict:
     new_class = {
         "id": generate_id(),
         "name": cls.name,
@@ -203,215 +435,248 @@ def create_class(cls: ClassCreate):
         "studentIds": cls.studentIds or [],
         "createdAt": datetime.now().isoformat()
     }
-    data["classes"].append(new_class)
-    write_json("classes.json", data)
     
-    # Update enrolled classes for each student
-    if cls.studentIds:
-        students_data = read_json("students.json")
-        for student in students_data["students"]:
-            if student["id"] in cls.studentIds:
-                if new_class["id"] not in student["enrolledClasses"]:
-                    student["enrolledClasses"].append(new_class["id"])
-        write_json("students.json", students_data)
-    
-    return new_class
+    # Also adds the class to each student's enrolled classes
+    return store.insert("classes", new_class)
+
+@app.post("/api/classes")
+async def create_class(cls: ClassCreate):
+    return await run_write(apply_create_class, cls)
+
+def apply_update_class(class_id: str, cls: ClassUpdate) -> dict:
+    update_data = cls.model_dump(exclude_unset=True)
+    updated = store.update("classes", class_id, update_data)
+    if updated is None:
+        raise HTTPException(status_code=404, detail="Class not found")
+    return updated
 
 @app.put("/api/classes/{class_id}")
-def update_class(class_id: str, cls: ClassUpdate):
-    data = read_json("classes.json")
-    for i, c in enumerate(data["classes"]):
-        if c["id"] == class_id:
-            update_data = cls.model_dump(exclude_unset=True)
-            data["classes"][i].update(update_data)
-            write_json("classes.json", data)
-            return data["classes"][i]
-    raise HTTPException(status_code=404, detail="Class not found")
+async def update_class(class_id: str, cls: ClassUpdate):
+    return await run_write(apply_update_class, class_id, cls)
+
+def apply_delete_class(class_id: str) -> dict:
+    # Also deletes the class's sessions (and their attendance), and takes it off enrolled classes
+    deleted = store.delete("classes", class_id)
+    if deleted is None:
+        raise HTTPException(status_code=404, detail="Class not found")
+    return {"message": "Class deleted", "class": deleted}
 
 @app.delete("/api/classes/{class_id}")
-def delete_class(class_id: str):
-    data = read_json("classes.json")
-    for i, c in enumerate(data["classes"]):
-        if c["id"] == class_id:
-            deleted = data["classes"].pop(i)
-            write_json("classes.json", data)
-            return {"message": "Class deleted", "class": deleted}
-    raise HTTPException(status_code=404, detail="Class not found")
+async def delete_class(class_id: str):
+    return await run_write(apply_delete_class, class_id)
 
 # ==================== Session Routes ====================
 
 @app.get("/api/sessions")
-def get_sessions(date: Optional[str] = None, class_id: Optional[str] = None):
-    data = read_json("sessions.json")
-    sessions = data["sessions"]
-    
+async def get_sessions(request: Request, date: Optional[str] = None, class_id: Optional[str] = None,
+                       date_from: Optional[str] = Query(None, alias="from"), date_to: Optional[str] = Query(None, alias="to"),
+                       sort: Optional[str] = None, limit: Optional[int] = None,
+                       cursor: Optional[str] = None, fields: Optional[str] = None):
+    criteria = {}
     if date:
-        sessions = [s for s in sessions if s["date"] == date]
+        criteria["date"] = date
     if class_id:
-        sessions = [s for s in sessions if s["classId"] == class_id]
+        criteria["classId"] = class_id
     
-    return sessions
+    return await list_response(request, "sessions", criteria, sort, limit, cursor, fields, date_range(date_from, date_to))
 
 @app.get("/api/sessions/{session_id}")
-def get_session(session_id: str):
-    data = read_json("sessions.json")
-    for session in data["sessions"]:
-        if session["id"] == session_id:
-            return session
-    raise HTTPException(status_code=404, detail="Session not found")
+async def get_session(session_id: str):
+    session = await run_read(store["sessions"].get, session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session
 
-@app.post("/api/sessions")
-def create_session(session: SessionCreate):
-    data = read_json("sessions.json")
-    
-    # Calculate hours worked
-    start = datetime.strptime(session.startTime, "%H:%M")
-    end = datetime.strptime(session.endTime, "%H:%M")
-    hours_worked = round((end - start).seconds / 3600, 2)
-    
-    new_session = {
+def session_hours(start_time: str, end_time: str) -> float:
+    start = datetime.strptime(start_time, "%H:%M")
+    end = datetime.strptime(end_time, "%H:%M")
+    return round((end - start).seconds / 3600, 2)
+
+def new_session(session: SessionCreate) -> dict:
+    return {
         "id": generate_id(),
         "classId": session.classId,
         "date": session.date,
         "startTime": session.startTime,
         "endTime": session.endTime,
-        "hoursWorked": hours_worked,
+        "hoursWorked": session_hours(session.startTime, session.endTime),
         "createdAt": datetime.now().isoformat()
     }
-    data["sessions"].append(new_session)
-    write_json("sessions.json", data)
-    return new_session
+
+def apply_create_session(session: SessionCreate) -> dict:
+    return store["sessions"].insert(new_session(session))
+
+@app.post("/api/sessions")
+async def create_session(session: SessionCreate):
+    return await run_write(apply_create_session, session)
+
+@app.post("/api/sessions/bulk")
+async def bulk_create_sessions(rows: List[Any] = Body(...)):
+    """Create many sessions with one write; a second session of a class at the same date and start time is rejected"""
+    return await bulk_create(
+        "sessions", rows, lambda row: new_session(SessionCreate.model_validate(row)),
+        ("classId", "date", "startTime"), generate_id, references={"classId": "classes"},
+    )
+
+@app.post("/api/sessions/generate")
+async def generate_sessions(spec: SessionGenerate):
+    """Create every class's weekly sessions between two dates with a single write.
+    
+    Dates that already have a session of the class (looked up in the
+    (classId, date) index) and excludeDates are skipped.
+    """
+    return await run_blocking(lambda: encoding.ORJSONResponse(planned_sessions(spec)))
+
+def planned_sessions(spec: SessionGenerate) -> dict:
+    try:
+        start = schedule.parse_date(spec.startDate)
+        end = schedule.parse_date(spec.endDate)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="startDate and endDate must be YYYY-MM-DD")
+    excluded = spec.excludeDates or []
+    invalid = schedule.first_invalid_date(excluded)
+    if invalid is not None:
+        raise HTTPException(status_code=400, detail=f"Invalid exclude date: {invalid}")
+    
+    errors = []
+    if spec.classIds is None:
+        classes = store["classes"].all()
+    else:
+        classes = store["classes"].get_many(spec.classIds)
+        found = {c["id"] for c in classes}
+        errors.extend({"classId": i, "detail": "Class not found"} for i in dict.fromkeys(spec.classIds) if i not in found)
+    
+    planned = []
+    created_at = datetime.now().isoformat()
+    for cls in classes:
+        try:
+            # Times are parsed once per class, not once per session
+            hours_worked = session_hours(cls["startTime"], cls["endTime"])
+            dates = list(schedule.weekly_dates(cls["dayOfWeek"], start, end, excluded))
+        except ValueError as exc:
+            errors.append({"classId": cls["id"], "detail": str(exc)})
+            continue
+        planned.extend({
+            "id": generate_id(),
+            "classId": cls["id"],
+            "date": session_date,
+            "startTime": cls["startTime"],
+            "endTime": cls["endTime"],
+            "hoursWorked": hours_worked,
+            "createdAt": created_at
+        } for session_date in dates)
+    
+    sessions = store["sessions"]
+    with sessions.lock:
+        existing = sessions.existing_keys(("classId", "date"), {(s["classId"], s["date"]) for s in planned})
+        created = [s for s in planned if (s["classId"], s["date"]) not in existing]
+        skipped = [{"classId": s["classId"], "date": s["date"]} for s in planned if (s["classId"], s["date"]) in existing]
+        created = bulk.assign_unique_ids(sessions, created, generate_id)
+        sessions.insert_many(created)
+    
+    return {"created": created, "skipped": skipped, "errors": errors}
+
+def apply_update_session(session_id: str, session: SessionUpdate) -> dict:
+    sessions = store["sessions"]
+    with sessions.lock:
+        s = sessions.get(session_id)
+        if s is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+        update_data = session.model_dump(exclude_unset=True)
+        
+        # Recalculate hours if times changed
+        start_time = update_data.get("startTime", s["startTime"])
+        end_time = update_data.get("endTime", s["endTime"])
+        update_data["hoursWorked"] = session_hours(start_time, end_time)
+        
+        return sessions.update(session_id, update_data)
 
 @app.put("/api/sessions/{session_id}")
-def update_session(session_id: str, session: SessionUpdate):
-    data = read_json("sessions.json")
-    for i, s in enumerate(data["sessions"]):
-        if s["id"] == session_id:
-            update_data = session.model_dump(exclude_unset=True)
-            
-            # Recalculate hours if times changed
-            start_time = update_data.get("startTime", s["startTime"])
-            end_time = update_data.get("endTime", s["endTime"])
-            start = datetime.strptime(start_time, "%H:%M")
-            end = datetime.strptime(end_time, "%H:%M")
-            update_data["hoursWorked"] = round((end - start).seconds / 3600, 2)
-            
-            data["sessions"][i].update(update_data)
-            write_json("sessions.json", data)
-            return data["sessions"][i]
-    raise HTTPException(status_code=404, detail="Session not found")
+async def update_session(session_id: str, session: SessionUpdate):
+    return await run_write(apply_update_session, session_id, session)
+
+def apply_delete_session(session_id: str) -> dict:
+    # Also deletes related attendance records
+    deleted = store.delete("sessions", session_id)
+    if deleted is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"message": "Session deleted", "session": deleted}
 
 @app.delete("/api/sessions/{session_id}")
-def delete_session(session_id: str):
-    data = read_json("sessions.json")
-    for i, s in enumerate(data["sessions"]):
-        if s["id"] == session_id:
-            deleted = data["sessions"].pop(i)
-            write_json("sessions.json", data)
-            
-            # Also delete related attendance records
-            att_data = read_json("attendance.json")
-            att_data["attendance"] = [a for a in att_data["attendance"] if a["sessionId"] != session_id]
-            write_json("attendance.json", att_data)
-            
-            return {"message": "Session deleted", "session": deleted}
-    raise HTTPException(status_code=404, detail="Session not found")
+async def delete_session(session_id: str):
+    return await run_write(apply_delete_session, session_id)
 
 # ==================== Attendance Routes ====================
 
 @app.get("/api/attendance")
-def get_attendance(session_id: Optional[str] = None, student_id: Optional[str] = None):
-    data = read_json("attendance.json")
-    attendance = data["attendance"]
-    
+async def get_attendance(request: Request, session_id: Optional[str] = None, student_id: Optional[str] = None,
+                         sort: Optional[str] = None, limit: Optional[int] = None,
+                         cursor: Optional[str] = None, fields: Optional[str] = None):
+    criteria = {}
     if session_id:
-        attendance = [a for a in attendance if a["sessionId"] == session_id]
+        criteria["sessionId"] = session_id
     if student_id:
-        attendance = [a for a in attendance if a["studentId"] == student_id]
+        criteria["studentId"] = student_id
     
-    return attendance
+    return await list_response(request, "attendance", criteria, sort, limit, cursor, fields)
 
-@app.post("/api/attendance")
-def create_attendance(attendance: AttendanceCreate):
-    data = read_json("attendance.json")
-    
-    # Check if attendance already exists for this session/student
-    for a in data["attendance"]:
-        if a["sessionId"] == attendance.sessionId and a["studentId"] == attendance.studentId:
-            raise HTTPException(status_code=400, detail="Attendance already recorded")
-    
-    new_attendance = {
+def new_attendance(attendance: AttendanceCreate) -> dict:
+    return {
         "id": generate_id(),
         "sessionId": attendance.sessionId,
         "studentId": attendance.studentId,
         "status": attendance.status,
         "createdAt": datetime.now().isoformat()
     }
-    data["attendance"].append(new_attendance)
-    write_json("attendance.json", data)
-    return new_attendance
+
+def apply_create_attendance(attendance: AttendanceCreate) -> dict:
+    records = store["attendance"]
+    with records.lock:
+        # Check if attendance already exists for this session/student
+        if records.find(sessionId=attendance.sessionId, studentId=attendance.studentId):
+            raise HTTPException(status_code=400, detail="Attendance already recorded")
+        
+        return records.insert(new_attendance(attendance))
+
+@app.post("/api/attendance")
+async def create_attendance(attendance: AttendanceCreate):
+    return await run_write(apply_create_attendance, attendance)
+
+def apply_update_attendance(attendance_id: str, attendance: AttendanceUpdate) -> dict:
+    updated = store["attendance"].update(attendance_id, {"status": attendance.status})
+    if updated is None:
+        raise HTTPException(status_code=404, detail="Attendance not found")
+    return updated
 
 @app.put("/api/attendance/{attendance_id}")
-def update_attendance(attendance_id: str, attendance: AttendanceUpdate):
-    data = read_json("attendance.json")
-    for i, a in enumerate(data["attendance"]):
-        if a["id"] == attendance_id:
-            data["attendance"][i]["status"] = attendance.status
-            write_json("attendance.json", data)
-            return data["attendance"][i]
-    raise HTTPException(status_code=404, detail="Attendance not found")
+async def update_attendance(attendance_id: str, attendance: AttendanceUpdate):
+    return await run_write(apply_update_attendance, attendance_id, attendance)
 
 @app.post("/api/attendance/bulk")
-def bulk_create_attendance(attendances: List[AttendanceCreate]):
-    data = read_json("attendance.json")
-    created = []
-    
-    for attendance in attendances:
-        # Skip if already exists
-        exists = any(
-            a["sessionId"] == attendance.sessionId and a["studentId"] == attendance.studentId
-            for a in data["attendance"]
-        )
-        if exists:
-            continue
-            
-        new_attendance = {
-            "id": generate_id(),
-            "sessionId": attendance.sessionId,
-            "studentId": attendance.studentId,
-            "status": attendance.status,
-            "createdAt": datetime.now().isoformat()
-        }
-        data["attendance"].append(new_attendance)
-        created.append(new_attendance)
-    
-    write_json("attendance.json", data)
-    return created
+async def bulk_create_attendance(attendances: List[AttendanceCreate]):
+    # Records that already exist, on disk or earlier in this batch, are skipped
+    return await run_blocking(lambda: encoding.ORJSONResponse(bulk.bulk_insert(
+        store, "attendance", attendances, new_attendance, ("sessionId", "studentId"), generate_id)[0]))
 
 # ==================== Payment Routes ====================
 
 @app.get("/api/payments")
-def get_payments(student_id: Optional[str] = None):
-    data = read_json("payments.json")
-    payments = data["payments"]
-    
-    if student_id:
-        payments = [p for p in payments if p["studentId"] == student_id]
-    
-    return payments
+async def get_payments(request: Request, student_id: Optional[str] = None,
+                       date_from: Optional[str] = Query(None, alias="from"), date_to: Optional[str] = Query(None, alias="to"),
+                       sort: Optional[str] = None, limit: Optional[int] = None,
+                       cursor: Optional[str] = None, fields: Optional[str] = None):
+    criteria = {"studentId": student_id} if student_id else {}
+    return await list_response(request, "payments", criteria, sort, limit, cursor, fields, date_range(date_from, date_to))
 
 @app.get("/api/payments/{payment_id}")
-def get_payment(payment_id: str):
-    data = read_json("payments.json")
-    for payment in data["payments"]:
-        if payment["id"] == payment_id:
-            return payment
-    raise HTTPException(status_code=404, detail="Payment not found")
+async def get_payment(payment_id: str):
+    payment = await run_read(store["payments"].get, payment_id)
+    if payment is None:
+        raise HTTPException(status_code=404, detail="Payment not found")
+    return payment
 
-@app.post("/api/payments")
-def create_payment(payment: PaymentCreate):
-    data = read_json("payments.json")
-    new_payment = {
+def new_payment(payment: PaymentCreate) -> dict:
+    return {
         "id": generate_id(),
         "studentId": payment.studentId,
         "amount": payment.amount,
@@ -419,179 +684,404 @@ def create_payment(payment: PaymentCreate):
         "notes": payment.notes,
         "createdAt": datetime.now().isoformat()
     }
-    data["payments"].append(new_payment)
-    write_json("payments.json", data)
-    return new_payment
+
+def apply_create_payment(payment: PaymentCreate) -> dict:
+    return store["payments"].insert(new_payment(payment))
+
+@app.post("/api/payments")
+async def create_payment(payment: PaymentCreate):
+    return await run_write(apply_create_payment, payment)
+
+@app.post("/api/payments/bulk")
+async def bulk_create_payments(rows: List[Any] = Body(...)):
+    """Create many payments with one write; a payment repeating student, date, amount and notes is rejected"""
+    return await bulk_create(
+        "payments", rows, lambda row: new_payment(PaymentCreate.model_validate(row)),
+        ("studentId", "date", "amount", "notes"), generate_id, references={"studentId": "students"},
+    )
+
+def apply_update_payment(payment_id: str, payment: PaymentUpdate) -> dict:
+    update_data = payment.model_dump(exclude_unset=True)
+    updated = store["payments"].update(payment_id, update_data)
+    if updated is None:
+        raise HTTPException(status_code=404, detail="Payment not found")
+    return updated
 
 @app.put("/api/payments/{payment_id}")
-def update_payment(payment_id: str, payment: PaymentUpdate):
-    data = read_json("payments.json")
-    for i, p in enumerate(data["payments"]):
-        if p["id"] == payment_id:
-            update_data = payment.model_dump(exclude_unset=True)
-            data["payments"][i].update(update_data)
-            write_json("payments.json", data)
-            return data["payments"][i]
-    raise HTTPException(status_code=404, detail="Payment not found")
+async def update_payment(payment_id: str, payment: PaymentUpdate):
+    return await run_write(apply_update_payment, payment_id, payment)
+
+def apply_delete_payment(payment_id: str) -> dict:
+    deleted = store["payments"].delete(payment_id)
+    if deleted is None:
+        raise HTTPException(status_code=404, detail="Payment not found")
+    return {"message": "Payment deleted", "payment": deleted}
 
 @app.delete("/api/payments/{payment_id}")
-def delete_payment(payment_id: str):
-    data = read_json("payments.json")
-    for i, p in enumerate(data["payments"]):
-        if p["id"] == payment_id:
-            deleted = data["payments"].pop(i)
-            write_json("payments.json", data)
-            return {"message": "Payment deleted", "payment": deleted}
-    raise HTTPException(status_code=404, detail="Payment not found")
+async def delete_payment(payment_id: str):
+    return await run_write(apply_delete_payment, payment_id)
 
-# ==================== Reports/Dashboard Routes ====================
+# ==================== Batch Routes ====================
 
-@app.get("/api/reports/payroll")
-def get_payroll_report(start_date: str, end_date: str):
-    """Calculate payroll for a date range"""
-    sessions_data = read_json("sessions.json")
-    attendance_data = read_json("attendance.json")
-    students_data = read_json("students.json")
-    classes_data = read_json("classes.json")
+# Most operations a single batch may carry
+BATCH_MAX_OPERATIONS = int(os.environ.get("TUITION_BATCH_MAX_OPERATIONS", "1000"))
+
+# Routes a batch operation may name: method, path, body model (None for no body)
+# and the function the route runs
+BATCH_ROUTES = [
+    ("POST", "/api/students", StudentCreate, apply_create_student),
+    ("PUT", "/api/students/{id}", StudentUpdate, apply_update_student),
+    ("DELETE", "/api/students/{id}", None, apply_delete_student),
+    ("POST", "/api/classes", ClassCreate, apply_create_class),
+    ("PUT", "/api/classes/{id}", ClassUpdate, apply_update_class),
+    ("DELETE", "/api/classes/{id}", None, apply_delete_class),
+    ("POST", "/api/sessions", SessionCreate, apply_create_session),
+    ("PUT", "/api/sessions/{id}", SessionUpdate, apply_update_session),
+    ("DELETE", "/api/sessions/{id}", None, apply_delete_session),
+    ("POST", "/api/attendance", AttendanceCreate, apply_create_attendance),
+    ("PUT", "/api/attendance/{id}", AttendanceUpdate, apply_update_attendance),
+    ("POST", "/api/payments", PaymentCreate, apply_create_payment),
+    ("PUT", "/api/payments/{id}", PaymentUpdate, apply_update_payment),
+    ("DELETE", "/api/payments/{id}", None, apply_delete_payment),
+]
+BATCH_PATTERNS = [
+    (method, re.compile(re.escape(path).replace(re.escape("{id}"), "([^/]+)") + "/?"), model, fn)
+    for method, path, model, fn in BATCH_ROUTES
+]
+
+class BatchFailed(Exception):
+    """Operation `index` of a batch failed, so none of the batch was applied"""
+
+    def __init__(self, index: int, status_code: int, detail: str):
+        super().__init__(detail)
+        self.index = index
+        self.status_code = status_code
+        self.detail = detail
+
+def batch_call(index: int, operation: BatchOperation) -> tuple:
+    """(function, arguments) of the route an operation names, with its body validated"""
+    method = operation.method.upper()
+    for route_method, pattern, model, fn in BATCH_PATTERNS:
+        match = pattern.fullmatch(operation.path)
+        if match is None or route_method != method:
+            continue
+        args = [unquote(value) for value in match.groups()]
+        if model is not None:
+            try:
+                args.append(model.model_validate(operation.body if operation.body is not None else {}))
+            except ValidationError as exc:
+                raise BatchFailed(index, 422, bulk.describe_error(exc))
+        return fn, args
+    raise BatchFailed(index, 404, f"No batch operation for {method} {operation.path}")
+
+def apply_batch(calls: List[tuple], key: Optional[str], fingerprint: str) -> tuple:
+    """Run the calls in one all-or-nothing batch. Returns (results, whether they were replayed)."""
+    with store.batch(key) as batch:
+        if batch.replayed is not None:
+            if batch.replayed["fingerprint"] != fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different batch")
+            return batch.replayed["results"], True
+        results = []
+        for index, (fn, args) in enumerate(calls):
+            try:
+                results.append({"status": 200, "body": fn(*args)})
+            except HTTPException as exc:
+                raise BatchFailed(index, exc.status_code, exc.detail)
+            except ConstraintError as exc:
+                raise BatchFailed(index, 400, str(exc))
+        batch.result = {"fingerprint": fingerprint, "results": results}
+    return results, False
+
+def batch_failure(failure: BatchFailed, count: int) -> Response:
+    """Answer for a failed batch: the failed operation's status, and a result per operation"""
+    results = [{"status": 424, "body": {"detail": f"Not applied: operation {failure.index} failed"}}] * count
+    results[failure.index] = {"status": failure.status_code, "body": {"detail": failure.detail}}
+    return encoding.ORJSONResponse({"detail": f"Operation {failure.index} failed: {failure.detail}", "results": results},
+                                   status_code=failure.status_code)
+
+@app.post("/api/batch")
+async def run_batch(request: Request, spec: BatchRequest):
+    """Apply create/update/delete operations of the routes above, in order and all or nothing.
     
-    # Filter sessions by date range
-    sessions = [
-        s for s in sessions_data["sessions"]
-        if start_date <= s["date"] <= end_date
-    ]
+    Each collection the batch changes is written once. With an
+    Idempotency-Key header, the results are kept for a day and a retry with
+    the same key and operations gets them back instead of applying the batch again.
+    """
+    if len(spec.operations) > BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_OPERATIONS} operations per batch")
+    key = request.headers.get("idempotency-key")
+    if key is not None and not 0 < len(key) <= 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key must be 1 to 255 characters")
+    fingerprint = hashlib.sha1(encoding.dumps(spec.model_dump())).hexdigest()
+    try:
+        calls = [batch_call(index, operation) for index, operation in enumerate(spec.operations)]
+        results, replayed = await run_write(apply_batch, calls, key, fingerprint)
+    except BatchFailed as failure:
+        return batch_failure(failure, len(spec.operations))
+    return encoding.ORJSONResponse({"results": results}, headers={"Idempotent-Replayed": "true"} if replayed else None)
+
+# ==================== Export Routes ====================
+
+def export_response(request: Request, name: str, fmt: str, batches) -> StreamingResponse:
+    """Stream batches of rows as an NDJSON or CSV download, gzipped if the client accepts it"""
+    chunks = export.encode_rows(batches, fmt, export.COLUMNS[name])
+    headers = {"Content-Disposition": export.content_disposition(name, fmt), "Vary": "Accept-Encoding"}
+    if export.accepts_gzip(request.headers.get("accept-encoding")):
+        chunks = export.gzip_stream(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(chunks, media_type=export.FORMATS[fmt], headers=headers)
+
+def check_export_format(fmt: str):
+    if fmt not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(export.FORMATS)}")
+
+@app.get("/api/export/payroll")
+async def export_payroll(request: Request, format: str = "csv",
+                         date_from: Optional[str] = Query(None, alias="from"), date_to: Optional[str] = Query(None, alias="to")):
+    """Payroll rows for a date range (all sessions by default)"""
+    check_export_format(format)
     
-    # Create a map of student hourly rates
-    student_rates = {s["id"]: s["hourlyRate"] for s in students_data["students"]}
-    student_names = {s["id"]: s["name"] for s in students_data["students"]}
+    def batches():
+        yield store.payroll_report(date_from or "", date_to or "\uffff")["students"]
     
-    # Calculate earnings per student
-    student_hours = {}
-    for session in sessions:
-        session_attendance = [
-            a for a in attendance_data["attendance"]
-            if a["sessionId"] == session["id"] and a["status"] in ["present", "late"]
-        ]
-        for att in session_attendance:
-            student_id = att["studentId"]
-            if student_id not in student_hours:
-                student_hours[student_id] = 0
-            student_hours[student_id] += session["hoursWorked"]
+    return export_response(request, "payroll", format, batches())
+
+@app.get("/api/export/{collection}")
+async def export_collection(request: Request, collection: str, format: str = "ndjson",
+                            date_from: Optional[str] = Query(None, alias="from"), date_to: Optional[str] = Query(None, alias="to")):
+    """Every record of a collection, streamed in collection order.
     
-    # Calculate total earnings
-    report = []
-    total_hours = 0
-    total_earnings = 0
+    `from`/`to` filter sessions and payments by date, and attendance by the
+    date of its session.
+    """
+    if collection not in store.COLLECTIONS:
+        raise HTTPException(status_code=404, detail="Collection not found")
+    check_export_format(format)
+    between = date_range(date_from, date_to)
     
-    for student_id, hours in student_hours.items():
-        rate = student_rates.get(student_id, 0)
-        earnings = hours * rate
-        report.append({
-            "studentId": student_id,
-            "studentName": student_names.get(student_id, "Unknown"),
-            "hours": hours,
-            "hourlyRate": rate,
-            "earnings": earnings
-        })
-        total_hours += hours
-        total_earnings += earnings
+    if between is None:
+        batches = store[collection].scan()
+    elif collection in ("sessions", "payments"):
+        batches = store[collection].scan(between=between)
+    elif collection == "attendance":
+        batches = export.attendance_between(store, between)
+    else:
+        raise HTTPException(status_code=400, detail=f"{collection} cannot be filtered by date")
     
-    return {
-        "startDate": start_date,
-        "endDate": end_date,
-        "students": report,
-        "totalHours": total_hours,
-        "totalEarnings": total_earnings
-    }
+    return export_response(request, collection, format, batches)
+
+# ==================== Reports/Dashboard Routes ====================
+
+BALANCE_COLLECTIONS = ["students", "sessions", "attendance", "payments"]
+
+@app.get("/api/reports/payroll")
+async def get_payroll_report(request: Request, start_date: str, end_date: str):
+    """Calculate payroll for a date range"""
+    return await cached_response(request, "payroll", ["students", "sessions", "attendance"], (start_date, end_date),
+                                 lambda: store.payroll_report(start_date, end_date))
 
 @app.get("/api/reports/student-balance/{student_id}")
-def get_student_balance(student_id: str):
+async def get_student_balance(request: Request, student_id: str):
     """Get balance for a specific student"""
-    sessions_data = read_json("sessions.json")
-    attendance_data = read_json("attendance.json")
-    payments_data = read_json("payments.json")
-    students_data = read_json("students.json")
-    
-    # Get student info
-    student = None
-    for s in students_data["students"]:
-        if s["id"] == student_id:
-            student = s
-            break
+    def compute():
+        balance = store.student_balance(student_id)
+        if balance is None:
+            raise HTTPException(status_code=404, detail="Student not found")
+        return balance
     
-    if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
-    
-    # Calculate total hours attended
-    total_hours = 0
-    for session in sessions_data["sessions"]:
-        attendance = next(
-            (a for a in attendance_data["attendance"]
-             if a["sessionId"] == session["id"] and a["studentId"] == student_id and a["status"] in ["present", "late"]),
-            None
-        )
-        if attendance:
-            total_hours += session["hoursWorked"]
-    
-    # Calculate total due
-    total_due = total_hours * student["hourlyRate"]
-    
-    # Calculate total paid
-    total_paid = sum(
-        p["amount"] for p in payments_data["payments"]
-        if p["studentId"] == student_id
-    )
-    
-    return {
-        "studentId": student_id,
-        "studentName": student["name"],
-        "hourlyRate": student["hourlyRate"],
-        "totalHours": total_hours,
-        "totalDue": total_due,
-        "totalPaid": total_paid,
-        "balance": total_due - total_paid
-    }
+    return await cached_response(request, "student-balance", BALANCE_COLLECTIONS, (student_id,), compute)
+
+@app.get("/api/reports/balances")
+async def get_balances(request: Request):
+    """Get balances for every student in one response"""
+    return await cached_response(request, "balances", BALANCE_COLLECTIONS, (), store.all_balances)
+
+@app.post("/api/reports/balances/check")
+async def check_balances():
+    """Rebuild the balance aggregates from scratch and report any drift from the maintained ones"""
+    return await run_report(store.check_balances)
+
+def analytics_window(start: Optional[str], end: Optional[str], bucket: str):
+    """Validate the shared parameters of the analytics reports"""
+    if bucket not in analytics.BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of: {', '.join(analytics.BUCKETS)}")
+    invalid = schedule.first_invalid_date(d for d in (start, end) if d is not None)
+    if invalid is not None:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {invalid}")
+
+@app.get("/api/reports/attendance-rates")
+async def get_attendance_rates(request: Request, start: Optional[str] = Query(None, alias="from"),
+                               end: Optional[str] = Query(None, alias="to"), bucket: str = "month"):
+    """Attendance counts and rate per class and period"""
+    analytics_window(start, end, bucket)
+    return await cached_response(request, "attendance-rates", ["classes", "sessions", "attendance"], (start, end, bucket),
+                                 lambda: {"from": start, "to": end, "bucket": bucket,
+                                          "classes": store.analytics.attendance_rates(start, end, bucket)})
+
+@app.get("/api/reports/attendance-trends")
+async def get_attendance_trends(request: Request, start: Optional[str] = Query(None, alias="from"),
+                                end: Optional[str] = Query(None, alias="to"), bucket: str = "week",
+                                classId: Optional[str] = None, studentId: Optional[str] = None):
+    """Present/late/absent counts per period, optionally for one class or student"""
+    analytics_window(start, end, bucket)
+    return await cached_response(request, "attendance-trends", ["sessions", "attendance"],
+                                 (start, end, bucket, classId, studentId),
+                                 lambda: {"from": start, "to": end, "bucket": bucket,
+                                          "periods": store.analytics.attendance_trends(start, end, bucket, classId, studentId)})
+
+@app.get("/api/reports/revenue")
+async def get_revenue(request: Request, start: Optional[str] = Query(None, alias="from"),
+                      end: Optional[str] = Query(None, alias="to"), bucket: str = "month"):
+    """Payments received per student and period"""
+    analytics_window(start, end, bucket)
+
+    def compute():
+        rows = store.analytics.revenue(start, end, bucket)
+        return {"from": start, "to": end, "bucket": bucket, "students": rows,
+                "totalAmount": sum(r["amount"] for r in rows)}
+
+    return await cached_response(request, "revenue", ["students", "payments"], (start, end, bucket), compute)
 
 @app.get("/api/dashboard")
-def get_dashboard():
+async def get_dashboard(request: Request):
     """Get dashboard summary data"""
     from datetime import datetime
     today = datetime.now().strftime("%Y-%m-%d")
     day_of_week = datetime.now().strftime("%A")
     
-    students_data = read_json("students.json")
-    classes_data = read_json("classes.json")
-    sessions_data = read_json("sessions.json")
-    payments_data = read_json("payments.json")
+    # The summary also depends on the date, so it is part of the cache key
+    return await cached_response(request, "dashboard", ["students", "classes", "sessions", "payments"],
+                                 (today, day_of_week), lambda: dashboard_summary(today, day_of_week))
+
+def dashboard_summary(today: str, day_of_week: str) -> dict:
+    """Dashboard payload for the given date"""
+    with metrics.section("dashboard", "load"):
+        students = store["students"].all()
+        classes = store["classes"].all()
+        payments = store["payments"].all()
     
     # Active students count
-    active_students = len([s for s in students_data["students"] if s.get("active", True)])
+    active_students = len([s for s in students if s.get("active", True)])
     
     # Today's classes
-    todays_classes = [c for c in classes_data["classes"] if c["dayOfWeek"] == day_of_week]
+    todays_classes = [c for c in classes if c["dayOfWeek"] == day_of_week]
     
     # Today's sessions
-    todays_sessions = [s for s in sessions_data["sessions"] if s["date"] == today]
+    with metrics.section("dashboard", "todays_sessions"):
+        todays_sessions = store["sessions"].find(date=today)
     
     # Total hours this month
     month_start = today[:8] + "01"
-    month_sessions = [s for s in sessions_data["sessions"] if s["date"] >= month_start]
-    total_hours_month = sum(s["hoursWorked"] for s in month_sessions)
+    with metrics.section("dashboard", "hours_month"):
+        total_hours_month = store.hours_between(month_start, None)
     
     # Recent payments
-    recent_payments = sorted(payments_data["payments"], key=lambda x: x["date"], reverse=True)[:5]
+    with metrics.section("dashboard", "recent_payments"):
+        recent_payments = sorted(payments, key=lambda x: x["date"], reverse=True)[:5]
     
     return {
         "today": today,
         "dayOfWeek": day_of_week,
         "activeStudents": active_students,
-        "totalClasses": len(classes_data["classes"]),
+        "totalClasses": len(classes),
         "todaysClasses": todays_classes,
         "todaysSessions": todays_sessions,
         "totalHoursMonth": total_hours_month,
         "recentPayments": recent_payments
     }
 
+# ==================== Change Feed Routes ====================
+
+# Longest a long-poll may wait, and how often an idle event stream sends a keepalive comment
+MAX_CHANGES_WAIT = 60.0
+KEEPALIVE_SECONDS = 15.0
+
+def resync_payload() -> dict:
+    return {"epoch": change_feed.epoch, "events": [], "next": change_feed.seq, "resync": True}
+
+async def change_stream(since: int, stale: bool, names: Optional[set], limit: int):
+    """Server-Sent Events: one `change` event per change, or a final `resync` event"""
+    position = since
+    while True:
+        page = None if stale else change_feed.read(position, limit, names)
+        if page is None:
+            yield changes.sse("resync", resync_payload())
+            return
+        if page["events"]:
+            yield b"".join(changes.sse("change", event, event["seq"]) for event in page["events"])
+        position = page["next"]
+        if not await change_feed.wait(position, KEEPALIVE_SECONDS):
+            yield b": keepalive\n\n"
+
+@app.get("/api/changes")
+async def get_changes(request: Request, since: Optional[int] = None, epoch: Optional[str] = None,
+                      wait: float = 0, limit: int = MAX_PAGE_SIZE, collections: Optional[str] = None):
+    """Changes made after sequence number `since`.
+
+    Returns {"epoch", "events", "next", "resync"}; pass `next` back as
+    `since` (and `epoch` as `epoch`). Without `since` the response only
+    carries the current sequence number to start from. With `wait` (seconds)
+    the request is held until there is a change or the time is up. If the
+    changes after `since` are no longer retained, or `epoch` belongs to an
+    earlier run of the server, `resync` is true: refetch the collections and
+    continue from `next`. With `Accept: text/event-stream` the changes are
+    streamed as Server-Sent Events instead (a reconnecting EventSource's
+    Last-Event-ID takes the place of `since`).
+    """
+    if WORKERS > 1:
+        raise HTTPException(status_code=501, detail="The change feed is not available with TUITION_WORKERS above 1")
+    if not 0 <= wait <= MAX_CHANGES_WAIT:
+        raise HTTPException(status_code=400, detail=f"wait must be between 0 and {MAX_CHANGES_WAIT:g} seconds")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    names = {name.strip() for name in collections.split(",") if name.strip()} if collections else None
+    unknown = sorted((names or set()) - set(store.COLLECTIONS))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown collection: {', '.join(unknown)}")
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id:
+        try:
+            since = int(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Last-Event-ID must be a sequence number")
+    if since is None:
+        since = change_feed.seq
+    stale = epoch is not None and epoch != change_feed.epoch
+    
+    if "text/event-stream" in request.headers.get("accept", ""):
+        return StreamingResponse(change_stream(since, stale, names, limit), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    if stale:
+        return resync_payload()
+    page = change_feed.read(since, limit, names)
+    deadline = asyncio.get_running_loop().time() + wait
+    while page is not None and not page["events"]:
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0 or not await change_feed.wait(page["next"], remaining):
+            break
+        page = change_feed.read(page["next"], limit, names)
+    if page is None:
+        return resync_payload()
+    return {**page, "resync": False}
+
+if WORKERS == 1:
+    metrics.REGISTRY.gauge("tuition_changes_sequence", "Sequence number of the latest change event", (),
+                           lambda: {(): change_feed.seq}, kind="counter")
+    metrics.REGISTRY.gauge("tuition_changes_waiting", "Long-polls and event streams waiting for a change", (),
+                           lambda: {(): change_feed.waiting})
+
+# ==================== Metrics Routes ====================
+
+metrics.REGISTRY.gauge("tuition_records", "Records currently held per collection", ("collection",),
+                       lambda: {(name,): len(store[name]) for name in store.COLLECTIONS})
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Request, storage, report and cache metrics in the Prometheus text format"""
+    return Response(await run_read(metrics.REGISTRY.render), media_type=metrics.CONTENT_TYPE)
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    # Several workers have to be started from the import string, each importing the app itself
+    uvicorn.run(app if WORKERS == 1 else "main:app", host="0.0.0.0", port=8001, workers=WORKERS)
 
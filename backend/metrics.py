@@ -0,0 +1,263 @@
+"""Request, storage and report instrumentation, exposed in the Prometheus text format"""
+
+import bisect
+import contextvars
+import cProfile
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# ==================== Metric types ====================
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Counter:
+    """Monotonic totals, one per combination of label values"""
+
+    TYPE = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0.0)
+
+    def lines(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+class Histogram:
+    """Observation counts per bucket, plus their sum and count, per combination of label values"""
+
+    TYPE = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, *label_values) -> int:
+        series = self._series.get(label_values)
+        return sum(series[0]) if series else 0
+
+    def lines(self) -> Iterator[str]:
+        with self._lock:
+            series = sorted((values, (list(counts), total)) for values, (counts, total) in self._series.items())
+        names = self.labels + ("le",)
+        for label_values, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(names, label_values + (_format_value(bound),))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, label_values)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labels, label_values)} {cumulative}"
+
+class Gauge:
+    """Values read when the metrics are rendered: `read()` returns {label values: value}.
+
+    `kind` is "counter" for totals kept elsewhere (e.g. the response cache's hit count).
+    """
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...], read: Callable[[], Dict[tuple, float]],
+                 kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.read = read
+        self.TYPE = kind
+
+    def lines(self) -> Iterator[str]:
+        for label_values, value in sorted(self.read().items()):
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+class Registry:
+    """The process's metrics (see REGISTRY), rendered without prometheus_client"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Histogram:
+        return self._add(Histogram(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Tuple[str, ...], read: Callable[[], Dict[tuple, float]],
+              kind: str = "gauge") -> Gauge:
+        """Register (or replace) a metric whose values come from `read` at render time"""
+        return self._add(Gauge(name, help, labels, read, kind))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.TYPE}")
+            lines.extend(metric.lines())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "tuition_http_requests_total", "HTTP requests by method, route template and status code",
+    ("method", "route", "status"))
+HTTP_DURATION = REGISTRY.histogram(
+    "tuition_http_request_duration_seconds", "Time from receiving a request to sending the last byte of its response",
+    ("method", "route"))
+STORAGE_OPERATIONS = REGISTRY.counter(
+    "tuition_storage_operations_total", "Data file reads and writes (JSON or snapshot files and journals)", ("op", "file"))
+STORAGE_BYTES = REGISTRY.counter(
+    "tuition_storage_bytes_total", "Bytes read from and written to data files", ("op", "file"))
+STORAGE_DURATION = REGISTRY.histogram(
+    "tuition_storage_duration_seconds", "Time spent reading or writing (including fsync) a data file", ("op", "file"))
+SECTION_DURATION = REGISTRY.histogram(
+    "tuition_report_section_duration_seconds", "Time spent in each section of report computations",
+    ("report", "section"))
+
+# ==================== Recording ====================
+
+def record_io(op: str, filepath: str, nbytes: int, seconds: float):
+    """Count one read or write of a data file"""
+    name = os.path.basename(filepath)
+    STORAGE_OPERATIONS.inc(op, name)
+    STORAGE_BYTES.inc(op, name, amount=nbytes)
+    STORAGE_DURATION.observe(seconds, op, name)
+
+@contextmanager
+def section(report: str, name: str):
+    """Time the enclosed block as section `name` of `report`"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        SECTION_DURATION.observe(time.perf_counter() - started, report, name)
+
+# ==================== Middleware ====================
+
+# Set while the current request is being profiled, so blocking work it
+# starts runs on the profiled thread instead of in a pool
+_profiling = contextvars.ContextVar("profiling", default=False)
+
+def profiling() -> bool:
+    return _profiling.get()
+
+class RequestProfiler:
+    """cProfile capture of single requests that send `X-Profile: <token>`.
+
+    The stats are written to `directory` as <time>-<method>-<path>.prof and
+    the file name is returned in an X-Profile-File response header. Only one
+    request is profiled at a time; a request arriving meanwhile is served
+    normally. The profiler sees the event loop thread, so a capture also
+    includes whatever other requests ran there meanwhile: use it on a quiet
+    server.
+    """
+
+    def __init__(self, token: str, directory: str):
+        self.token = token
+        self.directory = directory
+        self.lock = threading.Lock()
+
+    def wanted(self, scope) -> bool:
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                return bool(self.token) and value.decode("latin-1") == self.token
+        return False
+
+    def filename(self, scope) -> str:
+        path = re.sub(r"[^A-Za-z0-9]+", "_", scope["path"]).strip("_")
+        return f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{scope['method']}-{path}.prof"
+
+class MetricsMiddleware:
+    """ASGI middleware recording every HTTP request's route, status and duration.
+
+    Requests are labelled with their route template (/api/students/{student_id}),
+    never the raw path, so the number of series stays bounded; requests that
+    match no route are labelled "unmatched".
+    """
+
+    def __init__(self, app, profiler: Optional[RequestProfiler] = None):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = filename = None
+        if self.profiler is not None and self.profiler.wanted(scope) and self.profiler.lock.acquire(blocking=False):
+            profile = cProfile.Profile()
+            filename = self.profiler.filename(scope)
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if filename is not None:
+                    message = {**message, "headers": list(message.get("headers", [])) + [(b"x-profile-file", filename.encode())]}
+            await send(message)
+
+        started = time.perf_counter()
+        token = _profiling.set(True) if profile is not None else None
+        try:
+            if profile is not None:
+                profile.enable()
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if profile is not None:
+                profile.disable()
+                _profiling.reset(token)
+                try:
+                    os.makedirs(self.profiler.directory, exist_ok=True)
+                    profile.dump_stats(os.path.join(self.profiler.directory, filename))
+                finally:
+                    self.profiler.lock.release()
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUESTS.inc(scope["method"], route, str(status[0]))
+            HTTP_DURATION.observe(time.perf_counter() - started, scope["method"], route)
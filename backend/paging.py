@@ -0,0 +1,80 @@
+import base64
+import json
+from bisect import bisect_left, bisect_right
+from typing import Callable, Iterable, List, Optional, Tuple
+
+# Fields each collection can be sorted by
+SORT_FIELDS = {
+    "students": ("name", "createdAt"),
+    "classes": ("name", "createdAt"),
+    "sessions": ("date", "createdAt"),
+    "attendance": ("createdAt",),
+    "payments": ("date", "createdAt"),
+}
+
+# ==================== Sorting ====================
+
+def parse_sort(collection: str, sort: Optional[str]) -> Tuple[Optional[str], bool]:
+    """(field, descending) for a sort parameter such as "date" or "-createdAt".
+
+    No sort means collection order (field None). Raises ValueError for a
+    field the collection cannot be sorted by.
+    """
+    if not sort:
+        return None, False
+    descending = sort.startswith("-")
+    field = sort.lstrip("-")
+    if field not in SORT_FIELDS.get(collection, ()):
+        raise ValueError(f"{collection} cannot be sorted by {field}")
+    return field, descending
+
+def sort_value(value) -> str:
+    # Missing values sort first, as an empty string would
+    return "" if value is None else value
+
+# ==================== Cursors ====================
+
+def encode_cursor(sort: Optional[str], position: tuple) -> str:
+    """Opaque cursor for the page after `position` (the last sort key returned)"""
+    payload = json.dumps([sort or "", list(position)]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort: Optional[str]) -> tuple:
+    """Position a cursor points after. Raises ValueError if it is malformed or from another sort."""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, position = json.loads(payload)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if cursor_sort != (sort or "") or not isinstance(position, list):
+        raise ValueError("Cursor does not belong to this sort order")
+    return tuple(position)
+
+def paginate(records: List, key: Callable[[object], tuple], descending: bool,
+             after: Optional[tuple], limit: Optional[int]) -> Tuple[List, Optional[tuple]]:
+    """One page of `records` (records or ids), which must be sorted ascending by `key`.
+
+    Returns the page in the requested direction and the key of its last
+    item if more follow. Pages are located by key rather than by
+    offset, so records inserted or deleted between requests never shift a
+    later page.
+    """
+    if descending:
+        end = len(records) if after is None else bisect_left(records, after, key=key)
+        start = 0 if limit is None else max(0, end - limit)
+        page = records[start:end][::-1]
+        more = start > 0
+    else:
+        start = 0 if after is None else bisect_right(records, after, key=key)
+        end = len(records) if limit is None else start + limit
+        page = records[start:end]
+        more = end < len(records)
+    return page, (key(page[-1]) if more and page else None)
+
+# ==================== Projection ====================
+
+def project(records: Iterable[dict], fields: Optional[List[str]]) -> List[dict]:
+    """Records reduced to `fields` (all fields when None)"""
+    if not fields:
+        return list(records)
+    return [{f: r[f] for f in fields if f in r} for r in records]
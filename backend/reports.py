@@ -0,0 +1,102 @@
+from typing import Dict, Iterable, Tuple
+
+# Attendance statuses that count towards billable hours
+COUNTED_STATUSES = ("present", "late")
+
+# Fields the reports and balances read from each collection
+SESSION_FIELDS = ("id", "classId", "date", "hoursWorked")
+ATTENDANCE_FIELDS = ("sessionId", "studentId", "status")
+
+# ==================== Joins ====================
+
+def attended_session_ids(attendance: Iterable[dict]) -> set:
+    """Ids of the sessions a student's attendance records count towards"""
+    return {a["sessionId"] for a in attendance if a["status"] in COUNTED_STATUSES}
+
+def student_hours(sessions: Iterable[dict], attendance: Iterable[dict]) -> Dict[str, float]:
+    """studentId -> hours attended in `sessions`, given their attendance records.
+
+    Both must be in collection order. Attendance is grouped by session once
+    and joined to the sessions through a dict, and the hours are added up
+    as a nested scan of sessions, then attendance, would: students in order
+    of their first counted session, and the same float additions.
+    """
+    attendees = {}
+    for a in attendance:
+        if a["status"] in COUNTED_STATUSES:
+            attendees.setdefault(a["sessionId"], []).append(a["studentId"])
+    hours = {}
+    for session in sessions:
+        for student_id in attendees.get(session["id"], ()):
+            if student_id not in hours:
+                hours[student_id] = 0
+            hours[student_id] += session["hoursWorked"]
+    return hours
+
+def balance_totals(sessions: Iterable[dict], attendance: Iterable[dict],
+                   payments: Iterable[dict]) -> Dict[str, Tuple[float, float]]:
+    """studentId -> (hours attended, total paid), for the students with a counted
+    attendance record or a payment among those given.
+
+    A session counts once per student however many records they have for it.
+    Hours are added in the order of `sessions` and amounts in the order of
+    `payments`, so one student's records give the same floats whether they
+    come alone or with everyone else's.
+    """
+    attendees = {}
+    for a in attendance:
+        if a["status"] in COUNTED_STATUSES:
+            attendees.setdefault(a["sessionId"], set()).add(a["studentId"])
+    hours = {}
+    for session in sessions:
+        for student_id in attendees.get(session["id"], ()):
+            hours[student_id] = hours.get(student_id, 0) + session["hoursWorked"]
+    paid = {}
+    for p in payments:
+        paid[p["studentId"]] = paid.get(p["studentId"], 0) + p["amount"]
+    return {student_id: (hours.get(student_id, 0), paid.get(student_id, 0))
+            for student_id in hours.keys() | paid.keys()}
+
+# ==================== Reports ====================
+
+def payroll_summary(student_hours: Dict[str, float], students: Dict[str, dict],
+                    start_date: str, end_date: str) -> dict:
+    """Payroll response from per-student hours and an id -> student map"""
+    report = []
+    total_hours = 0
+    total_earnings = 0
+
+    for student_id, hours in student_hours.items():
+        student = students.get(student_id)
+        rate = student["hourlyRate"] if student else 0
+        earnings = hours * rate
+        report.append({
+            "studentId": student_id,
+            "studentName": student["name"] if student else "Unknown",
+            "hours": hours,
+            "hourlyRate": rate,
+            "earnings": earnings
+        })
+        total_hours += hours
+        total_earnings += earnings
+
+    return {
+        "startDate": start_date,
+        "endDate": end_date,
+        "students": report,
+        "totalHours": total_hours,
+        "totalEarnings": total_earnings
+    }
+
+def balance_summary(student: dict, total_hours: float, total_paid: float) -> dict:
+    """Balance response for one student"""
+    total_due = total_hours * student["hourlyRate"]
+    return {
+        "studentId": student["id"],
+        "studentName": student["name"],
+        "hourlyRate": student["hourlyRate"],
+        "totalHours": total_hours,
+        "totalDue": total_due,
+        "totalPaid": total_paid,
+        "balance": total_due - total_paid
+    }
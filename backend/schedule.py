@@ -0,0 +1,38 @@
+from datetime import date, timedelta
+from typing import Iterable, Iterator, Optional
+
+# dayOfWeek values as the frontend stores them (datetime's %A names)
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+# ==================== Recurring sessions ====================
+
+def parse_date(value: str) -> date:
+    """A YYYY-MM-DD date; raises ValueError otherwise"""
+    return date.fromisoformat(value)
+
+def weekly_dates(day_of_week: str, start: date, end: date,
+                 excluded: Iterable[str] = ()) -> Iterator[str]:
+    """Every date between start and end (inclusive) falling on `day_of_week`, as YYYY-MM-DD.
+
+    Dates in `excluded` (holidays) are left out. Raises ValueError for an
+    unknown day name.
+    """
+    try:
+        weekday = WEEKDAYS.index(day_of_week)
+    except ValueError:
+        raise ValueError(f"Unknown dayOfWeek: {day_of_week}")
+    excluded = set(excluded)
+    current = start + timedelta(days=(weekday - start.weekday()) % 7)
+    while current <= end:
+        iso = current.isoformat()
+        if iso not in excluded:
+            yield iso
+        current += timedelta(days=7)
+
+def first_invalid_date(values: Iterable[str]) -> Optional[str]:
+    for value in values:
+        try:
+            parse_date(value)
+        except ValueError:
+            return value
+    return None
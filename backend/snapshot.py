@@ -0,0 +1,140 @@
+"""Binary snapshot files: a collection's table in MessagePack, loaded without re-parsing records"""
+
+import argparse
+import os
+import time
+from typing import Iterable, Iterator, Tuple, Union
+
+import msgpack
+
+import metrics
+from tables import SCHEMAS, CompactTable, DictTable, make_table
+
+# A snapshot is a stream of MessagePack objects: a header (see _header), then either one
+# CompactTable.dump() (each column as raw array bytes) or one object per record
+MAGIC = "tuition-snapshot"
+VERSION = 1
+EXTENSION = ".msgpack"
+FORMATS = ("json", "msgpack")
+
+# Upper limit of one object (a column of a large table) when reading
+MAX_OBJECT_BYTES = 2 ** 31 - 1
+
+def _header(name: str, table: str) -> dict:
+    return {"magic": MAGIC, "version": VERSION, "collection": name, "table": table}
+
+def dump_table_tmp(filepath: str, name: str, table: Union[CompactTable, DictTable]) -> str:
+    """Write `table` durably to a temp file next to `filepath` and return its path"""
+    tmp_path = f"{filepath}.{os.getpid()}.tmp"
+    started = time.perf_counter()
+    packer = msgpack.Packer(use_bin_type=True, default=str)
+    with open(tmp_path, "wb") as f:
+        if isinstance(table, CompactTable):
+            f.write(packer.pack(_header(name, "compact")))
+            f.write(packer.pack(table.dump()))
+        else:
+            f.write(packer.pack(_header(name, "records")))
+            for record in table.records():
+                f.write(packer.pack(record))
+        f.flush()
+        os.fsync(f.fileno())
+        metrics.record_io("write", filepath, f.tell(), time.perf_counter() - started)
+    return tmp_path
+
+def dump_records_tmp(filepath: str, name: str, records: Iterable[dict]) -> str:
+    """Like dump_table_tmp, for records given one at a time; read_table lays
+    them out as whichever table the collection uses"""
+    tmp_path = f"{filepath}.{os.getpid()}.tmp"
+    started = time.perf_counter()
+    packer = msgpack.Packer(use_bin_type=True, default=str)
+    with open(tmp_path, "wb") as f:
+        f.write(packer.pack(_header(name, "records")))
+        for record in records:
+            f.write(packer.pack(record))
+        f.flush()
+        os.fsync(f.fileno())
+        metrics.record_io("write", filepath, f.tell(), time.perf_counter() - started)
+    return tmp_path
+
+def _compatible(table: CompactTable, name: str) -> bool:
+    """Whether a loaded table has the column layout this version uses for `name`"""
+    schema = SCHEMAS.get(name)
+    return schema is not None and [(field, type(column)) for field, column in table.columns.items()] == \
+        [(field, type(make())) for field, make in schema]
+
+def _relaid(name: str, compact: bool, records: Iterable[dict]) -> Union[CompactTable, DictTable]:
+    table = make_table(name, compact)
+    for record in records:
+        table.append(record)
+    return table
+
+def _unpacker(f, filepath: str, name: str) -> Tuple[msgpack.Unpacker, str]:
+    """Unpacker positioned after the header of snapshot file `f`, and the header's table kind"""
+    unpacker = msgpack.Unpacker(f, raw=False, strict_map_key=False, max_buffer_size=MAX_OBJECT_BYTES)
+    header = next(unpacker, None)
+    if not isinstance(header, dict) or header.get("magic") != MAGIC:
+        raise ValueError(f"{filepath} is not a snapshot file")
+    if header.get("version") != VERSION or header.get("collection") != name:
+        raise ValueError(f"{filepath} is a version {header.get('version')} snapshot of "
+                         f"{header.get('collection')!r}, expected version {VERSION} of {name!r}")
+    return unpacker, header.get("table")
+
+def read_table(filepath: str, name: str, compact: bool) -> Union[CompactTable, DictTable]:
+    """The table stored in a snapshot file, as make_table(name, compact) would lay it out.
+
+    A compact table written with the current column layout is used as it is;
+    otherwise (TUITION_COMPACT changed, or SCHEMAS did) its records are
+    appended to a new table one by one. Raises ValueError for a file that is
+    not a snapshot of `name`.
+    """
+    started = time.perf_counter()
+    with open(filepath, "rb") as f:
+        unpacker, kind = _unpacker(f, filepath, name)
+        if kind == "compact":
+            table = CompactTable.load(next(unpacker))
+            if not (compact and _compatible(table, name)):
+                table = _relaid(name, compact, table.records())
+        else:
+            table = _relaid(name, compact, unpacker)
+        metrics.record_io("read", filepath, os.fstat(f.fileno()).st_size, time.perf_counter() - started)
+    return table
+
+def iter_records(filepath: str, name: str) -> Iterator[dict]:
+    """The records of a snapshot file one at a time, without building a table
+    (a compact table is one object, so it is still loaded whole)"""
+    started = time.perf_counter()
+    with open(filepath, "rb") as f:
+        unpacker, kind = _unpacker(f, filepath, name)
+        if kind == "compact":
+            yield from CompactTable.load(next(unpacker)).records()
+        else:
+            yield from unpacker
+        metrics.record_io("read", filepath, os.fstat(f.fileno()).st_size, time.perf_counter() - started)
+
+# ==================== Conversion ====================
+
+def detect_format(data_dir: str) -> str:
+    """The format of the data files in `data_dir`: msgpack if there are any snapshot files, else json"""
+    try:
+        names = os.listdir(data_dir)
+    except FileNotFoundError:
+        return "json"
+    return "msgpack" if any(name.endswith(EXTENSION) for name in names) else "json"
+
+def convert(data_dir: str, to: str) -> dict:
+    """Rewrite every collection of `data_dir` in the `to` format, keeping the
+    old files as `.bak`; returns {collection: records}"""
+    from storage import Store
+    store = Store(data_dir, file_format=to)
+    counts = {name: len(store[name]) for name in store.COLLECTIONS}
+    store.flush()
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a data directory between JSON and binary snapshot files")
+    parser.add_argument("--data-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+    parser.add_argument("--to", choices=FORMATS, required=True, help="format to convert the data files to")
+    args = parser.parse_args()
+
+    for name, count in convert(args.data_dir, args.to).items():
+        print(f"{name}: {count} records")
@@ -0,0 +1,688 @@
+"""SQLite storage backend: storage.Store's interface on a database mirroring supabase-schema.sql"""
+
+import argparse
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import orjson
+
+import paging
+import reports
+import snapshot
+from analytics import Analytics
+from storage import IDEMPOTENCY_SECONDS, Batch, ConstraintError, Store
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+  id TEXT PRIMARY KEY,
+  name TEXT NOT NULL,
+  phone TEXT DEFAULT '',
+  email TEXT DEFAULT '',
+  hourly_rate REAL DEFAULT 0,
+  active INTEGER DEFAULT 1,
+  created_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS classes (
+  id TEXT PRIMARY KEY,
+  name TEXT NOT NULL,
+  day_of_week TEXT NOT NULL,
+  start_time TEXT NOT NULL,
+  end_time TEXT NOT NULL,
+  created_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS class_students (
+  class_id TEXT REFERENCES classes(id) ON DELETE CASCADE,
+  student_id TEXT REFERENCES students(id) ON DELETE CASCADE,
+  PRIMARY KEY (class_id, student_id)
+);
+
+CREATE TABLE IF NOT EXISTS sessions (
+  id TEXT PRIMARY KEY,
+  class_id TEXT REFERENCES classes(id) ON DELETE CASCADE,
+  session_date TEXT NOT NULL,
+  start_time TEXT NOT NULL,
+  end_time TEXT NOT NULL,
+  hours_worked REAL NOT NULL,
+  created_at TEXT
+);
+
+-- UNIQUE(session_id, student_id) also serves lookups by session_id
+CREATE TABLE IF NOT EXISTS attendance (
+  id TEXT PRIMARY KEY,
+  session_id TEXT REFERENCES sessions(id) ON DELETE CASCADE,
+  student_id TEXT REFERENCES students(id) ON DELETE CASCADE,
+  status TEXT NOT NULL CHECK (status IN ('present', 'absent', 'late')),
+  created_at TEXT,
+  UNIQUE(session_id, student_id)
+);
+
+CREATE TABLE IF NOT EXISTS payments (
+  id TEXT PRIMARY KEY,
+  student_id TEXT REFERENCES students(id) ON DELETE CASCADE,
+  amount REAL NOT NULL,
+  payment_date TEXT NOT NULL,
+  notes TEXT DEFAULT '',
+  created_at TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_class_students_student ON class_students(student_id);
+CREATE INDEX IF NOT EXISTS idx_sessions_date ON sessions(session_date);
+CREATE INDEX IF NOT EXISTS idx_sessions_class ON sessions(class_id);
+CREATE INDEX IF NOT EXISTS idx_sessions_class_date ON sessions(class_id, session_date);
+CREATE INDEX IF NOT EXISTS idx_attendance_student ON attendance(student_id);
+CREATE INDEX IF NOT EXISTS idx_payments_student ON payments(student_id);
+CREATE INDEX IF NOT EXISTS idx_payments_date ON payments(payment_date);
+
+-- Results of batches sent with an idempotency key (see SQLiteStore.batch)
+CREATE TABLE IF NOT EXISTS batches (
+  key TEXT PRIMARY KEY,
+  result TEXT NOT NULL,
+  created_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_batches_created ON batches(created_at);
+
+CREATE TABLE IF NOT EXISTS collection_versions (
+  name TEXT PRIMARY KEY,
+  version INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Table -> collections whose records it feeds. Triggers bump those collections'
+# versions on every row change, including cascaded deletes and changes made
+# by other processes.
+VERSIONED_TABLES = {
+    "students": ["students"],
+    "classes": ["classes"],
+    "class_students": ["students", "classes"],
+    "sessions": ["sessions"],
+    "attendance": ["attendance"],
+    "payments": ["payments"],
+}
+
+def _version_triggers() -> str:
+    statements = []
+    for table, collections in VERSIONED_TABLES.items():
+        names = ", ".join(f"'{name}'" for name in collections)
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            statements.append(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_version AFTER {event} ON {table} "
+                f"BEGIN UPDATE collection_versions SET version = version + 1 WHERE name IN ({names}); END;"
+            )
+    return "\n".join(statements)
+
+# Record field -> column, in the order the API returns fields. None marks a
+# list field stored in class_students rather than on the row itself.
+FIELDS = {
+    "students": [("id", "id"), ("name", "name"), ("phone", "phone"), ("email", "email"),
+                 ("hourlyRate", "hourly_rate"), ("active", "active"),
+                 ("enrolledClasses", None), ("createdAt", "created_at")],
+    "classes": [("id", "id"), ("name", "name"), ("dayOfWeek", "day_of_week"),
+                ("startTime", "start_time"), ("endTime", "end_time"),
+                ("studentIds", None), ("createdAt", "created_at")],
+    "sessions": [("id", "id"), ("classId", "class_id"), ("date", "session_date"),
+                 ("startTime", "start_time"), ("endTime", "end_time"),
+                 ("hoursWorked", "hours_worked"), ("createdAt", "created_at")],
+    "attendance": [("id", "id"), ("sessionId", "session_id"), ("studentId", "student_id"),
+                   ("status", "status"), ("createdAt", "created_at")],
+    "payments": [("id", "id"), ("studentId", "student_id"), ("amount", "amount"),
+                 ("date", "payment_date"), ("notes", "notes"), ("createdAt", "created_at")],
+}
+
+# List field -> (class_students column holding the owner id, column holding the listed id)
+LINKS = {
+    "students": ("enrolledClasses", "student_id", "class_id"),
+    "classes": ("studentIds", "class_id", "student_id"),
+}
+
+BOOL_FIELDS = {"active"}
+
+# Collections a delete can change through ON DELETE CASCADE (directly or via another cascade)
+CASCADES = {
+    "students": ["classes", "attendance", "payments"],
+    "classes": ["students", "sessions", "attendance"],
+    "sessions": ["attendance"],
+}
+
+# SQLite's default limit on bound parameters is 999
+MAX_PARAMS = 900
+
+class SQLiteCollection:
+    """One table behind the same methods as storage.Collection.
+
+    `listeners` are told about changes made through this object once they
+    are committed (inside SQLiteStore.batch, once the batch commits), as
+    storage.Collection does. Rows removed by a cascade are
+    not read back; the collections they belong to get `reset` instead.
+    """
+
+    def __init__(self, store: "SQLiteStore", name: str):
+        self.store = store
+        self.name = name
+        self.lock = threading.RLock()
+        self.listeners = []
+        self.fields = [(f, c) for f, c in FIELDS[name] if c is not None]
+        self.columns = {f: c for f, c in self.fields}
+        self.link = LINKS.get(name)
+        # Statements are built once so sqlite3's statement cache reuses the prepared form
+        columns = ", ".join(c for _, c in self.fields)
+        self._select = f"SELECT {columns} FROM {name}"
+        self._select_with_rowid = f"SELECT rowid, {columns} FROM {name}"
+        self._insert = "INSERT INTO {} ({}) VALUES ({})".format(
+            name, ", ".join(c for _, c in self.fields), ", ".join("?" for _ in self.fields))
+
+    # ---- row mapping ----
+
+    def _row_values(self, record: dict) -> tuple:
+        values = []
+        for field, _ in self.fields:
+            value = record.get(field)
+            if field in BOOL_FIELDS and value is not None:
+                value = int(bool(value))
+            values.append(value)
+        return tuple(values)
+
+    def _to_records(self, conn: sqlite3.Connection, rows: List[tuple]) -> List[dict]:
+        links = self._links(conn, [row[0] for row in rows]) if self.link else {}
+        records = []
+        for row in rows:
+            values = dict(zip((f for f, _ in self.fields), row))
+            record = {}
+            for field, column in FIELDS[self.name]:
+                if column is None:
+                    record[field] = links.get(values["id"], [])
+                elif field in BOOL_FIELDS and values[field] is not None:
+                    record[field] = bool(values[field])
+                else:
+                    record[field] = values[field]
+            records.append(record)
+        return records
+
+    def _links(self, conn: sqlite3.Connection, ids: List[str]) -> Dict[str, List[str]]:
+        _, owner, other = self.link
+        links = {}
+        for chunk in _chunks(ids):
+            sql = "SELECT {}, {} FROM class_students WHERE {} IN ({}) ORDER BY rowid".format(
+                owner, other, owner, ", ".join("?" for _ in chunk))
+            for owner_id, other_id in conn.execute(sql, chunk):
+                links.setdefault(owner_id, []).append(other_id)
+        return links
+
+    def _set_links(self, conn: sqlite3.Connection, record_id: str, linked_ids: Iterable[str]):
+        _, owner, other = self.link
+        conn.execute("DELETE FROM class_students WHERE {} = ?".format(owner), (record_id,))
+        conn.executemany(
+            "INSERT OR IGNORE INTO class_students ({}, {}) VALUES (?, ?)".format(owner, other),
+            [(record_id, linked_id) for linked_id in linked_ids],
+        )
+
+    def _where(self, criteria: dict):
+        clauses, params = [], []
+        for field, value in criteria.items():
+            column = self.columns.get(field)
+            if column is None:
+                raise ValueError(f"{self.name} cannot be filtered by {field}")
+            clauses.append(f"{column} = ?")
+            params.append(int(bool(value)) if field in BOOL_FIELDS else value)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def _query(self, where: str = "", params=()) -> List[dict]:
+        conn = self.store.connection()
+        rows = conn.execute(f"{self._select}{where} ORDER BY rowid", params).fetchall()
+        return self._to_records(conn, rows)
+
+    # ---- reads ----
+
+    def all(self) -> List[dict]:
+        return self._query()
+
+    def project(self, fields: Tuple[str, ...]) -> List[dict]:
+        """Every record; rows are built whole here, so this is all()"""
+        return self._query()
+
+    def get(self, record_id: str) -> Optional[dict]:
+        records = self._query(" WHERE id = ?", (record_id,))
+        return records[0] if records else None
+
+    def get_many(self, record_ids: Iterable[str]) -> List[dict]:
+        ids = list(set(record_ids))
+        conn = self.store.connection()
+        rows = []
+        for chunk in _chunks(ids):
+            sql = "{} WHERE id IN ({})".format(self._select_with_rowid, ", ".join("?" for _ in chunk))
+            rows.extend(conn.execute(sql, chunk).fetchall())
+        rows.sort(key=lambda row: row[0])
+        return self._to_records(conn, [row[1:] for row in rows])
+
+    def find(self, **criteria) -> List[dict]:
+        where, params = self._where(criteria)
+        return self._query(where, params)
+
+    def query(self, criteria: Optional[dict] = None, sort: Optional[str] = None,
+              between: Optional[Tuple[str, Optional[str], Optional[str]]] = None,
+              after: Optional[tuple] = None, limit: Optional[int] = None) -> Tuple[List[dict], Optional[tuple]]:
+        """One page of matching records; see storage.Collection.query. Positions are rowids."""
+        field, descending = paging.parse_sort(self.name, sort)
+        where, params = self._where(criteria or {})
+        clauses = [where[len(" WHERE "):]] if where else []
+        if between:
+            column = self._column(between[0])
+            for op, bound in ((">=", between[1]), ("<=", between[2])):
+                if bound is not None:
+                    clauses.append(f"{column} {op} ?")
+                    params.append(bound)
+        keys = ["rowid"] if field is None else [f"COALESCE({self._column(field)}, '')", "rowid"]
+        if after is not None:
+            if len(after) != len(keys):
+                raise ValueError("Invalid cursor")
+            clauses.append("({}) {} ({})".format(", ".join(keys), "<" if descending else ">",
+                                                 ", ".join("?" for _ in keys)))
+            params.extend(after)
+        direction = " DESC" if descending else ""
+        sql = "SELECT {}, {} FROM {}{} ORDER BY {}".format(
+            ", ".join(keys), ", ".join(c for _, c in self.fields), self.name,
+            " WHERE " + " AND ".join(clauses) if clauses else "",
+            ", ".join(k + direction for k in keys))
+        if limit is not None:
+            sql += f" LIMIT {int(limit) + 1}"
+        conn = self.store.connection()
+        rows = conn.execute(sql, params).fetchall()
+        more = limit is not None and len(rows) > limit
+        rows = rows[:limit] if limit is not None else rows
+        records = self._to_records(conn, [row[len(keys):] for row in rows])
+        return records, (tuple(rows[-1][:len(keys)]) if more and rows else None)
+
+    def scan(self, criteria: Optional[dict] = None,
+             between: Optional[Tuple[str, Optional[str], Optional[str]]] = None,
+             batch_size: int = 1000) -> Iterator[List[dict]]:
+        """Matching records in collection order, in batches read one keyset query at a time.
+
+        Each batch is a separate query, so batches may be fetched from
+        different threads (each uses its own connection).
+        """
+        after = None
+        while True:
+            records, after = self.query(criteria, between=between, after=after, limit=batch_size)
+            if records:
+                yield records
+            if after is None:
+                return
+
+    def existing_keys(self, fields: Tuple[str, ...], keys: set) -> set:
+        """The subset of `keys` (value tuples over `fields`) some stored row has"""
+        if not keys:
+            return set()
+        columns = ", ".join(self._column(f) for f in fields)
+        per_chunk = MAX_PARAMS // len(fields)
+        conn = self.store.connection()
+        if len(keys) > per_chunk:
+            # Many keys: one pass over the table beats a lookup per chunk
+            return keys & set(conn.execute(f"SELECT {columns} FROM {self.name}").fetchall())
+        row = "({})".format(", ".join("?" for _ in fields))
+        sql = f"SELECT {columns} FROM {self.name} WHERE ({columns}) IN (VALUES {', '.join(row for _ in keys)})"
+        return keys & set(conn.execute(sql, [v for key in keys for v in key]).fetchall())
+
+    def _column(self, field: str) -> str:
+        column = self.columns.get(field)
+        if column is None:
+            raise ValueError(f"{self.name} has no field {field}")
+        return column
+
+    def refresh(self):
+        pass
+
+    @property
+    def version(self) -> int:
+        """Counter that increases with every change to the table (see VERSIONED_TABLES)"""
+        return self.store.versions([self.name])[0]
+
+    def __len__(self) -> int:
+        return self.store.connection().execute(f"SELECT COUNT(*) FROM {self.name}").fetchone()[0]
+
+    # ---- writes ----
+
+    def insert(self, record: dict) -> dict:
+        self.insert_many([record])
+        return record
+
+    def insert_many(self, records: List[dict]) -> List[dict]:
+        with self.store.transaction() as conn:
+            conn.executemany(self._insert, [self._row_values(r) for r in records])
+            if self.link:
+                for record in records:
+                    self._set_links(conn, record["id"], record.get(self.link[0]) or [])
+        self._notify((None, record) for record in records)
+        return records
+
+    def update(self, record_id: str, changes: dict) -> Optional[dict]:
+        """Merge `changes` into a record. Returns the updated record, or None if missing."""
+        updated = self.update_many({record_id: changes})
+        return updated[0] if updated else None
+
+    def update_many(self, changes_by_id: dict) -> List[dict]:
+        before = {r["id"]: r for r in self.get_many(changes_by_id)} if self.listeners else {}
+        with self.store.transaction() as conn:
+            updated_ids = []
+            for record_id, changes in changes_by_id.items():
+                values = {f: v for f, v in changes.items() if f in self.columns and f != "id"}
+                if values:
+                    sets = ", ".join(f"{self.columns[f]} = ?" for f in values)
+                    params = [int(bool(v)) if f in BOOL_FIELDS else v for f, v in values.items()]
+                    cursor = conn.execute(f"UPDATE {self.name} SET {sets} WHERE id = ?", params + [record_id])
+                    found = cursor.rowcount > 0
+                else:
+                    found = conn.execute(f"SELECT 1 FROM {self.name} WHERE id = ?", (record_id,)).fetchone()
+                if not found:
+                    continue
+                if self.link and self.link[0] in changes:
+                    self._set_links(conn, record_id, changes[self.link[0]] or [])
+                updated_ids.append(record_id)
+        updated = self.get_many(updated_ids)
+        self._notify((before.get(record["id"]), record) for record in updated)
+        return updated
+
+    def delete(self, record_id: str) -> Optional[dict]:
+        """Remove a record. Returns the removed record, or None if missing."""
+        deleted = self.delete_where(id=record_id)
+        return deleted[0] if deleted else None
+
+    def delete_where(self, **criteria) -> List[dict]:
+        """Remove every record matching `criteria`. Returns the removed records."""
+        where, params = self._where(criteria)
+        with self.store.transaction() as conn:
+            removed = self._to_records(conn, conn.execute(f"{self._select}{where} ORDER BY rowid", params).fetchall())
+            conn.execute(f"DELETE FROM {self.name}{where}", params)
+        self._notify((record, None) for record in removed)
+        if removed:
+            for name in CASCADES.get(self.name, []):
+                self._tell("reset", (name,))
+        return removed
+
+    def _notify(self, changes: Iterable[Tuple[Optional[dict], Optional[dict]]]):
+        if not self.listeners:
+            return
+        for old, new in changes:
+            self._tell("changed", (self.name, old, new))
+
+    def _tell(self, event: str, args: tuple):
+        """Call `event` on every listener, or hold it until the enclosing batch commits"""
+        held = getattr(self.store._local, "events", None)
+        if held is not None:
+            held.append((self, event, args))
+            return
+        for listener in self.listeners:
+            getattr(listener, event)(*args)
+
+class SQLiteStore:
+    """All collections in one SQLite database. Reports select their rows in SQL and add them
+    up in Python, in collection order, so the floats match storage.Store's."""
+
+    COLLECTIONS = Store.COLLECTIONS
+
+    # Every call goes to the database file
+    IN_MEMORY = False
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        conn = self.connection()
+        conn.executescript(SCHEMA)
+        conn.executescript(_version_triggers())
+        conn.executemany("INSERT OR IGNORE INTO collection_versions (name) VALUES (?)",
+                         [(name,) for name in self.COLLECTIONS])
+        conn.commit()
+        self.collections = {name: SQLiteCollection(self, name) for name in self.COLLECTIONS}
+        self.analytics = Analytics(self)
+        # Distinguishes this instance's ETags from those handed out by earlier runs
+        self.epoch = uuid.uuid4().hex[:8]
+
+    def __getitem__(self, name: str) -> SQLiteCollection:
+        return self.collections[name]
+
+    def connection(self) -> sqlite3.Connection:
+        """This thread's connection (sqlite3 connections must not be shared across threads)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, cached_statements=256)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA foreign_keys = ON")
+            self._local.conn = conn
+        return conn
+
+    def transaction(self):
+        return _Transaction(self.connection(), self._local)
+
+    @contextmanager
+    def batch(self, key: Optional[str] = None) -> Iterator[Batch]:
+        """Store.batch on SQLite: the block runs in one transaction, which also saves the result.
+        Listeners are told of its changes once it commits."""
+        outer = getattr(self._local, "events", None) is None
+        if outer:
+            self._local.events = []
+        try:
+            with self.transaction() as conn:
+                # Take the write lock up front, so the batch cannot fail halfway on a busy database
+                conn.execute("BEGIN IMMEDIATE")
+                replayed = None
+                if key is not None:
+                    row = conn.execute("SELECT result FROM batches WHERE key = ? AND created_at >= ?",
+                                       (key, time.time() - IDEMPOTENCY_SECONDS)).fetchone()
+                    replayed = orjson.loads(row[0]) if row is not None else None
+                batch = Batch(replayed)
+                yield batch
+                if key is not None and batch.result is not None:
+                    now = time.time()
+                    conn.execute("DELETE FROM batches WHERE created_at < ?", (now - IDEMPOTENCY_SECONDS,))
+                    conn.execute("INSERT OR REPLACE INTO batches (key, result, created_at) VALUES (?, ?, ?)",
+                                 (key, orjson.dumps(batch.result, default=str).decode(), now))
+        except BaseException:
+            if outer:
+                self._local.events = None
+            raise
+        if outer:
+            events, self._local.events = self._local.events, None
+            for collection, event, args in events:
+                for listener in collection.listeners:
+                    getattr(listener, event)(*args)
+
+    # ---- referential integrity ----
+    # Store.insert/update/delete: both sides of the enrolment are the one
+    # class_students table, and ON DELETE CASCADE removes dependent rows
+
+    def insert(self, name: str, record: dict) -> dict:
+        return self.collections[name].insert(record)
+
+    def update(self, name: str, record_id: str, changes: dict) -> Optional[dict]:
+        return self.collections[name].update(record_id, changes)
+
+    def delete(self, name: str, record_id: str) -> Optional[dict]:
+        return self.collections[name].delete(record_id)
+
+    def versions(self, names: Iterable[str]) -> tuple:
+        """Current versions of the named collections"""
+        names = list(names)
+        rows = dict(self.connection().execute("SELECT name, version FROM collection_versions").fetchall())
+        return tuple(rows[name] for name in names)
+
+    def approx_bytes(self) -> int:
+        """Memory held by records: none, they stay in the database file (as Store.approx_bytes)"""
+        return 0
+
+    def close(self):
+        """Nothing is buffered: each thread's connection is closed when the store, and with it
+        the thread-local storage holding the connection, is dropped"""
+
+    # ---- reports ----
+
+    def payroll_report(self, start_date: str, end_date: str) -> dict:
+        """Payroll, with the hours added up in Python in the order storage.Store adds them"""
+        rows = self.connection().execute(
+            """
+            SELECT a.student_id, s.hours_worked
+            FROM sessions s JOIN attendance a ON a.session_id = s.id
+            WHERE s.session_date BETWEEN ? AND ? AND a.status IN ('present', 'late')
+            ORDER BY s.rowid, a.rowid
+            """,
+            (start_date, end_date),
+        ).fetchall()
+        student_hours = {}
+        for student_id, hours in rows:
+            student_hours[student_id] = student_hours.get(student_id, 0) + hours
+        students = self["students"].get_many(student_hours)
+        return reports.payroll_summary(student_hours, {s["id"]: s for s in students}, start_date, end_date)
+
+    def hours_between(self, start_date: Optional[str], end_date: Optional[str]) -> float:
+        """Total hours of the sessions dated between start_date and end_date (either may be None)"""
+        rows = self.connection().execute(
+            "SELECT hours_worked FROM sessions WHERE session_date >= ? AND session_date <= ? ORDER BY rowid",
+            (start_date or "", "\uffff" if end_date is None else end_date),
+        )
+        return sum(hours for hours, in rows)
+
+    def student_balance(self, student_id: str) -> Optional[dict]:
+        """Balance for one student, or None if the student does not exist"""
+        student = self["students"].get(student_id)
+        if student is None:
+            return None
+        return reports.balance_summary(student, *self._balance_totals(student_id).get(student_id, (0, 0)))
+
+    def all_balances(self) -> List[dict]:
+        """Balance of every student, added up the same way as student_balance"""
+        totals = self._balance_totals()
+        return [reports.balance_summary(s, *totals.get(s["id"], (0, 0))) for s in self["students"].all()]
+
+    def _balance_totals(self, student_id: Optional[str] = None) -> Dict[str, Tuple[float, float]]:
+        """studentId -> (hours attended, total paid), of one student or of all of them.
+
+        Added up by reports.balance_totals from rows in rowid (collection)
+        order rather than with SUM, so the floats match storage.Store's exactly.
+        """
+        conn = self.connection()
+        where, params = ("", ()) if student_id is None else ("WHERE student_id = ?", (student_id,))
+        attendance = [
+            {"sessionId": session_id, "studentId": row_student_id, "status": status}
+            for session_id, row_student_id, status in conn.execute(
+                f"SELECT session_id, student_id, status FROM attendance {where}", params)
+        ]
+        sessions = (
+            {"id": session_id, "hoursWorked": hours}
+            for session_id, hours in conn.execute(
+                f"""
+                SELECT id, hours_worked FROM sessions
+                WHERE id IN (SELECT session_id FROM attendance {where}) ORDER BY rowid
+                """,
+                params,
+            )
+        )
+        payments = (
+            {"studentId": row_student_id, "amount": amount}
+            for row_student_id, amount in conn.execute(
+                f"SELECT student_id, amount FROM payments {where} ORDER BY rowid", params)
+        )
+        return reports.balance_totals(sessions, attendance, payments)
+
+    def check_balances(self) -> dict:
+        # Balances are aggregated by SQLite on every request; there is no stored state to drift
+        return {"consistent": True, "mismatches": []}
+
+class _Transaction:
+    """Commit on success, roll back on error, and surface constraint failures as ConstraintError.
+
+    Inside another transaction of the same thread (SQLiteStore.batch),
+    committing or rolling back is left to the outermost one.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, local: threading.local):
+        self.conn = conn
+        self.local = local
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.local.depth = getattr(self.local, "depth", 0) + 1
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.local.depth -= 1
+        if self.local.depth == 0:
+            if exc_type is None:
+                self.conn.commit()
+                return False
+            self.conn.rollback()
+        if isinstance(exc, sqlite3.IntegrityError):
+            raise ConstraintError(str(exc)) from exc
+        return False
+
+def _chunks(items: List, size: int = MAX_PARAMS):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+# ==================== JSON import ====================
+
+def import_json(data_dir: str, db_path: str) -> Dict[str, dict]:
+    """Copy every collection from a JSON data directory into a SQLite database.
+
+    Rows that break the schema's constraints (attendance or payments for
+    deleted students, sessions for deleted classes, duplicate attendance for
+    the same session and student) are skipped. Returns per-collection counts
+    of imported and skipped rows.
+    """
+    source = Store(data_dir, file_format=snapshot.detect_format(data_dir))
+    target = SQLiteStore(db_path)
+    conn = target.connection()
+    summary = {}
+    # Check references once at the end instead of row by row
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        for name in target.COLLECTIONS:
+            collection = target[name]
+            records = source[name].all()
+            before = len(collection)
+            conn.executemany(
+                collection._insert.replace("INSERT", "INSERT OR IGNORE", 1),
+                [collection._row_values(r) for r in records],
+            )
+            summary[name] = {"imported": len(collection) - before, "skipped": len(records) - (len(collection) - before)}
+
+        # Enrollment lives on both sides in the JSON files
+        links = set()
+        for cls in source["classes"].all():
+            links.update((cls["id"], student_id) for student_id in cls.get("studentIds") or [])
+        for student in source["students"].all():
+            links.update((class_id, student["id"]) for class_id in student.get("enrolledClasses") or [])
+        before = conn.execute("SELECT COUNT(*) FROM class_students").fetchone()[0]
+        conn.executemany("INSERT OR IGNORE INTO class_students (class_id, student_id) VALUES (?, ?)", sorted(links))
+        imported = conn.execute("SELECT COUNT(*) FROM class_students").fetchone()[0] - before
+        summary["class_students"] = {"imported": imported, "skipped": len(links) - imported}
+
+        # Drop rows whose parent does not exist, children first
+        for table in ["class_students", "attendance", "payments", "sessions", "attendance"]:
+            orphans = [row[1] for row in conn.execute(f"PRAGMA foreign_key_check({table})")]
+            for rowid in orphans:
+                conn.execute(f"DELETE FROM {table} WHERE rowid = ?", (rowid,))
+            counts = summary[table]
+            counts["imported"] -= len(orphans)
+            counts["skipped"] += len(orphans)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+    return summary
+
+if __name__ == "__main__":
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Import the JSON data files into a SQLite database")
+    parser.add_argument("--data-dir", default=os.path.join(here, "data"))
+    parser.add_argument("--db", default=os.path.join(here, "data", "tuition.db"))
+    args = parser.parse_args()
+
+    for name, counts in import_json(args.data_dir, args.db).items():
+        print(f"{name}: {counts['imported']} imported, {counts['skipped']} skipped")
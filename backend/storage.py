@@ -0,0 +1,1586 @@
+import bisect
+import copy
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from array import array
+from collections import defaultdict
+from concurrent.futures import Future
+from contextlib import ExitStack, contextmanager
+from typing import Callable, Dict, Iterable, Iterator, Optional, List, Tuple
+
+import orjson
+
+import coherence
+import metrics
+import paging
+import reports
+import snapshot
+from aggregates import StudentBalances, student_totals
+from analytics import Analytics
+from tables import make_table
+
+class ConstraintError(Exception):
+    """A write was rejected by the storage backend (foreign key, unique or check constraint)"""
+
+# ==================== File I/O ====================
+
+# Default empty data structures
+DEFAULT_DATA = {
+    "students.json": {"students": []},
+    "classes.json": {"classes": []},
+    "sessions.json": {"sessions": []},
+    "attendance.json": {"attendance": []},
+    "payments.json": {"payments": []},
+}
+
+def read_json(filepath: str) -> dict:
+    filename = os.path.basename(filepath)
+    # Create file with default data if it doesn't exist
+    if not os.path.exists(filepath):
+        default = copy.deepcopy(DEFAULT_DATA.get(filename, {}))
+        write_json(filepath, default)
+        return default
+    started = time.perf_counter()
+    with open(filepath, "rb") as f:
+        raw = f.read()
+    try:
+        data = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        # NaN/Infinity, which json.dump writes but orjson does not read
+        data = json.loads(raw)
+    metrics.record_io("read", filepath, len(raw), time.perf_counter() - started)
+    return data
+
+def write_json(filepath: str, data: dict):
+    """Atomically replace a file: readers and crashes see the old or the new contents, never a mix"""
+    replace_file(dump_json_tmp(filepath, data), filepath)
+
+def dump_json_tmp(filepath: str, data: dict) -> str:
+    """Write `data` durably to a temp file next to `filepath` and return its path"""
+    tmp_path = f"{filepath}.{os.getpid()}.tmp"
+    started = time.perf_counter()
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+        metrics.record_io("write", filepath, f.tell(), time.perf_counter() - started)
+    return tmp_path
+
+def dump_collection_tmp(filepath: str, name: str, records: Iterable[dict]) -> str:
+    """Like dump_json_tmp for {name: records}, writing one record at a time.
+
+    The output is byte-for-byte what json.dump(..., indent=2) produces, but
+    the full list never has to exist at once.
+    """
+    tmp_path = f"{filepath}.{os.getpid()}.tmp"
+    started = time.perf_counter()
+    with open(tmp_path, "w") as f:
+        f.write("{\n  " + json.dumps(name) + ": [")
+        separator = "\n"
+        for record in records:
+            f.write(separator)
+            f.write("    " + json.dumps(record, indent=2, default=str).replace("\n", "\n    "))
+            separator = ",\n"
+        f.write("]\n}" if separator == "\n" else "\n  ]\n}")
+        f.flush()
+        os.fsync(f.fileno())
+        metrics.record_io("write", filepath, f.tell(), time.perf_counter() - started)
+    return tmp_path
+
+def replace_file(tmp_path: str, filepath: str):
+    os.replace(tmp_path, filepath)
+    fsync_dir(os.path.dirname(filepath))
+
+def fsync_dir(dirpath: str):
+    """Persist a rename. Not supported on Windows, where it is skipped."""
+    try:
+        fd = os.open(dirpath or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def read_journal(filepath: str) -> List[dict]:
+    """Entries of a journal file. A torn final line (crash mid-append) is cut off."""
+    return read_journal_from(filepath, 0)[0]
+
+def read_journal_from(filepath: str, offset: int) -> Tuple[List[dict], int]:
+    """Entries of a journal file after its first `offset` bytes, and the offset they end at"""
+    entries = []
+    started = time.perf_counter()
+    try:
+        f = open(filepath, "rb+")
+    except FileNotFoundError:
+        return entries, 0
+    with f:
+        f.seek(offset)
+        valid_bytes = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                entries.append(orjson.loads(line))
+            except ValueError:
+                break
+            valid_bytes += len(line)
+        f.truncate(offset + valid_bytes)
+    metrics.record_io("read", filepath, valid_bytes, time.perf_counter() - started)
+    return entries, offset + valid_bytes
+
+def file_signature(filepath: str):
+    """(mtime, size) of a file, used to detect edits made outside the process"""
+    try:
+        st = os.stat(filepath)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+# ==================== Group commit ====================
+
+_deferred = threading.local()
+
+@contextmanager
+def deferred_commits(tickets: List[Future]):
+    """Collect, instead of waiting for, the commit tickets of changes made in this block.
+
+    For callers that must not block (async handlers): changes are applied in
+    memory as usual, and the caller waits for the tickets it was handed
+    (e.g. with asyncio.wrap_future) before reporting success.
+    """
+    previous = getattr(_deferred, "tickets", None)
+    _deferred.tickets = tickets
+    try:
+        yield tickets
+    finally:
+        _deferred.tickets = previous
+
+_nowait = threading.local()
+
+class WouldBlock(Exception):
+    """Raised inside `nonblocking` by a read or write that would have to wait"""
+
+@contextmanager
+def nonblocking():
+    """Make reads and writes in this block raise WouldBlock instead of waiting for a
+    collection held by another thread or loading one from disk.
+
+    For calls made on the event loop, which retry on a thread when they get it.
+    Only until the block first changes a collection: from then on it has to run
+    to the end, so it waits like anywhere else.
+    """
+    previous = getattr(_nowait, "active", False)
+    _nowait.active = True
+    try:
+        yield
+    finally:
+        _nowait.active = previous
+
+def _would_block():
+    if getattr(_nowait, "active", False):
+        raise WouldBlock()
+
+def _changing():
+    """A collection is being changed: nothing may give up with WouldBlock any more"""
+    _nowait.active = False
+
+class Mutex:
+    """RLock whose `with` block gives up with WouldBlock, inside `nonblocking`, when another thread holds it"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.acquire = self._lock.acquire
+        self.release = self._lock.release
+
+    def __enter__(self):
+        self.enter()
+        return self
+
+    def enter(self):
+        if not self._lock.acquire(blocking=False):
+            _would_block()
+            self._lock.acquire()
+
+    def __exit__(self, exc_type, exc, tb):
+        self._lock.release()
+        return False
+
+class CommitLock:
+    """Re-entrant collection lock that waits for durability only after it is released.
+
+    Mutations made while the lock is held hand their commit ticket to
+    `defer`; the outermost `with` block releases the lock first and then
+    waits for the tickets (or, inside `deferred_commits`, hands them to the
+    caller). Callers therefore never hold the lock while their write is being
+    flushed, which is what lets concurrent writers share one flush.
+
+    Plain reads hold just `mutex`. With a `process_lock` (a
+    coherence.ProcessLock, when other processes share the data directory) the
+    outermost block also holds that exclusively, so a read-modify-write
+    sequence is atomic across processes too. Like `mutex`, it gives up with
+    WouldBlock inside `nonblocking` rather than wait for another thread.
+    """
+
+    def __init__(self, process_lock=None):
+        self.mutex = Mutex()
+        self.process_lock = process_lock
+        self._local = threading.local()
+
+    @property
+    def held(self) -> bool:
+        """Whether the calling thread is inside a `with` block of this lock"""
+        return getattr(self._local, "depth", 0) > 0
+
+    def __enter__(self):
+        self.mutex.enter()
+        if self.process_lock is not None and not self.held:
+            try:
+                self.process_lock.acquire()
+            except BaseException:
+                self.mutex.release()
+                raise
+        self._local.depth = getattr(self._local, "depth", 0) + 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._local.depth -= 1
+        tickets = []
+        if self._local.depth == 0:
+            tickets = getattr(self._local, "tickets", [])
+            self._local.tickets = []
+            if self.process_lock is not None:
+                self.process_lock.release()
+        self.mutex.release()
+        sink = getattr(_deferred, "tickets", None)
+        if sink is not None:
+            sink.extend(tickets)
+            return False
+        for ticket in tickets:
+            ticket.result()
+        return False
+
+    def defer(self, ticket: Future):
+        if not hasattr(self._local, "tickets"):
+            self._local.tickets = []
+        self._local.tickets.append(ticket)
+
+class GroupCommitWriter:
+    """Serialized background writer for one collection.
+
+    Mutations are queued with `submit`. The writer thread waits `window`
+    seconds after the first queued mutation, then makes everything queued so
+    far durable with a single call to `flush` and resolves every submitter's
+    ticket. Mutations arriving during a flush go into the next batch. The
+    thread is started on demand and exits after a few idle seconds.
+    """
+
+    IDLE_SECONDS = 5.0
+
+    def __init__(self, name: str, flush: Callable[[List[dict]], None], window: float = 0.0):
+        self.name = name
+        self.window = window
+        self._flush = flush
+        self._cond = threading.Condition()
+        self._entries: List[dict] = []
+        self._tickets: List[Future] = []
+        self._in_flight = False
+        self._thread = None
+
+    @property
+    def busy(self) -> bool:
+        """Whether some submitted mutation is not yet durable"""
+        return bool(self._tickets) or self._in_flight
+
+    def submit(self, entries: List[dict]) -> Future:
+        ticket = Future()
+        with self._cond:
+            self._entries.extend(entries)
+            self._tickets.append(ticket)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"writer-{self.name}", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+        return ticket
+
+    def wait_idle(self):
+        """Block until everything submitted so far is durable"""
+        with self._cond:
+            while self.busy:
+                self._cond.wait()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._tickets:
+                    self._cond.wait(self.IDLE_SECONDS)
+                    if not self._tickets:
+                        self._thread = None
+                        return
+            if self.window:
+                time.sleep(self.window)
+            with self._cond:
+                entries, tickets = self._entries, self._tickets
+                self._entries, self._tickets = [], []
+                self._in_flight = True
+            try:
+                self._flush(entries)
+            except BaseException as exc:
+                for ticket in tickets:
+                    ticket.set_exception(exc)
+            else:
+                for ticket in tickets:
+                    ticket.set_result(None)
+            finally:
+                with self._cond:
+                    self._in_flight = False
+                    self._cond.notify_all()
+
+# ==================== Indexes ====================
+
+class Index:
+    """Hash index from the value of one or more fields to the slots holding it.
+
+    Buckets are arrays of slots kept in ascending order, so lookups return
+    records in the same order a full scan would.
+    """
+
+    def __init__(self, fields: tuple):
+        self.fields = fields
+        self.buckets: Dict[object, array] = {}
+        self._unsorted = set()
+
+    def key(self, record: dict):
+        if len(self.fields) == 1:
+            return record.get(self.fields[0])
+        return tuple(record.get(f) for f in self.fields)
+
+    def add(self, record: dict, slot: int):
+        key = self.key(record)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            self.buckets[key] = array("q", (slot,))
+            return
+        if slot < bucket[-1]:
+            self._unsorted.add(key)
+        bucket.append(slot)
+
+    def remove(self, record: dict, slot: int):
+        key = self.key(record)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return
+        if key in self._unsorted:
+            try:
+                bucket.remove(slot)
+            except ValueError:
+                return
+        else:
+            # Sorted: find the slot by bisection rather than scanning the bucket
+            i = bisect.bisect_left(bucket, slot)
+            if i == len(bucket) or bucket[i] != slot:
+                return
+            del bucket[i]
+        if not bucket:
+            del self.buckets[key]
+            self._unsorted.discard(key)
+
+    def clear(self):
+        self.buckets.clear()
+        self._unsorted.clear()
+
+    def rebuild(self, keys: list, slots: List[int]):
+        """Replace the contents with keys[i] -> slots[i], for ascending `slots`"""
+        self.clear()
+        buckets: Dict[object, list] = defaultdict(list)
+        for key, slot in zip(keys, slots):
+            buckets[key].append(slot)
+        self.buckets = {key: array("q", bucket) for key, bucket in buckets.items()}
+
+    def size(self, key) -> int:
+        return len(self.buckets.get(key, ()))
+
+    def lookup(self, key) -> List[int]:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return []
+        if key in self._unsorted:
+            bucket = self.buckets[key] = array("q", sorted(bucket))
+            self._unsorted.discard(key)
+        return list(bucket)
+
+class OrderedIndex:
+    """Sorted (value, slot) entries for one field, for range queries.
+
+    Entries appended out of order (bulk loads, inserts of earlier dates) are
+    sorted lazily on the next lookup, which Timsort does in near-linear time
+    for mostly-ordered data.
+    """
+
+    def __init__(self, field: str):
+        self.field = field
+        self.entries: List[tuple] = []
+        self._dirty = False
+
+    def entry(self, record: dict, slot: int) -> tuple:
+        return (paging.sort_value(record.get(self.field)), slot)
+
+    def add(self, record: dict, slot: int):
+        entry = self.entry(record, slot)
+        if self.entries and entry < self.entries[-1]:
+            self._dirty = True
+        self.entries.append(entry)
+
+    def remove(self, record: dict, slot: int):
+        self._sort()
+        entry = self.entry(record, slot)
+        i = bisect.bisect_left(self.entries, entry)
+        if i < len(self.entries) and self.entries[i] == entry:
+            del self.entries[i]
+
+    def clear(self):
+        self.entries = []
+        self._dirty = False
+
+    def rebuild(self, values: list, slots: List[int]):
+        """Replace the contents with the entries of values[i] at slots[i]"""
+        self.entries = sorted(zip(map(paging.sort_value, values), slots))
+        self._dirty = False
+
+    def _sort(self):
+        if self._dirty:
+            self.entries.sort()
+            self._dirty = False
+
+    def _bounds(self, low, high) -> Tuple[int, int]:
+        self._sort()
+        start = 0 if low is None else bisect.bisect_left(self.entries, (low,))
+        end = len(self.entries) if high is None else bisect.bisect_left(self.entries, (high, float("inf")))
+        return start, end
+
+    def count(self, low=None, high=None) -> int:
+        start, end = self._bounds(low, high)
+        return max(0, end - start)
+
+    def range(self, low=None, high=None) -> List[tuple]:
+        """Entries with low <= value <= high (either bound may be None), in (value, slot) order"""
+        start, end = self._bounds(low, high)
+        return self.entries[start:end]
+
+class MemberIndex:
+    """Index from each value in a list field (a class's studentIds, say) to the slots whose list holds it"""
+
+    def __init__(self, field: str):
+        self.field = field
+        self.buckets: Dict[object, set] = {}
+
+    def values(self, record: dict) -> set:
+        return set(record.get(self.field) or ())
+
+    def add(self, record: dict, slot: int):
+        for value in self.values(record):
+            self.buckets.setdefault(value, set()).add(slot)
+
+    def remove(self, record: dict, slot: int):
+        for value in self.values(record):
+            bucket = self.buckets.get(value)
+            if bucket is not None:
+                bucket.discard(slot)
+                if not bucket:
+                    del self.buckets[value]
+
+    def clear(self):
+        self.buckets.clear()
+
+    def lookup(self, value) -> List[int]:
+        """Slots whose list holds `value`, ascending"""
+        return sorted(self.buckets.get(value, ()))
+
+# Rough memory of an index bucket (key and array of slots) and of an ordered
+# index entry ((value, slot) tuple), for Collection.approx_bytes
+BUCKET_BYTES = 150
+ORDERED_ENTRY_BYTES = 130
+
+# ==================== Collections ====================
+
+class Collection:
+    """One collection file, loaded once and served from memory.
+
+    Records live in a table (see tables.py) where each occupies a slot in
+    collection (file) order, found by id through an id -> slot dict, next to
+    the secondary indexes listed in `index_fields` and a MemberIndex for each
+    list field in `member_fields`; all of them are kept in step on every
+    insert, update and delete. With `compact`, the large
+    collections use a CompactTable that stores records as typed columns and
+    rebuilds the dicts on read. Mutations are applied in memory and handed to
+    a GroupCommitWriter, which rewrites the file atomically (temp file,
+    fsync, rename); the mutating call returns once that write is durable.
+    Every access re-checks the file's mtime/size so edits made by hand (or
+    by another process) are picked up.
+
+    Records are never modified in place, only replaced, so lists returned by
+    reads stay valid while the collection changes.
+
+    Objects in `listeners` are told about every change as it is applied
+    (`changed(name, old, new)`, with None for the missing side of an insert
+    or delete) and about wholesale reloads (`reset(name)`), which is how
+    derived state such as aggregates.StudentBalances stays current.
+    `version` goes up on each of those events, which is what response ETags
+    and cache keys are built from.
+
+    A leftover journal (see JournalCollection) is replayed on load and folded
+    into the snapshot, so switching storage modes never loses writes.
+
+    The snapshot is `<name>.json`, or with `file_format="msgpack"` a binary
+    `<name>.msgpack` (see snapshot.py) that loads without parsing records.
+    If only the other format's file exists, it is loaded, rewritten in this
+    format and kept as `.bak`.
+
+    With `shared` (a coherence.SharedVersions), other processes serve the
+    same files. `lock` is then held across processes as well, mutations are
+    written synchronously while it is held and published as a bump of the
+    collection's shared counter, and the freshness check compares that
+    counter instead of the files' signatures (see coherence.py).
+
+    Ids are treated as a primary key: if a file contains the same id twice,
+    the first record wins.
+    """
+
+    def __init__(self, name: str, data_dir: str, index_fields: List[tuple] = (),
+                 commit_window: float = 0.0, ordered_fields: List[str] = (), compact: bool = False,
+                 file_format: str = "json", shared=None, member_fields: List[str] = ()):
+        self.name = name
+        self.binary = file_format == "msgpack"
+        self.filename = f"{name}{snapshot.EXTENSION}" if self.binary else f"{name}.json"
+        self.path = os.path.join(data_dir, self.filename)
+        self.other_path = os.path.join(data_dir, f"{name}.json" if self.binary else f"{name}{snapshot.EXTENSION}")
+        self.journal_path = os.path.join(data_dir, f"{name}.journal")
+        self.compact_records = compact
+        self.shared = shared
+        self.lock = CommitLock(shared.locks[name] if shared is not None else None)
+        self.writer = GroupCommitWriter(name, self._flush, commit_window)
+        self.indexes = {fields: Index(fields) for fields in index_fields}
+        self.ordered = {field: OrderedIndex(field) for field in ordered_fields}
+        self.members = {field: MemberIndex(field) for field in member_fields}
+        self.listeners = []
+        self._version = 0
+        self._table = make_table(name, compact)
+        self._slots: Dict[str, int] = {}
+        # Changes whenever the slots are renumbered (on every load), so page positions can tell
+        self._layout = None
+        self._signature = None
+        self._loaded = False
+        self._loading = False
+        # Bytes of the journal reflected in memory, and the lines among them
+        self._journal_end = 0
+        self._journal_entries = 0
+        # Shared counter value reflected in memory
+        self._seen = None
+        # approx_bytes() result and the version it was estimated at
+        self._bytes = (None, 0)
+        # In a batch (Store.batch): how to undo its changes, the entries it has yet to write,
+        # and the changes listeners are told of once it commits
+        self._undo = None
+        self._pending = None
+        self._events = None
+
+    def _current_signature(self):
+        return (file_signature(self.path), file_signature(self.journal_path))
+
+    def _ensure_fresh(self):
+        if self._undo is not None and self._loaded:
+            # A batch holds the lock and has not written its changes: the files are behind memory
+            return
+        if self.shared is not None:
+            if not (self._loaded and self.shared.counter(self.name) == self._seen):
+                self._catch_up()
+            return
+        # While our own writes are queued the file is behind memory, not ahead of it
+        if self._loaded and (self.writer.busy or self._current_signature() == self._signature):
+            return
+        _would_block()
+        self._load()
+
+    def _catch_up(self):
+        """Apply what other processes changed, holding the collection's process lock while reading files"""
+        if self.lock.held:
+            self._sync()
+        elif not self._loaded:
+            # The first load may convert or compact the files, which takes the exclusive lock
+            with self.lock:
+                self._sync()
+        else:
+            with self.lock.process_lock.holding(exclusive=False):
+                self._sync()
+
+    def _sync(self):
+        counter = self.shared.counter(self.name)
+        if self._loaded and counter == self._seen:
+            return
+        snapshot_sig, journal_sig = self._current_signature()
+        journal_size = journal_sig[1] if journal_sig is not None else 0
+        if self._loaded and snapshot_sig == self._signature[0] and journal_size >= self._journal_end:
+            # Only journal lines were appended since: replay those
+            entries, self._journal_end = read_journal_from(self.journal_path, self._journal_end)
+            for entry in entries:
+                self._apply(entry)
+            self._journal_entries += len(entries)
+            self._signature = self._current_signature()
+        else:
+            self._load()
+        if self._writable() and self.shared.signature(self.name) != self._signature:
+            # Changed while no server was running, or by our own load (conversion, compaction)
+            counter = self.shared.publish(self.name, self._signature)
+        self._seen = counter
+
+    def _writable(self) -> bool:
+        """Whether the files may be rewritten now: always, unless other processes share them
+        and this thread does not hold the collection's lock"""
+        return self.shared is None or self.lock.held
+
+    def _load(self):
+        converting = not os.path.exists(self.path) and os.path.exists(self.other_path)
+        source = self.other_path if converting else self.path
+        self._loading = True
+        self._slots = {}
+        self._layout = uuid.uuid4().hex[:8]
+        for index in self.indexes.values():
+            index.clear()
+        for ordered in self.ordered.values():
+            ordered.clear()
+        for members in self.members.values():
+            members.clear()
+        if source.endswith(snapshot.EXTENSION):
+            self._adopt(snapshot.read_table(source, self.name, self.compact_records)
+                        if os.path.exists(source) else make_table(self.name, self.compact_records))
+        else:
+            data = read_json(source)
+            self._table = make_table(self.name, self.compact_records)
+            for record in data.get(self.name, []):
+                if record["id"] not in self._slots:
+                    self._add(record)
+            del data
+        journal, self._journal_end = read_journal_from(self.journal_path, 0)
+        for entry in journal:
+            self._apply(entry)
+        self._loading = False
+        self._version += 1
+        for listener in self.listeners:
+            listener.reset(self.name)
+        self._loaded = True
+        if converting:
+            self._write_snapshot()
+            os.replace(source, f"{source}.bak")
+        self._loaded_journal(len(journal))
+        self._signature = self._current_signature()
+
+    def _adopt(self, table):
+        """Take over a table read from a snapshot file, building the id map and indexes in bulk"""
+        slots = table.live_slots()
+        ids = table.field_values(slots, "id")
+        self._slots = dict(zip(ids, slots))
+        if len(self._slots) != len(slots):
+            # Repeated ids: keep the first record, as a JSON load does
+            self._slots = {}
+            for record_id, slot in zip(ids, slots):
+                if record_id in self._slots:
+                    table.delete(slot)
+                else:
+                    self._slots[record_id] = slot
+            slots = table.live_slots()
+        self._table = table
+        for fields, index in self.indexes.items():
+            columns = [table.field_values(slots, field) for field in fields]
+            index.rebuild(columns[0] if len(fields) == 1 else list(zip(*columns)), slots)
+        for field, ordered in self.ordered.items():
+            ordered.rebuild(table.field_values(slots, field), slots)
+        for field, members in self.members.items():
+            for value, slot in zip(table.field_values(slots, field), slots):
+                members.add({field: value}, slot)
+
+    def _loaded_journal(self, entries: int):
+        self._journal_entries = entries
+        if entries and self._writable():
+            self.compact()
+
+    def _apply(self, entry: dict):
+        """Replay one journal entry. Entries carry full records, so replay is idempotent."""
+        if entry["op"] == "delete":
+            if entry["id"] in self._slots:
+                self._remove(entry["id"])
+            return
+        record = entry["record"]
+        if record["id"] in self._slots:
+            self._replace(record["id"], record)
+        else:
+            self._add(record)
+
+    def _persist(self, entries: List[dict]) -> Optional[Future]:
+        """Queue mutations for the writer; the caller's outermost `with self.lock` waits for them.
+        Returns the commit ticket, or None when there is nothing left to wait for."""
+        if self._pending is not None:
+            # Written together when the batch commits
+            self._pending.extend(entries)
+            return None
+        if self.shared is not None:
+            # Other processes are waiting on our lock: write now, then tell them
+            self._flush(entries)
+            self._seen = self.shared.publish(self.name, self._signature)
+            return None
+        ticket = self.writer.submit(entries)
+        self.lock.defer(ticket)
+        return ticket
+
+    def _flush(self, entries: List[dict]):
+        """Writer thread: make a batch of mutations durable"""
+        self._write_snapshot()
+
+    def _write_snapshot(self, drop_journal: bool = False):
+        with self.lock.mutex:
+            table = self._table.snapshot()
+        # Serialize outside the lock, streaming records out of the copy
+        if self.binary:
+            tmp_path = snapshot.dump_table_tmp(self.path, self.name, table)
+        else:
+            tmp_path = dump_collection_tmp(self.path, self.name, table.records())
+        with self.lock.mutex:
+            replace_file(tmp_path, self.path)
+            if drop_journal and os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+                self._journal_end = 0
+            self._signature = self._current_signature()
+
+    def compact(self):
+        """Fold the journal into the snapshot and clear it"""
+        self._write_snapshot(drop_journal=True)
+
+    def flush(self):
+        """Wait until every mutation made so far is on disk"""
+        self.writer.wait_idle()
+
+    def _add(self, record: dict):
+        _changing()
+        slot = self._table.append(record)
+        self._slots[record["id"]] = slot
+        for index in self.indexes.values():
+            index.add(record, slot)
+        for ordered in self.ordered.values():
+            ordered.add(record, slot)
+        for members in self.members.values():
+            members.add(record, slot)
+        if self._undo is not None and not self._loading:
+            self._undo.append(("add", record["id"]))
+        self._notify(None, record)
+
+    def _restore(self, slot: int, record: dict):
+        """Undo the removal of `record` from `slot`, keeping collection order"""
+        _changing()
+        self._table.restore(slot, record)
+        self._slots[record["id"]] = slot
+        for index in self.indexes.values():
+            index.add(record, slot)
+        for ordered in self.ordered.values():
+            ordered.add(record, slot)
+        for members in self.members.values():
+            members.add(record, slot)
+        self._notify(None, record)
+
+    def _notify(self, old: Optional[dict], new: Optional[dict]):
+        if self._loading:
+            return
+        self._version += 1
+        if self._events is not None:
+            # Told when the batch commits, or never if it is rolled back
+            self._events.append((self, old, new))
+            return
+        self._tell(old, new)
+
+    def _tell(self, old: Optional[dict], new: Optional[dict]):
+        for listener in self.listeners:
+            listener.changed(self.name, old, new)
+
+    def _remove(self, record_id: str) -> dict:
+        _changing()
+        slot = self._slots.pop(record_id)
+        record = self._table.record(slot)
+        self._table.delete(slot)
+        for index in self.indexes.values():
+            index.remove(record, slot)
+        for ordered in self.ordered.values():
+            ordered.remove(record, slot)
+        for members in self.members.values():
+            members.remove(record, slot)
+        if self._undo is not None and not self._loading:
+            self._undo.append(("remove", slot, record))
+        self._notify(record, None)
+        return record
+
+    def _replace(self, record_id: str, changes: dict, merge: bool = True) -> dict:
+        _changing()
+        slot = self._slots[record_id]
+        old = self._table.record(slot)
+        # Replace rather than mutate so lists handed out by all() stay consistent
+        new = {**old, **changes} if merge else changes
+        for index in self.indexes.values():
+            if index.key(old) != index.key(new):
+                index.remove(old, slot)
+                index.add(new, slot)
+        for field, ordered in self.ordered.items():
+            if old.get(field) != new.get(field):
+                ordered.remove(old, slot)
+                ordered.add(new, slot)
+        for field, members in self.members.items():
+            if old.get(field) != new.get(field):
+                members.remove(old, slot)
+                members.add(new, slot)
+        self._table.replace(slot, new)
+        if self._undo is not None and not self._loading:
+            self._undo.append(("replace", record_id, old))
+        self._notify(old, new)
+        return new
+
+    # ---- batches ----
+
+    def _begin(self, events: list):
+        """Start a batch: changes are recorded for undo, their writes held back and the
+        events for listeners collected in `events` (caller holds `lock`)"""
+        if self._loaded:
+            # Catch up now; once the batch changes the collection, memory is ahead of the files
+            self._ensure_fresh()
+        self._undo, self._pending, self._events = [], [], events
+
+    def _commit(self) -> Optional[Future]:
+        """End a batch, writing all of its changes at once; returns the commit ticket (see _persist)"""
+        entries = self._pending
+        self._undo = self._pending = self._events = None
+        return self._persist(entries) if entries else None
+
+    def _rollback(self):
+        """End a batch, undoing its changes in memory; nothing of it was written, and
+        listeners hear of neither the changes nor the undo"""
+        undo = self._undo
+        self._undo = self._pending = None
+        for step in reversed(undo):
+            if step[0] == "add":
+                self._remove(step[1])
+            elif step[0] == "remove":
+                self._restore(step[1], step[2])
+            else:
+                self._replace(step[1], step[2], merge=False)
+        self._events = None
+
+    def _best_index(self, criteria: dict) -> Optional[Index]:
+        """The index over the most queried fields, preferring the smallest bucket"""
+        best, best_rank = None, None
+        for fields, index in self.indexes.items():
+            if not set(fields) <= criteria.keys():
+                continue
+            rank = (-len(fields), index.size(index.key(criteria)))
+            if best_rank is None or rank < best_rank:
+                best, best_rank = index, rank
+        return best
+
+    def _match_slots(self, criteria: dict) -> List[int]:
+        """Slots of the records matching `criteria`, in collection order"""
+        if not criteria:
+            return self._table.live_slots()
+        index = self._best_index(criteria)
+        if index is None:
+            candidates = self._table.live_slots()
+        else:
+            candidates = index.lookup(index.key(criteria))
+            if len(index.fields) == len(criteria):
+                return candidates
+        value = self._table.value
+        return [s for s in candidates if all(value(s, f) == v for f, v in criteria.items())]
+
+    def _match(self, criteria: dict) -> List[dict]:
+        return self._table.records_at(self._match_slots(criteria))
+
+    # ---- reads ----
+
+    def refresh(self):
+        """Reload from disk if the file changed outside the process"""
+        with self.lock.mutex:
+            self._ensure_fresh()
+
+    @property
+    def version(self) -> int:
+        """Counter that increases with every change to the collection"""
+        with self.lock.mutex:
+            self._ensure_fresh()
+            # The shared counter is the same in every process, and so are ETags built from it
+            return self._version if self.shared is None else self._seen
+
+    def all(self) -> List[dict]:
+        with self.lock.mutex:
+            self._ensure_fresh()
+            # Records are built from a copy, outside the lock, so writers are not held up
+            table = self._table.snapshot()
+        return table.records_at(table.live_slots())
+
+    def project(self, fields: Tuple[str, ...]) -> List[dict]:
+        """Every record, in collection order, with at least `fields`.
+
+        Cheaper than all() for a compact collection, which then decodes only
+        those fields; the dicts may carry more fields than asked for.
+        """
+        with self.lock.mutex:
+            self._ensure_fresh()
+            table = self._table.snapshot()
+        return table.records_at(table.live_slots(), fields)
+
+    def get(self, record_id: str) -> Optional[dict]:
+        with self.lock.mutex:
+            self._ensure_fresh()
+            slot = self._slots.get(record_id)
+            return None if slot is None else self._table.record(slot)
+
+    def get_many(self, record_ids: Iterable[str], fields: Optional[Tuple[str, ...]] = None) -> List[dict]:
+        """The records with the given ids, in collection order; missing ids are skipped.
+        With `fields`, as in project()."""
+        with self.lock.mutex:
+            self._ensure_fresh()
+            slots = sorted(self._slots[i] for i in set(record_ids) if i in self._slots)
+            return self._table.records_at(slots, fields)
+
+    def find_in(self, field: str, values: Iterable, fields: Optional[Tuple[str, ...]] = None) -> List[dict]:
+        """Records whose `field` (which must have an index of its own) is one of `values`, in collection order.
+        With `fields`, as in project()."""
+        with self.lock.mutex:
+            self._ensure_fresh()
+            index = self.indexes[(field,)]
+            slots = sorted(slot for value in set(values) for slot in index.lookup(value))
+            return self._table.records_at(slots, fields)
+
+    def listing(self, field: str, value) -> List[dict]:
+        """Records whose list `field` (one of `member_fields`) holds `value`, in collection order"""
+        with self.lock.mutex:
+            self._ensure_fresh()
+            return self._table.records_at(self.members[field].lookup(value))
+
+    def find(self, **criteria) -> List[dict]:
+        """Records whose fields equal every value in `criteria`, served from an index when one fits"""
+        with self.lock.mutex:
+            self._ensure_fresh()
+            return self._match(criteria)
+
+    def query(self, criteria: Optional[dict] = None, sort: Optional[str] = None,
+              between: Optional[Tuple[str, Optional[str], Optional[str]]] = None,
+              after: Optional[tuple] = None, limit: Optional[int] = None) -> Tuple[List[dict], Optional[tuple]]:
+        """One page of the records matching `criteria`.
+
+        `between` is (field, low, high) with inclusive, optional bounds; it is
+        answered from an ordered index when the field has one. `sort` is a
+        field name, "-" prefixed for descending; ties (and no sort at all)
+        follow collection order. `after` is the position returned with the
+        previous page. Returns (records, position of the last record, or
+        None when there are no more). Raises ValueError for a position that
+        can no longer be resumed from.
+        """
+        criteria = criteria or {}
+        field, descending = paging.parse_sort(self.name, sort)
+        with self.lock.mutex:
+            self._ensure_fresh()
+            slots, by_field = self._candidates(criteria, between or (field and (field, None, None)))
+            value = self._table.value
+            if field is None:
+                key = lambda s: (s,)
+            else:
+                key = lambda s: (paging.sort_value(value(s, field)), s)
+            if by_field != (field or "position"):
+                slots.sort(key=key)
+            if after is not None:
+                after = self._resume(after, 1 if field is None else 2)
+            # Pages are cut from slots so only the returned records are built
+            page, position = paging.paginate(slots, key, descending, after, limit)
+            if position is not None:
+                position += (value(page[-1], "id"), self._layout)
+            return self._table.records_at(page), position
+
+    def _resume(self, after: tuple, size: int) -> tuple:
+        """The sort key in a position returned by query, in terms of the current slots.
+
+        Positions end with the last record's id and the layout its slot
+        belongs to. Slots are renumbered when the files are reloaded (and
+        differ between workers), so the record's current slot is used then.
+        """
+        if len(after) != size + 2:
+            raise ValueError("Invalid cursor")
+        key, record_id, layout = after[:size], after[size], after[size + 1]
+        if layout == self._layout:
+            return key
+        slot = self._slots.get(record_id)
+        if slot is None:
+            raise ValueError("Cursor has expired; start the listing again")
+        return key[:-1] + (slot,)
+
+    def scan(self, criteria: Optional[dict] = None,
+             between: Optional[Tuple[str, Optional[str], Optional[str]]] = None,
+             batch_size: int = 1000) -> Iterator[List[dict]]:
+        """Matching records in collection order, in batches, as of the first batch.
+
+        Works from a copy of the table taken under the lock (references to
+        the stored immutable records, or bulk-copied column arrays), so
+        records are only built batch by batch as the export is consumed.
+        """
+        with self.lock.mutex:
+            self._ensure_fresh()
+            slots, by_field = self._candidates(criteria or {}, between)
+            if by_field != "position":
+                slots.sort()
+            table = self._table.snapshot()
+        for i in range(0, len(slots), batch_size):
+            yield table.records_at(slots[i:i + batch_size])
+
+    def _candidates(self, criteria: dict, between) -> Tuple[List[int], str]:
+        """Slots of the matching records and their order ("position" or the ordered field).
+
+        `between` may also be just the sort field with open bounds, which lets
+        a sorted listing read in index order instead of sorting.
+        """
+        ordered = self.ordered.get(between[0]) if between else None
+        value = self._table.value
+        if ordered is not None:
+            field, low, high = between
+            index = self._best_index(criteria) if criteria else None
+            # A small hash bucket beats walking a wide date range
+            if index is None or index.size(index.key(criteria)) >= ordered.count(low, high):
+                slots = [s for _, s in ordered.range(low, high)]
+                if criteria:
+                    slots = [s for s in slots if all(value(s, f) == v for f, v in criteria.items())]
+                return slots, field
+        slots = self._match_slots(criteria)
+        if between and (between[1] is not None or between[2] is not None):
+            field, low, high = between
+            slots = [
+                s for s in slots
+                if (low is None or paging.sort_value(value(s, field)) >= low)
+                and (high is None or paging.sort_value(value(s, field)) <= high)
+            ]
+        return slots, "position"
+
+    def existing_keys(self, fields: Tuple[str, ...], keys: set) -> set:
+        """The subset of `keys` (value tuples over `fields`) some stored record has"""
+        with self.lock.mutex:
+            self._ensure_fresh()
+            covering = [index for index in self.indexes.values() if set(index.fields) <= set(fields)]
+            if covering:
+                index = max(covering, key=lambda index: len(index.fields))
+                positions = [fields.index(f) for f in index.fields]
+                bucket_key = (lambda k: k[positions[0]]) if len(positions) == 1 else (lambda k: tuple(k[p] for p in positions))
+                # Checking each key's bucket beats a scan unless the buckets are large
+                if sum(index.size(bucket_key(k)) for k in keys) < len(self._slots):
+                    return {k for k in keys if self._match_slots(dict(zip(fields, k)))}
+            value = self._table.value
+            stored = {tuple(value(s, f) for f in fields) for s in self._table.live_slots()}
+            return keys & stored
+
+    def __len__(self) -> int:
+        with self.lock.mutex:
+            self._ensure_fresh()
+            return len(self._slots)
+
+    def approx_bytes(self) -> int:
+        """Estimated memory held by the records and indexes, without loading them (0 until loaded).
+
+        Re-estimated only after the collection changed.
+        """
+        with self.lock.mutex:
+            if not self._loaded:
+                return 0
+            version, estimate = self._bytes
+            if version != self._version:
+                records = len(self._slots)
+                estimate = self._table.approx_bytes() + sys.getsizeof(self._slots)
+                for index in self.indexes.values():
+                    estimate += sys.getsizeof(index.buckets) + len(index.buckets) * BUCKET_BYTES + records * 8
+                for ordered in self.ordered.values():
+                    estimate += sys.getsizeof(ordered.entries) + records * ORDERED_ENTRY_BYTES
+                self._bytes = (self._version, estimate)
+            return estimate
+
+    # ---- writes ----
+
+    def insert(self, record: dict) -> dict:
+        with self.lock:
+            self._ensure_fresh()
+            self._add(record)
+            self._persist([{"op": "insert", "record": record}])
+            return record
+
+    def insert_many(self, records: List[dict]) -> List[dict]:
+        """Append several records with a single write"""
+        with self.lock:
+            self._ensure_fresh()
+            if records:
+                for record in records:
+                    self._add(record)
+                self._persist([{"op": "insert", "record": r} for r in records])
+            return records
+
+    def update(self, record_id: str, changes: dict) -> Optional[dict]:
+        """Merge `changes` into a record. Returns the updated record, or None if missing."""
+        with self.lock:
+            self._ensure_fresh()
+            if record_id not in self._slots:
+                return None
+            updated = self._replace(record_id, changes)
+            self._persist([{"op": "update", "record": updated}])
+            return updated
+
+    def update_many(self, changes_by_id: dict) -> List[dict]:
+        """Apply {id: changes} to several records with a single write"""
+        with self.lock:
+            self._ensure_fresh()
+            updated = [
+                self._replace(record_id, changes)
+                for record_id, changes in changes_by_id.items()
+                if record_id in self._slots
+            ]
+            if updated:
+                self._persist([{"op": "update", "record": r} for r in updated])
+            return updated
+
+    def delete(self, record_id: str) -> Optional[dict]:
+        """Remove a record. Returns the removed record, or None if missing."""
+        with self.lock:
+            self._ensure_fresh()
+            if record_id not in self._slots:
+                return None
+            deleted = self._remove(record_id)
+            self._persist([{"op": "delete", "id": record_id}])
+            return deleted
+
+    def delete_where(self, **criteria) -> List[dict]:
+        """Remove every record matching `criteria`. Returns the removed records."""
+        with self.lock:
+            self._ensure_fresh()
+            removed = [self._remove(r["id"]) for r in self._match(criteria)]
+            if removed:
+                self._persist([{"op": "delete", "id": r["id"]} for r in removed])
+            return removed
+
+class JournalCollection(Collection):
+    """Collection that appends mutations to `<name>.journal` instead of rewriting the file.
+
+    Each insert/update/delete is one JSON line, so write cost is proportional
+    to the change. On load the snapshot is read and the journal replayed on
+    top. Once the journal holds more entries than the snapshot has records
+    (and at least `compact_threshold`), it is folded back into the snapshot.
+    """
+
+    def __init__(self, name: str, data_dir: str, index_fields: List[tuple] = (),
+                 commit_window: float = 0.0, ordered_fields: List[str] = (),
+                 compact: bool = False, compact_threshold: int = 1000, file_format: str = "json", shared=None,
+                 member_fields: List[str] = ()):
+        super().__init__(name, data_dir, index_fields, commit_window, ordered_fields, compact, file_format, shared,
+                         member_fields)
+        self.compact_threshold = compact_threshold
+
+    def _loaded_journal(self, entries: int):
+        self._journal_entries = entries
+        self._maybe_compact()
+
+    def _flush(self, entries: List[dict]):
+        lines = b"".join(orjson.dumps(entry, default=str) + b"\n" for entry in entries)
+        started = time.perf_counter()
+        with open(self.journal_path, "ab") as f:
+            with self.lock.mutex:
+                f.write(lines)
+                f.flush()
+                self._journal_end += len(lines)
+                self._signature = self._current_signature()
+            os.fsync(f.fileno())
+        metrics.record_io("write", self.journal_path, len(lines), time.perf_counter() - started)
+        self._journal_entries += len(entries)
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self._writable() and self._journal_entries >= max(self.compact_threshold, len(self._slots)):
+            self.compact()
+
+    def compact(self):
+        super().compact()
+        self._journal_entries = 0
+
+# ==================== Batches ====================
+
+# How long the result of a batch sent with an idempotency key is kept for retries
+IDEMPOTENCY_SECONDS = 24 * 3600
+
+class Batch:
+    """What Store.batch yields: `replayed`, the result saved by an earlier batch with the same
+    key (None if there is none), and `result`, the result to save for this one"""
+
+    def __init__(self, replayed=None):
+        self.replayed = replayed
+        self.result = None
+
+class BatchLog:
+    """Results of the batches sent with an idempotency key: one JSON line each in `batches.log`.
+
+    Looked up and added to under every collection's lock (Store.batch), which
+    serializes batches between threads and processes. A result is visible at
+    once, but only goes to disk after the batch's own writes, so a crash in
+    between can make a retry apply the batch again but never answer for
+    changes that were lost. With `shared`, each lookup first reads the lines
+    other processes appended since. Once expired results make up most of the
+    file, it is rewritten with just the live ones.
+    """
+
+    COMPACT_LINES = 1000
+
+    def __init__(self, path: str, shared: bool = False, ttl: float = IDEMPOTENCY_SECONDS):
+        self.path = path
+        self.shared = shared
+        self.ttl = ttl
+        # Guards the results and the file, which are also written from collection writer threads
+        self.lock = threading.Lock()
+        self._results: Dict[str, Tuple[float, object]] = {}
+        self._read = False
+        self._end = 0
+        self._lines = 0
+        self._inode = None
+
+    def _catch_up(self):
+        if self._read and not self.shared:
+            # Nothing but this process appends
+            return
+        self._read = True
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+        inode = st.st_ino if st is not None else None
+        if inode != self._inode or (st is not None and st.st_size < self._end):
+            # Rewritten by another process
+            self._results, self._end, self._lines, self._inode = {}, 0, 0, inode
+        if st is None or st.st_size == self._end:
+            return
+        entries, self._end = read_journal_from(self.path, self._end)
+        for entry in entries:
+            self._results[entry["key"]] = (entry["at"], entry["result"])
+        self._lines += len(entries)
+
+    def get(self, key: str):
+        """The saved result for `key`, or None if there is none (or it expired)"""
+        with self.lock:
+            self._catch_up()
+            found = self._results.get(key)
+        if found is None or found[0] < time.time() - self.ttl:
+            return None
+        return found[1]
+
+    def add(self, key: str, result, after: List[Future] = ()) -> Future:
+        """Save `result` for `key` once the `after` tickets are done; returns the ticket of that write"""
+        entry = {"key": key, "at": time.time(), "result": result}
+        with self.lock:
+            self._results[key] = (entry["at"], result)
+        saved = Future()
+        remaining = set(after)
+
+        def write(ticket: Optional[Future] = None):
+            with self.lock:
+                remaining.discard(ticket)
+                if remaining:
+                    return
+                try:
+                    failed = next((t.exception() for t in after if t.exception() is not None), None)
+                    if failed is not None:
+                        raise failed
+                    self._append(entry)
+                except BaseException as exc:
+                    saved.set_exception(exc)
+                    return
+            saved.set_result(None)
+
+        if not after:
+            write()
+        for ticket in after:
+            ticket.add_done_callback(write)
+        return saved
+
+    def _append(self, entry: dict):
+        line = orjson.dumps(entry, default=str) + b"\n"
+        started = time.perf_counter()
+        with open(self.path, "ab") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+            self._end = f.tell()
+            self._inode = os.fstat(f.fileno()).st_ino
+        metrics.record_io("write", self.path, len(line), time.perf_counter() - started)
+        self._lines += 1
+        if self._lines >= self.COMPACT_LINES:
+            cutoff = time.time() - self.ttl
+            live = {key: value for key, value in self._results.items() if value[0] >= cutoff}
+            if self._lines > 2 * len(live):
+                self._rewrite(live)
+
+    def _rewrite(self, live: Dict[str, Tuple[float, object]]):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            for key, (at, result) in live.items():
+                f.write(orjson.dumps({"key": key, "at": at, "result": result}, default=str) + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+            end = f.tell()
+        replace_file(tmp_path, self.path)
+        self._results, self._end, self._lines = live, end, len(live)
+        self._inode = os.stat(self.path).st_ino
+
+class Store:
+    """All collections of one data directory.
+
+    This is the storage interface the routes use: `store[name]` returns a
+    collection (all/project/get/get_many/find/query/scan/insert/insert_many/update/update_many/
+    delete/delete_where, plus a `lock` for read-modify-write sequences and a
+    `version` counter), `insert`/`update`/`delete` write a record together
+    with the enrolment lists and dependent records it affects (LINKS and
+    CASCADES), `batch` groups changes to several collections into
+    one all-or-nothing commit, `versions` and `epoch` identify a state of the data
+    for response caching, and the report methods below (plus `analytics`,
+    see analytics.py) return the report payloads. SQLiteStore in
+    sqlite_store.py implements the same interface.
+
+    `file_format` is "json" or "msgpack" (binary snapshots, see snapshot.py).
+    With `shared`, several processes may serve `data_dir` at once (see
+    coherence.py); `epoch` is then common to all of them.
+    """
+
+    COLLECTIONS = ["students", "classes", "sessions", "attendance", "payments"]
+
+    # Reads are served from memory and writes can defer their disk flush
+    # (deferred_commits), so callers may use the store without blocking
+    IN_MEMORY = True
+
+    # Secondary indexes maintained per collection (every collection is also keyed by id)
+    INDEXES = {
+        "sessions": [("date",), ("classId",), ("classId", "date")],
+        # (sessionId, studentId) lookups use the sessionId index: a session has few attendance rows
+        "attendance": [("sessionId",), ("studentId",)],
+        "payments": [("studentId",)],
+    }
+
+    # Fields with an ordered index for range filters and sorting
+    ORDERED_INDEXES = {
+        "sessions": ["date"],
+        "payments": ["date"],
+    }
+
+    # What a delete removes along with the record, as ON DELETE CASCADE in
+    # supabase-schema.sql: collection -> [(collection, indexed field holding its id)]
+    CASCADES = {
+        "students": [("attendance", "studentId"), ("payments", "studentId")],
+        "classes": [("sessions", "classId")],
+        "sessions": [("attendance", "sessionId")],
+    }
+
+    # Enrolment is listed on both sides: collection -> (its list field, the other
+    # collection, the other's list field). Both fields have a MemberIndex.
+    LINKS = {
+        "students": ("enrolledClasses", "classes", "studentIds"),
+        "classes": ("studentIds", "students", "enrolledClasses"),
+    }
+
+    def __init__(self, data_dir: str, journal: bool = False, commit_window: float = 0.0,
+                 compact: bool = True, file_format: str = "json", shared: bool = False):
+        if file_format not in snapshot.FORMATS:
+            raise ValueError(f"unknown file format {file_format!r}, expected one of {', '.join(snapshot.FORMATS)}")
+        self.data_dir = data_dir
+        os.makedirs(data_dir, exist_ok=True)
+        collection_class = JournalCollection if journal else Collection
+        self.shared = coherence.SharedVersions(data_dir, self.COLLECTIONS) if shared else None
+        self.collections = {
+            name: collection_class(name, data_dir, self.INDEXES.get(name, []), commit_window,
+                                   ordered_fields=self.ORDERED_INDEXES.get(name, []), compact=compact,
+                                   file_format=file_format, shared=self.shared,
+                                   member_fields=[self.LINKS[name][0]] if name in self.LINKS else [])
+            for name in self.COLLECTIONS
+        }
+        self.balances = StudentBalances(self)
+        self.analytics = Analytics(self)
+        self.batch_log = BatchLog(os.path.join(data_dir, "batches.log"), shared=shared)
+        # Distinguishes this instance's versions from those of earlier runs
+        self._epoch = uuid.uuid4().hex[:8]
+
+    @property
+    def epoch(self) -> str:
+        return self._epoch if self.shared is None else self.shared.epoch
+
+    def __getitem__(self, name: str) -> Collection:
+        return self.collections[name]
+
+    def versions(self, names: Iterable[str]) -> tuple:
+        """Current versions of the named collections"""
+        return tuple(self.collections[name].version for name in names)
+
+    @contextmanager
+    def batch(self, key: Optional[str] = None) -> Iterator[Batch]:
+        """Make changes to any of the collections, all or nothing.
+
+        Holds every collection's lock, always taken in COLLECTIONS order, for
+        the whole block. If the block raises, its changes are undone in memory
+        and nothing is written; otherwise each changed collection writes all
+        of them with a single write (one rewrite, or one journal append) as
+        the block ends. Listeners are told of the changes only then. With
+        `key`, yields the result saved by an earlier batch with that key as
+        `replayed` (the block should then change nothing), and saves the
+        block's `result` for IDEMPOTENCY_SECONDS.
+        A batch (without a key) opened inside another becomes part of it.
+        """
+        collections = list(self.collections.values())
+        if key is None and all(c.lock.held and c._undo is not None for c in collections):
+            yield Batch()
+            return
+        saved = None
+        with ExitStack() as locks:
+            for collection in collections:
+                locks.enter_context(collection.lock)
+            batch = Batch(self.batch_log.get(key) if key is not None else None)
+            events = []
+            begun = []
+            try:
+                # Catching up may give up with WouldBlock (see nonblocking); nothing is changed yet then
+                for collection in collections:
+                    collection._begin(events)
+                    begun.append(collection)
+                yield batch
+            except BaseException:
+                for collection in begun:
+                    collection._rollback()
+                raise
+            tickets = [ticket for ticket in (collection._commit() for collection in collections) if ticket is not None]
+            # In the order the changes were made, before other threads can read them
+            for collection, old, new in events:
+                collection._tell(old, new)
+            if key is not None and batch.result is not None:
+                saved = self.batch_log.add(key, batch.result, tickets)
+        if saved is not None:
+            # Like the batch's own writes (see CommitLock), waited for or handed to deferred_commits
+            sink = getattr(_deferred, "tickets", None)
+            if sink is not None:
+                sink.append(saved)
+            else:
+                saved.result()
+
+    # ---- referential integrity ----
+
+    def insert(self, name: str, record: dict) -> dict:
+        """Insert a record, adding it to the enrolment lists of the records it lists (see LINKS)"""
+        field = self.LINKS[name][0] if name in self.LINKS else None
+        if not (field and record.get(field)):
+            return self.collections[name].insert(record)
+        with self.batch():
+            self.collections[name].insert(record)
+            self._link(name, record["id"], [], record[field])
+        return record
+
+    def update(self, name: str, record_id: str, changes: dict) -> Optional[dict]:
+        """Collection.update, keeping the other side of the enrolment in step with a changed list"""
+        field = self.LINKS[name][0] if name in self.LINKS else None
+        if field not in changes:
+            return self.collections[name].update(record_id, changes)
+        collection = self.collections[name]
+        with self.batch():
+            old = collection.get(record_id)
+            updated = collection.update(record_id, changes)
+            if updated is not None:
+                self._link(name, record_id, old.get(field) or [], updated.get(field) or [])
+        return updated
+
+    def delete(self, name: str, record_id: str) -> Optional[dict]:
+        """Delete a record with everything that references it (see CASCADES), and take it off
+        enrolment lists, in one batch. Returns the deleted record, or None if missing."""
+        with self.batch():
+            deleted = self.collections[name].delete(record_id)
+            if deleted is not None:
+                self._cascade(name, {record_id})
+        return deleted
+
+    def _link(self, name: str, record_id: str, old: List[str], new: List[str]):
+        """Make the other side of the enrolment agree with `record_id`'s list going from `old` to `new`"""
+        _, other_name, other_field = self.LINKS[name]
+        added, removed = set(new) - set(old), set(old) - set(new)
+        changes = {}
+        for other in self.collections[other_name].get_many(added | removed):
+            listed = other.get(other_field) or []
+            if other["id"] in added and record_id not in listed:
+                changes[other["id"]] = {other_field: listed + [record_id]}
+            elif other["id"] in removed and record_id in listed:
+                changes[other["id"]] = {other_field: [i for i in listed if i != record_id]}
+        if changes:
+            self.collections[other_name].update_many(changes)
+
+    def _cascade(self, name: str, deleted_ids: set):
+        """Remove what refers to the just deleted records of `name`, found through the indexes,
+        so the work is proportional to the records affected"""
+        if name in self.LINKS:
+            _, other_name, other_field = self.LINKS[name]
+            other = self.collections[other_name]
+            listing = {}
+            for deleted_id in deleted_ids:
+                for record in other.listing(other_field, deleted_id):
+                    listing[record["id"]] = record
+            other.update_many({
+                record_id: {other_field: [i for i in record[other_field] if i not in deleted_ids]}
+                for record_id, record in listing.items()
+            })
+        for child_name, field in self.CASCADES.get(name, []):
+            child = self.collections[child_name]
+            removed = set()
+            for deleted_id in deleted_ids:
+                removed.update(record["id"] for record in child.delete_where(**{field: deleted_id}))
+            if removed:
+                self._cascade(child_name, removed)
+
+    def flush(self):
+        """Wait until every collection's queued writes are on disk"""
+        for collection in self.collections.values():
+            collection.flush()
+
+    def close(self):
+        """Flush, and close the files kept open for other processes; the store is not used afterwards"""
+        self.flush()
+        if self.shared is not None:
+            self.shared.close()
+
+    def approx_bytes(self) -> int:
+        """Estimated memory held by the loaded collections (see Collection.approx_bytes)"""
+        return sum(collection.approx_bytes() for collection in self.collections.values())
+
+    # ---- reports ----
+
+    def payroll_report(self, start_date: str, end_date: str) -> dict:
+        """Payroll from the sessions in the range (read off the date index) and their attendance"""
+        sessions, _ = self["sessions"].query(between=("date", start_date, end_date))
+        attendance = self["attendance"].find_in("sessionId", [s["id"] for s in sessions])
+        student_hours = reports.student_hours(sessions, attendance)
+        students = self["students"].get_many(student_hours)
+        return reports.payroll_summary(student_hours, {s["id"]: s for s in students}, start_date, end_date)
+
+    def hours_between(self, start_date: Optional[str], end_date: Optional[str]) -> float:
+        """Total hours of the sessions dated between start_date and end_date (either may be None)"""
+        sessions, _ = self["sessions"].query(between=("date", start_date, end_date))
+        return sum(s["hoursWorked"] for s in sessions)
+
+    def student_balance(self, student_id: str) -> Optional[dict]:
+        """Balance for one student, or None if the student does not exist"""
+        student = self["students"].get(student_id)
+        if student is None:
+            return None
+        return reports.balance_summary(student, *student_totals(self, [student_id])[student_id])
+
+    def all_balances(self) -> List[dict]:
+        """Balance of every student, added up again only for the students changed since the last call"""
+        return self.balances.all_balances()
+
+    def check_balances(self) -> dict:
+        return self.balances.check()
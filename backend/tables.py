@@ -0,0 +1,569 @@
+"""Record storage behind storage.Collection: DictTable keeps records as dicts, CompactTable as typed columns"""
+
+import sys
+from array import array
+from itertools import compress
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+class NotEncodable(Exception):
+    """A value does not fit a column; the record is kept as a plain dict instead"""
+
+def dump_array(values: array, keep: Optional[bytearray] = None) -> bytes:
+    """Raw little-endian bytes of an array (see load_array), only of the
+    entries whose `keep` flag is set if given"""
+    if keep is not None:
+        values = array(values.typecode, compress(values, keep))
+    elif sys.byteorder == "big":
+        values = array(values.typecode, values)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+def load_array(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    if len(data) % values.itemsize:
+        raise ValueError(f"{len(data)} bytes is not a whole number of {typecode!r} items")
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+# ==================== Memory estimates ====================
+
+# Values measured per list when estimating the memory held by a list's items
+SAMPLE_SIZE = 64
+
+def sampled_bytes(values: list, size: Callable[[object], int] = sys.getsizeof) -> int:
+    """Estimated memory of a list and its items, measuring an evenly spread sample of them"""
+    if not values:
+        return sys.getsizeof(values)
+    sample = values[::max(1, len(values) // SAMPLE_SIZE)]
+    return sys.getsizeof(values) + sum(map(size, sample)) * len(values) // len(sample)
+
+def record_bytes(record: Optional[dict]) -> int:
+    """Memory of a record dict and its values (field names are shared between records)"""
+    if record is None:
+        return 0
+    return sys.getsizeof(record) + sum(map(sys.getsizeof, record.values()))
+
+# ==================== Columns ====================
+
+class StrColumn:
+    """Strings kept as they are (ids, which are unique anyway)"""
+
+    def __init__(self):
+        self.values: List[Optional[str]] = []
+
+    def append(self, value):
+        if type(value) is not str:
+            raise NotEncodable
+        self.values.append(value)
+
+    def set(self, slot: int, value):
+        if type(value) is not str:
+            raise NotEncodable
+        self.values[slot] = value
+
+    def get(self, slot: int):
+        return self.values[slot]
+
+    def values_at(self, slots: List[int]) -> list:
+        values = self.values
+        return [values[slot] for slot in slots]
+
+    def pad(self):
+        self.values.append(None)
+
+    def copy(self) -> "StrColumn":
+        column = StrColumn()
+        column.values = list(self.values)
+        return column
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def approx_bytes(self) -> int:
+        return sampled_bytes(self.values)
+
+    def dump(self, keep: Optional[bytearray] = None) -> dict:
+        return {"kind": "str", "values": self.values if keep is None else list(compress(self.values, keep))}
+
+    @staticmethod
+    def load(payload: dict) -> "StrColumn":
+        column = StrColumn()
+        column.values = list(payload["values"])
+        return column
+
+class CodeColumn:
+    """Repeated strings (foreign keys, statuses, times) interned into a table of
+    distinct values, with each row holding a small integer code"""
+
+    def __init__(self, typecode: str = "i"):
+        self.codes = array(typecode)
+        self.strings: List[str] = []
+        self.lookup: Dict[str, int] = {}
+
+    def encode(self, value) -> int:
+        if type(value) is not str:
+            raise NotEncodable
+        code = self.lookup.get(value)
+        if code is None:
+            code = len(self.strings)
+            if code > 255 and self.codes.typecode == "B":
+                # More distinct values than a byte can number
+                self.codes = array("i", self.codes)
+            self.strings.append(value)
+            self.lookup[value] = code
+        return code
+
+    def append(self, value):
+        self.codes.append(self.encode(value))
+
+    def set(self, slot: int, value):
+        self.codes[slot] = self.encode(value)
+
+    def get(self, slot: int):
+        return self.strings[self.codes[slot]]
+
+    def values_at(self, slots: List[int]) -> list:
+        strings, codes = self.strings, self.codes
+        return [strings[codes[slot]] for slot in slots]
+
+    def pad(self):
+        self.codes.append(self.encode(""))
+
+    def copy(self) -> "CodeColumn":
+        column = CodeColumn()
+        column.codes = array(self.codes.typecode, self.codes)
+        # Strings are only ever appended, so sharing the list is safe for readers
+        column.strings = self.strings
+        return column
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def approx_bytes(self) -> int:
+        return sys.getsizeof(self.codes) + sampled_bytes(self.strings) + sys.getsizeof(self.lookup)
+
+    def dump(self, keep: Optional[bytearray] = None) -> dict:
+        return {"kind": "code", "typecode": self.codes.typecode, "codes": dump_array(self.codes, keep),
+                "strings": self.strings}
+
+    @staticmethod
+    def load(payload: dict) -> "CodeColumn":
+        column = CodeColumn(payload["typecode"])
+        column.codes = load_array(payload["typecode"], payload["codes"])
+        column.strings = list(payload["strings"])
+        column.lookup = {value: code for code, value in enumerate(column.strings)}
+        return column
+
+class DateColumn:
+    """YYYY-MM-DD dates stored as day ordinals"""
+
+    def __init__(self):
+        self.ordinals = array("i")
+
+    @staticmethod
+    def encode(value) -> int:
+        if type(value) is not str:
+            raise NotEncodable
+        try:
+            day = date.fromisoformat(value)
+        except ValueError:
+            raise NotEncodable
+        # fromisoformat also accepts forms such as 20250102; keep only the canonical one
+        if day.isoformat() != value:
+            raise NotEncodable
+        return day.toordinal()
+
+    def append(self, value):
+        self.ordinals.append(self.encode(value))
+
+    def set(self, slot: int, value):
+        self.ordinals[slot] = self.encode(value)
+
+    def get(self, slot: int):
+        return date.fromordinal(self.ordinals[slot]).isoformat()
+
+    def values_at(self, slots: List[int]) -> list:
+        # Far fewer distinct dates than rows: format each once
+        ordinals, formatted = self.ordinals, {}
+        values = []
+        for slot in slots:
+            ordinal = ordinals[slot]
+            value = formatted.get(ordinal)
+            if value is None:
+                value = formatted[ordinal] = date.fromordinal(ordinal).isoformat()
+            values.append(value)
+        return values
+
+    def pad(self):
+        self.ordinals.append(1)
+
+    def copy(self) -> "DateColumn":
+        column = DateColumn()
+        column.ordinals = array("i", self.ordinals)
+        return column
+
+    def __len__(self) -> int:
+        return len(self.ordinals)
+
+    def approx_bytes(self) -> int:
+        return sys.getsizeof(self.ordinals)
+
+    def dump(self, keep: Optional[bytearray] = None) -> dict:
+        return {"kind": "date", "ordinals": dump_array(self.ordinals, keep)}
+
+    @staticmethod
+    def load(payload: dict) -> "DateColumn":
+        column = DateColumn()
+        column.ordinals = load_array("i", payload["ordinals"])
+        return column
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+class TimestampColumn:
+    """Naive ISO timestamps (datetime.isoformat() output) stored as microseconds since 1970"""
+
+    def __init__(self):
+        self.micros = array("q")
+
+    @staticmethod
+    def encode(value) -> int:
+        if type(value) is not str:
+            raise NotEncodable
+        try:
+            moment = datetime.fromisoformat(value)
+        except ValueError:
+            raise NotEncodable
+        if moment.tzinfo is not None or moment.isoformat() != value:
+            raise NotEncodable
+        return (moment - EPOCH) // MICROSECOND
+
+    def append(self, value):
+        self.micros.append(self.encode(value))
+
+    def set(self, slot: int, value):
+        self.micros[slot] = self.encode(value)
+
+    def get(self, slot: int):
+        return (EPOCH + timedelta(microseconds=self.micros[slot])).isoformat()
+
+    def values_at(self, slots: List[int]) -> list:
+        micros = self.micros
+        return [(EPOCH + timedelta(microseconds=micros[slot])).isoformat() for slot in slots]
+
+    def pad(self):
+        self.micros.append(0)
+
+    def copy(self) -> "TimestampColumn":
+        column = TimestampColumn()
+        column.micros = array("q", self.micros)
+        return column
+
+    def __len__(self) -> int:
+        return len(self.micros)
+
+    def approx_bytes(self) -> int:
+        return sys.getsizeof(self.micros)
+
+    def dump(self, keep: Optional[bytearray] = None) -> dict:
+        return {"kind": "timestamp", "micros": dump_array(self.micros, keep)}
+
+    @staticmethod
+    def load(payload: dict) -> "TimestampColumn":
+        column = TimestampColumn()
+        column.micros = load_array("q", payload["micros"])
+        return column
+
+class FloatColumn:
+    def __init__(self):
+        self.values = array("d")
+
+    def append(self, value):
+        if type(value) is not float:
+            raise NotEncodable
+        self.values.append(value)
+
+    def set(self, slot: int, value):
+        if type(value) is not float:
+            raise NotEncodable
+        self.values[slot] = value
+
+    def get(self, slot: int):
+        return self.values[slot]
+
+    def values_at(self, slots: List[int]) -> list:
+        values = self.values
+        return [values[slot] for slot in slots]
+
+    def pad(self):
+        self.values.append(0.0)
+
+    def copy(self) -> "FloatColumn":
+        column = FloatColumn()
+        column.values = array("d", self.values)
+        return column
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def approx_bytes(self) -> int:
+        return sys.getsizeof(self.values)
+
+    def dump(self, keep: Optional[bytearray] = None) -> dict:
+        return {"kind": "float", "values": dump_array(self.values, keep)}
+
+    @staticmethod
+    def load(payload: dict) -> "FloatColumn":
+        column = FloatColumn()
+        column.values = load_array("d", payload["values"])
+        return column
+
+# Column classes by the "kind" their dump() records
+COLUMN_KINDS = {"str": StrColumn, "code": CodeColumn, "date": DateColumn, "timestamp": TimestampColumn, "float": FloatColumn}
+
+# Column layout per compact collection, in the order records' fields are returned
+SCHEMAS = {
+    "attendance": [
+        ("id", StrColumn), ("sessionId", CodeColumn), ("studentId", CodeColumn),
+        ("status", lambda: CodeColumn("B")), ("createdAt", TimestampColumn),
+    ],
+    "sessions": [
+        ("id", StrColumn), ("classId", CodeColumn), ("date", DateColumn),
+        ("startTime", CodeColumn), ("endTime", CodeColumn),
+        ("hoursWorked", FloatColumn), ("createdAt", TimestampColumn),
+    ],
+}
+
+# ==================== Tables ====================
+
+class DictTable:
+    """Records kept as plain dicts, one per slot (None once deleted)"""
+
+    def __init__(self):
+        self.rows: List[Optional[dict]] = []
+
+    def __len__(self) -> int:
+        """Number of slots, including those of deleted records"""
+        return len(self.rows)
+
+    def append(self, record: dict) -> int:
+        self.rows.append(record)
+        return len(self.rows) - 1
+
+    def replace(self, slot: int, record: dict):
+        self.rows[slot] = record
+
+    def delete(self, slot: int):
+        self.rows[slot] = None
+
+    def restore(self, slot: int, record: dict):
+        """Put a deleted record back in its slot"""
+        self.rows[slot] = record
+
+    def record(self, slot: int) -> dict:
+        return self.rows[slot]
+
+    def value(self, slot: int, field: str):
+        return self.rows[slot].get(field)
+
+    def records_at(self, slots: List[int], fields: Optional[Tuple[str, ...]] = None) -> List[dict]:
+        """Records of `slots`, in that order. Stored records are never modified,
+        so the whole record also stands in for a projection onto `fields`."""
+        rows = self.rows
+        return [rows[slot] for slot in slots]
+
+    def field_values(self, slots: List[int], field: str) -> list:
+        """`field` of the records in `slots` (None where missing)"""
+        rows = self.rows
+        return [rows[slot].get(field) for slot in slots]
+
+    def live_slots(self) -> List[int]:
+        return [slot for slot, record in enumerate(self.rows) if record is not None]
+
+    def snapshot(self) -> "DictTable":
+        """Copy that later changes to this table do not affect"""
+        table = DictTable()
+        table.rows = list(self.rows)
+        return table
+
+    def records(self) -> Iterator[dict]:
+        return (record for record in self.rows if record is not None)
+
+    def approx_bytes(self) -> int:
+        """Estimated memory of the records (see sampled_bytes)"""
+        return sampled_bytes(self.rows, record_bytes)
+
+class CompactTable:
+    """Records stored column by column (see SCHEMAS), rebuilt as dicts when read.
+
+    Only records whose fields are exactly the schema's, in the schema's order
+    and with values each column can hold, are stored in columns; anything
+    else (hand-edited rows, extra fields, unusual timestamps) is kept whole
+    as a dict in `overflow`, so every record reads back exactly as written.
+    """
+
+    def __init__(self, schema: List[tuple]):
+        self.schema = schema
+        self.fields = tuple(field for field, _ in schema)
+        self.columns = {field: make() for field, make in schema}
+        self.alive = bytearray()
+        self.overflow: Dict[int, dict] = {}
+
+    def __len__(self) -> int:
+        return len(self.alive)
+
+    def _fits(self, record: dict) -> bool:
+        return len(record) == len(self.fields) and tuple(record) == self.fields
+
+    def append(self, record: dict) -> int:
+        slot = len(self.alive)
+        appended = []
+        try:
+            if not self._fits(record):
+                raise NotEncodable
+            for field in self.fields:
+                column = self.columns[field]
+                column.append(record[field])
+                appended.append(column)
+        except NotEncodable:
+            # Keep every column one entry per slot
+            for field in self.fields:
+                column = self.columns[field]
+                if all(column is not done for done in appended):
+                    column.pad()
+            self.overflow[slot] = record
+        self.alive.append(1)
+        return slot
+
+    def replace(self, slot: int, record: dict):
+        if self._fits(record):
+            previous = {field: self.columns[field].get(slot) for field in self.fields} if slot not in self.overflow else None
+            try:
+                for field in self.fields:
+                    self.columns[field].set(slot, record[field])
+            except NotEncodable:
+                if previous is not None:
+                    for field, value in previous.items():
+                        self.columns[field].set(slot, value)
+            else:
+                self.overflow.pop(slot, None)
+                return
+        self.overflow[slot] = record
+
+    def delete(self, slot: int):
+        self.alive[slot] = 0
+        self.overflow.pop(slot, None)
+
+    def restore(self, slot: int, record: dict):
+        """Put a deleted record back in its slot"""
+        self.alive[slot] = 1
+        self.replace(slot, record)
+
+    def record(self, slot: int) -> dict:
+        record = self.overflow.get(slot)
+        if record is not None:
+            return record
+        return {field: self.columns[field].get(slot) for field in self.fields}
+
+    def value(self, slot: int, field: str):
+        record = self.overflow.get(slot)
+        if record is not None:
+            return record.get(field)
+        column = self.columns.get(field)
+        return None if column is None else column.get(slot)
+
+    def field_values(self, slots: List[int], field: str) -> list:
+        """`field` of the records in `slots` (None where missing), decoded from its column"""
+        column = self.columns.get(field)
+        values = column.values_at(slots) if column is not None else [None] * len(slots)
+        if self.overflow:
+            overflow = self.overflow
+            for i in compress(range(len(slots)), map(overflow.__contains__, slots)):
+                values[i] = overflow[slots[i]].get(field)
+        return values
+
+    def records_at(self, slots: List[int], fields: Optional[Tuple[str, ...]] = None) -> List[dict]:
+        """Records of `slots`, in that order, decoded a column at a time.
+
+        With `fields`, only those columns are decoded (records kept in
+        `overflow` are still returned whole).
+        """
+        names = self.fields if fields is None else tuple(f for f in fields if f in self.columns)
+        columns = [self.columns[name].values_at(slots) for name in names]
+        records = [dict(zip(names, values)) for values in zip(*columns)] if names else [{} for _ in slots]
+        if self.overflow:
+            overflow = self.overflow
+            for i, slot in enumerate(slots):
+                record = overflow.get(slot)
+                if record is not None:
+                    records[i] = record
+        return records
+
+    def live_slots(self) -> List[int]:
+        return [slot for slot, alive in enumerate(self.alive) if alive]
+
+    def snapshot(self) -> "CompactTable":
+        """Copy that later changes to this table do not affect (arrays copy in bulk)"""
+        table = CompactTable.__new__(CompactTable)
+        table.schema = self.schema
+        table.fields = self.fields
+        table.columns = {field: column.copy() for field, column in self.columns.items()}
+        table.alive = bytearray(self.alive)
+        table.overflow = dict(self.overflow)
+        return table
+
+    def records(self) -> Iterator[dict]:
+        slots = self.live_slots()
+        for i in range(0, len(slots), 1000):
+            yield from self.records_at(slots[i:i + 1000])
+
+    def approx_bytes(self) -> int:
+        """Estimated memory of the columns and the records kept whole"""
+        return (sum(column.approx_bytes() for column in self.columns.values()) + sys.getsizeof(self.alive)
+                + sys.getsizeof(self.overflow) + sum(map(record_bytes, self.overflow.values())))
+
+    def dump(self) -> dict:
+        """The table's columns as plain values and bytes, for snapshot files (see load).
+
+        Slots of deleted records are left out, as a JSON file would leave
+        them out, so the slots of the rest shift down.
+        """
+        keep = None if all(self.alive) else self.alive
+        overflow = self.overflow
+        if keep is not None and overflow:
+            # New slot = number of live slots before the old one
+            overflow, live, previous = {}, 0, 0
+            for slot in sorted(self.overflow):
+                live += self.alive.count(1, previous, slot)
+                previous = slot
+                overflow[live] = self.overflow[slot]
+        return {
+            "fields": list(self.fields),
+            "columns": [self.columns[field].dump(keep) for field in self.fields],
+            "alive": bytes(self.alive) if keep is None else bytes([1]) * self.alive.count(1),
+            "overflow": overflow,
+        }
+
+    @staticmethod
+    def load(payload: dict) -> "CompactTable":
+        """Table restored from dump() output, with the column layout it was written with"""
+        columns = [COLUMN_KINDS[column["kind"]].load(column) for column in payload["columns"]]
+        fields = tuple(payload["fields"])
+        table = CompactTable.__new__(CompactTable)
+        table.schema = [(field, type(column)) for field, column in zip(fields, columns)]
+        table.fields = fields
+        table.columns = dict(zip(fields, columns))
+        table.alive = bytearray(payload["alive"])
+        table.overflow = {int(slot): record for slot, record in payload["overflow"].items()}
+        if any(len(column) != len(table.alive) for column in columns):
+            raise ValueError("snapshot columns have different lengths")
+        return table
+
+def make_table(name: str, compact: bool):
+    if compact and name in SCHEMAS:
+        return CompactTable(SCHEMAS[name])
+    return DictTable()
@@ -0,0 +1,217 @@
+"""Tenants: many tutors served from one process, each with their own data directory"""
+
+import contextvars
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+import encoding
+import metrics
+from storage import WouldBlock, nonblocking
+
+HEADER = b"x-tenant"
+PREFIX = "/tenants/"
+TENANT_ID = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]{0,63}")
+
+TENANT_HITS = metrics.REGISTRY.counter(
+    "tuition_tenant_hits_total", "Requests for a tenant whose store was already open", ("tenant",))
+TENANT_LOADS = metrics.REGISTRY.counter(
+    "tuition_tenant_loads_total", "Times a tenant's store was opened (first request, or after eviction)", ("tenant",))
+TENANT_EVICTIONS = metrics.REGISTRY.counter(
+    "tuition_tenant_evictions_total", "Times a tenant's store was closed to stay within the LRU bounds", ("tenant",))
+
+class Tenant:
+    """An open tenant: its store, its change feed, and the number of requests using it"""
+
+    def __init__(self, store, change_feed):
+        self.id = None
+        self.store = store
+        self.change_feed = change_feed
+        self.leases = 0
+        self.bytes = 0
+
+class TenantStores:
+    """LRU of open tenants, bounded by `max_tenants` and by `max_bytes` of estimated memory.
+
+    `open_tenant(path)` returns a new Tenant for a tenant directory. A tenant
+    is leased by `lookup`/`acquire` for the duration of a request and is only
+    evicted once no lease is left; the most recently used tenant is never
+    evicted, even if it alone exceeds `max_bytes`.
+    """
+
+    def __init__(self, root: str, open_tenant: Callable[[str], Tenant], max_tenants: int = 100,
+                 max_bytes: int = 1 << 30):
+        self.root = root
+        self.open_tenant = open_tenant
+        self.max_tenants = max_tenants
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self._tenants: "OrderedDict[str, Tenant]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._tenants)
+
+    @property
+    def bytes(self) -> int:
+        """Estimated memory held by the open tenants, as of their last release"""
+        with self.lock:
+            return sum(tenant.bytes for tenant in self._tenants.values())
+
+    def sizes(self) -> dict:
+        with self.lock:
+            return {tenant_id: tenant.bytes for tenant_id, tenant in self._tenants.items()}
+
+    def path(self, tenant_id: str) -> str:
+        return os.path.join(self.root, tenant_id)
+
+    def lookup(self, tenant_id: str) -> Optional[Tenant]:
+        """Lease an open tenant, or return None if it is not open (see acquire)"""
+        with self.lock:
+            tenant = self._tenants.get(tenant_id)
+            if tenant is None:
+                return None
+            self._tenants.move_to_end(tenant_id)
+            tenant.leases += 1
+        TENANT_HITS.inc(tenant_id)
+        return tenant
+
+    def acquire(self, tenant_id: str) -> Tenant:
+        """Lease a tenant, opening it if needed. Raises KeyError for a tenant without a directory."""
+        tenant = self.lookup(tenant_id)
+        if tenant is not None:
+            return tenant
+        path = self.path(tenant_id)
+        if not os.path.isdir(path):
+            raise KeyError(tenant_id)
+        with self.lock:
+            # Opening a store only reads its files as collections are used, so it can happen under the lock
+            tenant = self._tenants.get(tenant_id)
+            if tenant is None:
+                tenant = self._tenants[tenant_id] = self.open_tenant(path)
+                tenant.id = tenant_id
+                loaded = True
+            else:
+                self._tenants.move_to_end(tenant_id)
+                loaded = False
+            tenant.leases += 1
+        (TENANT_LOADS if loaded else TENANT_HITS).inc(tenant_id)
+        return tenant
+
+    def release(self, tenant: Tenant) -> List[Tenant]:
+        """End a lease. Returns the tenants evicted to stay within bounds, for the caller to `close`."""
+        # Re-estimated only for collections changed since the last estimate
+        estimate = tenant.store.approx_bytes()
+        with self.lock:
+            tenant.leases -= 1
+            tenant.bytes = estimate
+            total = sum(t.bytes for t in self._tenants.values())
+            evicted = []
+            for candidate in list(self._tenants.values())[:-1]:
+                if len(self._tenants) <= self.max_tenants and total <= self.max_bytes:
+                    break
+                if candidate.leases == 0:
+                    del self._tenants[candidate.id]
+                    total -= candidate.bytes
+                    evicted.append(candidate)
+        for candidate in evicted:
+            TENANT_EVICTIONS.inc(candidate.id)
+        return evicted
+
+    @staticmethod
+    def close(tenants: List[Tenant]):
+        """Flush and close evicted tenants' stores"""
+        for tenant in tenants:
+            tenant.store.close()
+
+# ==================== Request context ====================
+
+_current: contextvars.ContextVar[Optional[Tenant]] = contextvars.ContextVar("tenant", default=None)
+
+class TenantLocal:
+    """Stands in for an attribute of the current request's tenant, or for `default` outside one.
+
+    The tenant is a context variable set by TenantMiddleware, so it follows
+    the request into the thread pool; work handed to other threads has to
+    carry the context along (contextvars.copy_context).
+    """
+
+    def __init__(self, attribute: str, default):
+        self._attribute = attribute
+        self._default = default
+
+    def _target(self):
+        tenant = _current.get()
+        return self._default if tenant is None else getattr(tenant, self._attribute)
+
+    def __getattr__(self, name: str):
+        return getattr(self._target(), name)
+
+    def __getitem__(self, key):
+        return self._target()[key]
+
+class TenantMiddleware:
+    """ASGI middleware that leases the request's tenant (X-Tenant header or /tenants/<id> prefix)
+    for as long as the request, including a streamed response, runs"""
+
+    def __init__(self, app, tenants: TenantStores):
+        self.app = app
+        self.tenants = tenants
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        try:
+            tenant_id = _tenant_of(scope)
+        except ValueError as exc:
+            await encoding.ORJSONResponse({"detail": str(exc)}, status_code=400)(scope, receive, send)
+            return
+        if tenant_id is None:
+            await self.app(scope, receive, send)
+            return
+
+        tenant = self.tenants.lookup(tenant_id)
+        if tenant is None:
+            try:
+                tenant = await run_in_threadpool(self.tenants.acquire, tenant_id)
+            except KeyError:
+                await encoding.ORJSONResponse({"detail": "Unknown tenant"}, status_code=404)(scope, receive, send)
+                return
+        token = _current.set(tenant)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+            # The memory estimate waits for collections a long write holds: not on the event loop
+            try:
+                with nonblocking():
+                    evicted = self.tenants.release(tenant)
+            except WouldBlock:
+                evicted = await run_in_threadpool(self.tenants.release, tenant)
+            if evicted:
+                await run_in_threadpool(self.tenants.close, evicted)
+
+def _tenant_of(scope) -> Optional[str]:
+    """The tenant a request names (None if none), moving a tenant path prefix into the root path"""
+    named = None
+    for name, value in scope["headers"]:
+        if name == HEADER:
+            named = value.decode("latin-1")
+            break
+    root_path = scope.get("root_path", "")
+    path = scope["path"][len(root_path):] if scope["path"].startswith(root_path) else scope["path"]
+    if path.startswith(PREFIX):
+        prefixed = path[len(PREFIX):].partition("/")[0]
+        if named is not None and named != prefixed:
+            raise ValueError("X-Tenant header and path prefix name different tenants")
+        named = prefixed
+        # Routing matches the rest of the path, as under a mount point. Set in place so that
+        # outer middleware sees the route the request was matched to.
+        scope["root_path"] = root_path + PREFIX + prefixed
+    if named is not None and not TENANT_ID.fullmatch(named):
+        raise ValueError("Invalid tenant id")
+    return named
@@ -0,0 +1,40 @@
+"""Bulk inserts racing with deletes of the records they reference"""
+
+import os
+import threading
+
+import bulk
+from storage import Store, write_json
+
+def test_referenced_record_cannot_be_deleted_during_a_bulk_insert(tmp_path):
+    data_dir = str(tmp_path / "data")
+    os.makedirs(data_dir)
+    student = {"id": "st1", "name": "Student", "phone": "", "email": "", "hourlyRate": 30, "active": True,
+               "enrolledClasses": [], "createdAt": "2025-01-01T00:00:00"}
+    write_json(os.path.join(data_dir, "students.json"), {"students": [student]})
+    store = Store(data_dir)
+    students = store["students"]
+    get_many = students.get_many
+
+    def get_many_then_race(ids, *args):
+        # Another request deletes the student right after the reference check found it
+        found = get_many(ids, *args)
+        deleting = threading.Thread(target=store.delete, args=("students", "st1"))
+        deleting.start()
+        deleting.join(0.5)
+        racers.append(deleting)
+        return found
+
+    racers = []
+    students.get_many = get_many_then_race
+    payment = {"id": "p1", "studentId": "st1", "amount": 10, "date": "2025-06-01", "notes": "",
+               "createdAt": "2025-06-01T00:00:00"}
+    created, errors = bulk.bulk_insert(store, "payments", [payment], dict, ("id",), lambda: "p2",
+                                       references={"studentId": "students"})
+    for racer in racers:
+        racer.join()
+
+    assert [p["id"] for p in created] == ["p1"] and errors == []
+    # The delete waited for the insert, and took the new payment with the student
+    assert students.get("st1") is None
+    assert store["payments"].all() == []
@@ -0,0 +1,115 @@
+"""Several processes sharing one data directory (Store(shared=True), as with TUITION_WORKERS)"""
+
+import asyncio
+import importlib
+import multiprocessing
+
+import httpx
+import pytest
+
+from storage import Store
+
+pytestmark = pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(),
+                                reason="needs forked worker processes")
+
+WORKERS = 4
+ROUNDS = 50
+
+@pytest.fixture(params=["json", "journal"])
+def open_store(request, tmp_path):
+    data_dir = str(tmp_path)
+    return lambda: Store(data_dir, journal=request.param == "journal", shared=True)
+
+def run(*processes):
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+# ==================== Lost updates ====================
+
+def increment(open_store, worker: int):
+    store = open_store()
+    students, payments = store["students"], store["payments"]
+    for i in range(ROUNDS):
+        # Read-modify-write under the collection lock, which other processes also take
+        with students.lock:
+            counter = students.get("counter")
+            students.update("counter", {"n": counter["n"] + 1})
+        payments.insert({"id": f"w{worker}-{i}", "studentId": "counter", "amount": 1, "date": "2025-01-01"})
+
+def test_no_lost_updates(open_store):
+    store = open_store()
+    store["students"].insert({"id": "counter", "name": "counter", "n": 0})
+    store.flush()
+    fork = multiprocessing.get_context("fork")
+    run(*(fork.Process(target=increment, args=(open_store, worker)) for worker in range(WORKERS)))
+
+    # Seen by a process that was running all along and by one started afresh
+    for reader in (store, open_store()):
+        assert reader["students"].get("counter")["n"] == WORKERS * ROUNDS
+        assert len(reader["payments"]) == WORKERS * ROUNDS
+
+# ==================== Stale reads ====================
+
+def write(open_store, conn, count: int):
+    students = open_store()["students"]
+    for i in range(1, count + 1):
+        students.update("counter", {"n": i})
+        conn.send(i)
+        conn.recv()
+    conn.send(None)
+
+def read(open_store, conn, results):
+    students = open_store()["students"]
+    students.get("counter")
+    seen = []
+    while True:
+        written = conn.recv()
+        if written is None:
+            break
+        seen.append((written, students.get("counter")["n"], students.version))
+        conn.send(True)
+    results.put(seen)
+
+def test_reads_see_other_processes_writes(open_store):
+    store = open_store()
+    store["students"].insert({"id": "counter", "name": "counter", "n": 0})
+    store.flush()
+    fork = multiprocessing.get_context("fork")
+    writer_end, reader_end = fork.Pipe()
+    results = fork.Queue()
+    reader = fork.Process(target=read, args=(open_store, reader_end, results))
+    writer = fork.Process(target=write, args=(open_store, writer_end, ROUNDS))
+    reader.start()
+    writer.start()
+    # Read before joining: a process does not exit while its queue holds unsent data
+    seen = results.get(timeout=60)
+    for process in (reader, writer):
+        process.join(60)
+        assert process.exitcode == 0
+
+    # Each read, made right after the other process's write, returns it
+    assert [n for _, n, _ in seen] == [written for written, _, _ in seen] == list(range(1, ROUNDS + 1))
+    # and the version ETags are built from changes with every write
+    assert len({version for _, _, version in seen}) == ROUNDS
+
+# ==================== Change feed ====================
+
+def test_change_feed_is_refused_with_several_workers(tmp_path, monkeypatch):
+    # Each worker would number only its own changes, under its own epoch
+    monkeypatch.setenv("TUITION_DATA_DIR", str(tmp_path))
+    monkeypatch.setenv("TUITION_WORKERS", "2")
+    import main
+    main = importlib.reload(main)
+    assert main.change_feed is None
+
+    async def get(path: str):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as api:
+            return await api.get(path)
+
+    for path in ("/api/changes", "/api/changes?since=0&wait=1"):
+        assert asyncio.run(get(path)).status_code == 501
+    assert asyncio.run(get("/api/students")).status_code == 200
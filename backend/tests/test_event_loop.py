@@ -0,0 +1,95 @@
+"""Requests served on the event loop while another thread holds a collection's lock"""
+
+import asyncio
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+
+import httpx
+import pytest
+
+STUDENT = {"name": "Student", "phone": "", "email": "", "hourlyRate": 30}
+
+@pytest.fixture
+def open_main(tmp_path, monkeypatch):
+    """Imports main afresh with the given TUITION_ environment, over an empty data directory"""
+    def open_main(**env):
+        monkeypatch.setenv("TUITION_DATA_DIR", str(tmp_path))
+        for name, value in env.items():
+            monkeypatch.setenv(f"TUITION_{name}", value)
+        import main
+        return importlib.reload(main)
+    return open_main
+
+@contextmanager
+def held(lock):
+    """Hold `lock` on another thread, the way a long bulk import does, until the block ends"""
+    taken, done = threading.Event(), threading.Event()
+    def hold():
+        with lock:
+            taken.set()
+            done.wait(5)
+    holder = threading.Thread(target=hold)
+    holder.start()
+    taken.wait()
+    try:
+        yield
+    finally:
+        done.set()
+        holder.join()
+
+def client(main) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test")
+
+def test_requests_stay_fast_while_a_bulk_insert_holds_the_lock(open_main):
+    main = open_main()
+    student = main.store["students"].insert({"id": "s1", "active": True, "enrolledClasses": [], **STUDENT})
+    payments = main.store["payments"]
+    len(payments)
+
+    async def requests():
+        async with client(main) as api:
+            started = time.perf_counter()
+            # Has to wait for the lock, on a thread rather than on the event loop
+            write = asyncio.ensure_future(api.post(
+                "/api/payments", json={"studentId": "s1", "amount": 10, "date": "2025-01-01"}))
+            await asyncio.sleep(0.05)
+            response = await api.get(f"/api/students/{student['id']}")
+            elapsed = time.perf_counter() - started
+            assert response.status_code == 200
+            assert not write.done()
+            return elapsed, write
+
+    async def scenario():
+        with held(payments.lock):
+            elapsed, write = await requests()
+        assert (await write).status_code == 200
+        return elapsed
+
+    assert asyncio.run(scenario()) < 0.5
+    assert len(payments) == 1
+
+def test_tenant_requests_end_while_a_tenant_collection_is_held(open_main, tmp_path):
+    (tmp_path / "tenants" / "t1").mkdir(parents=True)
+    main = open_main(TENANTS="1", TENANTS_DIR=str(tmp_path / "tenants"))
+
+    async def scenario():
+        async with client(main) as api:
+            student = (await api.post("/tenants/t1/api/students", json=STUDENT)).json()
+            assert (await api.get("/tenants/t1/api/payments")).status_code == 200
+            tenant = main.tenant_stores.lookup("t1")
+            main.tenant_stores.release(tenant)
+            # The tenant's request ends by estimating its memory, which reads every loaded collection
+            with held(tenant.store["payments"].lock):
+                started = time.perf_counter()
+                ending = asyncio.ensure_future(api.get(f"/tenants/t1/api/students/{student['id']}"))
+                await asyncio.sleep(0.05)
+                # Another request, served meanwhile
+                response = await api.get("/api/students/missing")
+                elapsed = time.perf_counter() - started
+                assert response.status_code == 404
+            assert (await ending).status_code == 200
+            return elapsed
+
+    assert asyncio.run(scenario()) < 0.5
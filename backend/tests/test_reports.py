@@ -0,0 +1,201 @@
+"""Payroll and balances against the original nested-loop implementations, on random data"""
+
+import os
+import random
+
+import pytest
+
+from sqlite_store import SQLiteStore, import_json
+from storage import Store, write_json
+
+SEEDS = range(5)
+
+# ==================== Original implementations ====================
+
+def baseline_payroll(data: dict, start_date: str, end_date: str) -> dict:
+    """get_payroll_report as first written: attendance rescanned for every session"""
+    sessions = [
+        s for s in data["sessions"]
+        if start_date <= s["date"] <= end_date
+    ]
+    student_rates = {s["id"]: s["hourlyRate"] for s in data["students"]}
+    student_names = {s["id"]: s["name"] for s in data["students"]}
+    student_hours = {}
+    for session in sessions:
+        session_attendance = [
+            a for a in data["attendance"]
+            if a["sessionId"] == session["id"] and a["status"] in ["present", "late"]
+        ]
+        for att in session_attendance:
+            student_id = att["studentId"]
+            if student_id not in student_hours:
+                student_hours[student_id] = 0
+            student_hours[student_id] += session["hoursWorked"]
+    report = []
+    total_hours = 0
+    total_earnings = 0
+    for student_id, hours in student_hours.items():
+        rate = student_rates.get(student_id, 0)
+        earnings = hours * rate
+        report.append({
+            "studentId": student_id,
+            "studentName": student_names.get(student_id, "Unknown"),
+            "hours": hours,
+            "hourlyRate": rate,
+            "earnings": earnings
+        })
+        total_hours += hours
+        total_earnings += earnings
+    return {
+        "startDate": start_date,
+        "endDate": end_date,
+        "students": report,
+        "totalHours": total_hours,
+        "totalEarnings": total_earnings
+    }
+
+def baseline_balance(data: dict, student_id: str) -> dict:
+    """get_student_balance as first written: a next() over attendance for every session"""
+    student = next(s for s in data["students"] if s["id"] == student_id)
+    total_hours = 0
+    for session in data["sessions"]:
+        attendance = next(
+            (a for a in data["attendance"]
+             if a["sessionId"] == session["id"] and a["studentId"] == student_id and a["status"] in ["present", "late"]),
+            None
+        )
+        if attendance:
+            total_hours += session["hoursWorked"]
+    total_due = total_hours * student["hourlyRate"]
+    total_paid = sum(
+        p["amount"] for p in data["payments"]
+        if p["studentId"] == student_id
+    )
+    return {
+        "studentId": student_id,
+        "studentName": student["name"],
+        "hourlyRate": student["hourlyRate"],
+        "totalHours": total_hours,
+        "totalDue": total_due,
+        "totalPaid": total_paid,
+        "balance": total_due - total_paid
+    }
+
+# ==================== Data ====================
+
+def random_data(seed: int) -> dict:
+    rng = random.Random(seed)
+    created = "2025-01-01T00:00:00"
+    students = [
+        {"id": f"st{i}", "name": f"Student {i}", "phone": "", "email": "",
+         "hourlyRate": rng.choice([25, 30.5, 37.5, 41.6, 0.1]), "active": True,
+         "enrolledClasses": [], "createdAt": created}
+        for i in range(rng.randint(5, 30))
+    ]
+    classes = [
+        {"id": f"c{i}", "name": f"Class {i}", "dayOfWeek": "Monday", "startTime": "16:00",
+         "endTime": "17:30", "studentIds": [], "createdAt": created}
+        for i in range(rng.randint(1, 5))
+    ]
+    sessions = []
+    for i in range(rng.randint(20, 150)):
+        day = f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        # A few dates that are not YYYY-MM-DD, which string comparison still ranges over
+        if rng.random() < 0.05:
+            day = rng.choice([day.replace("-0", "-"), day + "T10:00", "2025-13-01"])
+        sessions.append({"id": f"se{i}", "classId": rng.choice(classes)["id"], "date": day,
+                         "startTime": "16:00", "endTime": "17:30",
+                         "hoursWorked": rng.choice([1, 1.5, 0.1, 0.7, 1.3, 2.2, 0.33]), "createdAt": created})
+    attendance = []
+    for session in sessions:
+        for student in rng.sample(students, rng.randint(0, len(students))):
+            attendance.append({"id": f"a{len(attendance)}", "sessionId": session["id"],
+                               "studentId": student["id"],
+                               "status": rng.choice(["present", "late", "absent"]), "createdAt": created})
+    # Collection order is creation order, not date or session order
+    rng.shuffle(attendance)
+    payments = [
+        {"id": f"p{i}", "studentId": rng.choice(students)["id"], "amount": rng.choice([10, 12.3, 0.1, 99.99]),
+         "date": f"2025-{rng.randint(1, 12):02d}-01", "notes": "", "createdAt": created}
+        for i in range(rng.randint(0, 100))
+    ]
+    return {"students": students, "classes": classes, "sessions": sessions,
+            "attendance": attendance, "payments": payments}
+
+def random_ranges(seed: int):
+    rng = random.Random(seed)
+    ranges = [("0000", "9999"), ("2025-03-01", "2025-03-31"), ("2025-12-01", "2025-01-01")]
+    for _ in range(10):
+        ranges.append(tuple(sorted(f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}" for _ in range(2))))
+    return ranges
+
+@pytest.fixture(params=["json", "journal", "sqlite"])
+def backend(request, tmp_path):
+    """Opens a store of the parametrized kind over `data` written as JSON files"""
+    def open_store(data: dict):
+        data_dir = str(tmp_path / "data")
+        os.makedirs(data_dir)
+        for name, records in data.items():
+            write_json(os.path.join(data_dir, f"{name}.json"), {name: records})
+        if request.param == "sqlite":
+            db_path = str(tmp_path / "tuition.db")
+            import_json(data_dir, db_path)
+            return SQLiteStore(db_path)
+        return Store(data_dir, journal=request.param == "journal")
+    return open_store
+
+# ==================== Tests ====================
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_payroll_matches_nested_loops(backend, seed):
+    data = random_data(seed)
+    store = backend(data)
+    for start_date, end_date in random_ranges(seed):
+        assert store.payroll_report(start_date, end_date) == baseline_payroll(data, start_date, end_date)
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_student_balance_matches_nested_loops(backend, seed):
+    data = random_data(seed)
+    store = backend(data)
+    for student in data["students"]:
+        assert store.student_balance(student["id"]) == baseline_balance(data, student["id"])
+    assert store.student_balance("missing") is None
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_payroll_follows_changes(backend, seed):
+    data = random_data(seed)
+    store = backend(data)
+    rng = random.Random(seed)
+    for _ in range(20):
+        session = rng.choice(data["sessions"])
+        session["hoursWorked"] = rng.choice([0.2, 1.1, 2.5])
+        store.update("sessions", session["id"], {"hoursWorked": session["hoursWorked"]})
+        record = rng.choice(data["attendance"])
+        record["status"] = rng.choice(["present", "late", "absent"])
+        store.update("attendance", record["id"], {"status": record["status"]})
+    for start_date, end_date in random_ranges(seed):
+        assert store.payroll_report(start_date, end_date) == baseline_payroll(data, start_date, end_date)
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_bulk_balances_match_single(backend, seed):
+    data = random_data(seed)
+    store = backend(data)
+    rng = random.Random(seed)
+    for step in range(4):
+        balances = {b["studentId"]: b for b in store.all_balances()}
+        assert list(balances) == [s["id"] for s in data["students"]]
+        for student in data["students"]:
+            assert balances[student["id"]] == store.student_balance(student["id"])
+        # Changes between calls, so the bulk balances are partly kept and partly added up again
+        for i in range(5):
+            session = rng.choice(data["sessions"])
+            store.update("sessions", session["id"], {"hoursWorked": rng.choice([0.2, 1.1, 2.5])})
+            record = rng.choice(data["attendance"])
+            store.update("attendance", record["id"], {"status": rng.choice(["present", "late", "absent"])})
+            student = rng.choice(data["students"])
+            store.update("students", student["id"], {"hourlyRate": rng.choice([20, 33.3])})
+            store.insert("payments", {"id": f"p-{step}-{i}", "studentId": student["id"], "amount": 0.7,
+                                      "date": "2025-06-01", "notes": "", "createdAt": "2025-06-01T00:00:00"})
+        if data["payments"]:
+            store.delete("payments", data["payments"].pop()["id"])
+    assert store.check_balances()["consistent"]
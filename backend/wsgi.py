@@ -15,6 +15,8 @@ from main import app
 # PythonAnywhere uses WSGI, so we need to wrap FastAPI with an ASGI-to-WSGI adapter
 # However, PythonAnywhere now supports ASGI natively for FastAPI
 # Just export the app for the ASGI configuration
+# If the server runs more than one worker process, set TUITION_WORKERS to that
+# number so the workers lock and reload the data files for each other
 
 application = app
 